@@ -0,0 +1,214 @@
+"""
+Dispatch access checks: may a user act on a dispatch as its creator or as
+one of its assignees?
+
+Handlers ask before loading the dispatch. The answer comes from one
+indexed query (the dispatch's primary key plus an EXISTS on the
+(dispatch_id, assignee_id) primary key of the assignee links), so a 403
+costs no more than that and an allowed request never loads
+`assignee_links` just to test membership.
+
+Answers are cached per worker in a small LRU for ACCESS_CACHE_TTL_SECONDS.
+A commit that changes a dispatch's assignees (or deletes it) drops its
+entries in this worker; other workers pick the change up when their entry
+expires. Writes therefore skip the cache (`cached=False`) and check again
+against the dispatch they loaded for the versioned write (`verify`).
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from itertools import chain
+from typing import Dict, Iterable, List, NamedTuple, Optional, Set, Tuple
+
+from fastapi import HTTPException
+from sqlalchemy import event, exists, inspect, select
+from sqlmodel import Session
+
+from . import models
+from .config import settings
+from .database import session_shard
+
+CREATOR, ASSIGNEE = "creator", "assignee"
+
+_CHANGED_KEY = "access_changed"
+
+dispatches = models.Dispatch.__table__
+assignee_links = models.DispatchAssigneeLink.__table__
+
+
+class Relation(NamedTuple):
+    """What a user is to an existing dispatch."""
+
+    is_creator: bool
+    is_assignee: bool
+
+    def allows(self, roles: Iterable[str]) -> bool:
+        return (CREATOR in roles and self.is_creator) or (
+            ASSIGNEE in roles and self.is_assignee
+        )
+
+
+# (shard, dispatch_id, user_id)
+CacheKey = Tuple[str, int, int]
+
+
+class RelationCache:
+    """
+    Bounded LRU of relations with a TTL. Lookups record the invalidation
+    epoch first and only store their result if no invalidation happened
+    meanwhile, so a query racing a commit cannot cache the old answer.
+    """
+
+    def __init__(self):
+        self._entries: "OrderedDict[CacheKey, Tuple[Relation, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.epoch = 0
+
+    def get(self, key: CacheKey) -> Optional[Relation]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[1] < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    def put(self, entries: Dict[CacheKey, Relation], epoch: int):
+        ttl = settings.ACCESS_CACHE_TTL_SECONDS
+        if ttl <= 0:
+            return
+        expires_at = time.monotonic() + ttl
+        with self._lock:
+            if epoch != self.epoch:
+                return
+            for key, relation in entries.items():
+                self._entries[key] = (relation, expires_at)
+                self._entries.move_to_end(key)
+            while len(self._entries) > settings.ACCESS_CACHE_MAX_SIZE:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, shard: str, dispatch_ids: Set[int]):
+        with self._lock:
+            self.epoch += 1
+            for key in [
+                k for k in self._entries if k[0] == shard and k[1] in dispatch_ids
+            ]:
+                del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self.epoch += 1
+            self._entries.clear()
+
+
+cache = RelationCache()
+
+
+def relations(
+    session: Session, dispatch_ids: List[int], user_id: int, cached: bool = True
+) -> Dict[int, Relation]:
+    """
+    The user's relation to each of the dispatches, in one query for those
+    not cached (all of them unless `cached`). Dispatches that do not exist
+    are left out.
+    """
+    shard = session_shard(session)
+    result: Dict[int, Relation] = {}
+    missing = []
+    for dispatch_id in dispatch_ids:
+        relation = cache.get((shard, dispatch_id, user_id)) if cached else None
+        if relation is None:
+            missing.append(dispatch_id)
+        else:
+            result[dispatch_id] = relation
+    if not missing:
+        return result
+
+    epoch = cache.epoch
+    is_assignee = exists().where(
+        assignee_links.c.dispatch_id == dispatches.c.id,
+        assignee_links.c.assignee_id == user_id,
+    )
+    rows = session.exec(
+        select(dispatches.c.id, dispatches.c.creator_id, is_assignee).where(
+            dispatches.c.id.in_(missing)
+        )
+    ).all()
+    fetched = {
+        dispatch_id: Relation(creator_id == user_id, bool(assigned))
+        for dispatch_id, creator_id, assigned in rows
+    }
+    cache.put({(shard, i, user_id): r for i, r in fetched.items()}, epoch)
+    result.update(fetched)
+    return result
+
+
+def authorize(
+    session: Session,
+    dispatch_id: int,
+    user: models.User,
+    roles: Iterable[str] = (CREATOR, ASSIGNEE),
+    detail: str = "Not authorized to access this dispatch",
+    cached: bool = True,
+) -> bool:
+    """
+    Raises 403 unless the user is an admin or holds one of `roles` on the
+    dispatch. Returns False when the dispatch does not exist (the caller
+    answers 404 or looks in the archive).
+    """
+    relation = relations(session, [dispatch_id], user.id, cached).get(dispatch_id)
+    if relation is None:
+        return False
+    if not user.is_admin and not relation.allows(roles):
+        raise HTTPException(status_code=403, detail=detail)
+    return True
+
+
+def verify(
+    dispatch: models.Dispatch,
+    user: models.User,
+    roles: Iterable[str],
+    detail: str = "Not authorized to access this dispatch",
+):
+    """`authorize` against a loaded dispatch, e.g. inside a versioned write."""
+    relation = Relation(
+        dispatch.creator_id == user.id,
+        any(link.assignee_id == user.id for link in dispatch.assignee_links),
+    )
+    if not user.is_admin and not relation.allows(roles):
+        raise HTTPException(status_code=403, detail=detail)
+
+
+# --- Invalidation: only committed assignment changes drop entries ---
+
+
+@event.listens_for(Session, "after_flush")
+def _collect_changed_dispatches(session, flush_context):
+    changed = set()
+    for obj in chain(session.new, session.deleted):
+        if isinstance(obj, models.DispatchAssigneeLink):
+            changed.add(obj.dispatch_id)
+    for obj in chain(session.dirty, session.deleted):
+        # Replacing `assignee_links` orphans the old links during the flush.
+        if isinstance(obj, models.Dispatch) and (
+            obj in session.deleted
+            or inspect(obj).attrs.assignee_links.history.has_changes()
+        ):
+            changed.add(obj.id)
+    if changed:
+        session.info.setdefault(_CHANGED_KEY, set()).update(changed)
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_changed_dispatches(session):
+    changed = session.info.pop(_CHANGED_KEY, None)
+    if changed:
+        cache.invalidate(session_shard(session), changed)
+
+
+@event.listens_for(Session, "after_soft_rollback")
+def _discard_changed_dispatches(session, previous_transaction):
+    session.info.pop(_CHANGED_KEY, None)
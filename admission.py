@@ -0,0 +1,204 @@
+import asyncio
+import json
+import logging
+import time
+from collections import deque
+from typing import Deque, Dict, List
+
+from .config import settings
+
+logger = logging.getLogger(__name__)
+
+# Route classes in priority order: when capacity frees up, queued writes
+# are admitted before reads, and reads before expensive reads.
+CLASSES = ["write", "read", "expensive"]
+
+WRITE_METHODS = {"POST", "PUT", "PATCH", "DELETE"}
+
+
+def classify(method: str, path: str) -> str:
+    """Route class of a request, or "bypass" for probes that are never queued."""
+    if path in settings.ADMISSION_BYPASS_PATHS:
+        return "bypass"
+    if method in WRITE_METHODS:
+        return "write"
+    if any(path.startswith(p) for p in settings.ADMISSION_EXPENSIVE_PATHS):
+        return "expensive"
+    return "read"
+
+
+class ClassStats:
+    def __init__(self):
+        self.in_flight = 0
+        self.admitted = 0
+        self.queued = 0
+        self.rejected_queue_full = 0
+        self.rejected_timeout = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+
+
+class Rejected(Exception):
+    def __init__(self, reason: str):
+        self.reason = reason
+
+
+class AdmissionController:
+    """
+    Bounds concurrent requests per route class and in total. Requests over
+    the limit wait in a per-class FIFO queue for at most the class's max
+    wait; a full queue or an expired wait is rejected. All state lives on
+    the event loop, so no locking is needed.
+    """
+
+    def __init__(self):
+        self.stats: Dict[str, ClassStats] = {c: ClassStats() for c in CLASSES}
+        self._waiters: Dict[str, Deque[asyncio.Future]] = {c: deque() for c in CLASSES}
+        self._in_flight_total = 0
+
+    def _has_capacity(self, cls: str) -> bool:
+        return (
+            self._in_flight_total < settings.ADMISSION_MAX_CONCURRENCY
+            and self.stats[cls].in_flight < settings.ADMISSION_LIMITS[cls]
+        )
+
+    def _admit(self, cls: str):
+        self._in_flight_total += 1
+        self.stats[cls].in_flight += 1
+        self.stats[cls].admitted += 1
+
+    def _waiting_ahead(self, cls: str) -> bool:
+        # Someone of the same or a higher priority is queued for the shared
+        # capacity (rather than for their own class limit).
+        return any(
+            self._waiters[other]
+            and self.stats[other].in_flight < settings.ADMISSION_LIMITS[other]
+            for other in CLASSES[: CLASSES.index(cls) + 1]
+        )
+
+    async def acquire(self, cls: str):
+        stats = self.stats[cls]
+        if self._has_capacity(cls) and not self._waiting_ahead(cls):
+            self._admit(cls)
+            return
+        waiters = self._waiters[cls]
+        if len(waiters) >= settings.ADMISSION_QUEUE_SIZES[cls]:
+            stats.rejected_queue_full += 1
+            raise Rejected("queue full")
+
+        future = asyncio.get_running_loop().create_future()
+        waiters.append(future)
+        stats.queued += 1
+        started = time.monotonic()
+        try:
+            await asyncio.wait(
+                {future}, timeout=settings.ADMISSION_MAX_WAIT_MS[cls] / 1000
+            )
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                self.release(cls)  # admitted just as the client went away
+            raise
+        finally:
+            if not future.done():
+                waiters.remove(future)
+                future.cancel()
+        waited = time.monotonic() - started
+        stats.wait_seconds_total += waited
+        stats.wait_seconds_max = max(stats.wait_seconds_max, waited)
+        if future.cancelled():
+            stats.rejected_timeout += 1
+            raise Rejected("queue timeout")
+
+    def release(self, cls: str):
+        self._in_flight_total -= 1
+        self.stats[cls].in_flight -= 1
+        # Hand freed capacity to waiters, highest priority class first.
+        for waiting_cls in CLASSES:
+            waiters = self._waiters[waiting_cls]
+            while waiters and self._has_capacity(waiting_cls):
+                self._admit(waiting_cls)
+                waiters.popleft().set_result(None)
+
+    def snapshot(self) -> Dict[str, dict]:
+        return {
+            cls: dict(vars(stats), waiting=len(self._waiters[cls]))
+            for cls, stats in self.stats.items()
+        }
+
+    def prometheus(self) -> str:
+        """Metrics in the Prometheus text exposition format."""
+        lines: List[str] = []
+        metrics = [
+            ("in_flight", "gauge", "Requests currently being served"),
+            ("waiting", "gauge", "Requests currently queued"),
+            ("admitted", "counter", "Requests admitted"),
+            ("queued", "counter", "Requests that had to queue"),
+            ("rejected_queue_full", "counter", "Requests rejected, queue full"),
+            ("rejected_timeout", "counter", "Requests rejected, max wait exceeded"),
+            ("wait_seconds_total", "counter", "Total time spent queued"),
+            ("wait_seconds_max", "gauge", "Longest time spent queued"),
+        ]
+        snapshot = self.snapshot()
+        for name, kind, help_text in metrics:
+            full_name = f"hpc_dispatch_admission_{name}"
+            lines.append(f"# HELP {full_name} {help_text}")
+            lines.append(f"# TYPE {full_name} {kind}")
+            for cls, values in snapshot.items():
+                lines.append(f'{full_name}{{class="{cls}"}} {values[name]}')
+        lines.append("# HELP hpc_dispatch_admission_capacity Concurrency limits")
+        lines.append("# TYPE hpc_dispatch_admission_capacity gauge")
+        for cls in CLASSES:
+            limit = settings.ADMISSION_LIMITS[cls]
+            lines.append(f'hpc_dispatch_admission_capacity{{class="{cls}"}} {limit}')
+        total = settings.ADMISSION_MAX_CONCURRENCY
+        lines.append(f'hpc_dispatch_admission_capacity{{class="total"}} {total}')
+        return "\n".join(lines) + "\n"
+
+
+controller = AdmissionController()
+
+
+class AdmissionMiddleware:
+    """
+    Pure ASGI middleware applying the admission controller, so overload
+    is answered with an immediate 503 instead of piling requests up in the
+    threadpool until they all time out together.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        cls = classify(scope["method"], scope["path"])
+        if cls == "bypass":
+            await self.app(scope, receive, send)
+            return
+        try:
+            await controller.acquire(cls)
+        except Rejected as e:
+            logger.warning(f"Shed {scope['method']} {scope['path']}: {e.reason}")
+            await _send_unavailable(send, f"Service overloaded ({e.reason}).")
+            return
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            controller.release(cls)
+
+
+async def _send_unavailable(send, detail: str):
+    body = json.dumps({"detail": detail}).encode()
+    await send(
+        {
+            "type": "http.response.start",
+            "status": 503,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode()),
+                (b"retry-after", b"1"),
+            ],
+        }
+    )
+    await send({"type": "http.response.body", "body": body})
@@ -0,0 +1,387 @@
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+from fastapi import Depends
+from sqlalchemy import Column, DateTime, Index, MetaData, Table, delete, func, insert
+from sqlalchemy import select
+from sqlalchemy.engine import Engine
+from sqlmodel import Session, create_engine
+
+from . import access, models, schemas
+from .config import settings
+from .database import engine, ensure_schema, get_current_shard, shard_engines
+
+logger = logging.getLogger(__name__)
+
+CLOSED_STATUSES = [models.DispatchStatus.COMPLETED, models.DispatchStatus.REJECTED]
+
+# Archive tables live in their own metadata so they can be created in a
+# separate database file. They mirror the live columns but carry no foreign
+# keys, and child tables keep the original `id` as a plain column: SQLite
+# may hand out a deleted id again, which must not collide in the archive.
+archive_metadata = MetaData()
+
+
+def _archive_table(source: Table, keep_primary_key: bool, indexes: List[str]) -> Table:
+    columns = [
+        Column(
+            c.name,
+            c.type,
+            primary_key=keep_primary_key and c.primary_key,
+            nullable=c.nullable,
+        )
+        for c in source.columns
+    ]
+    table = Table(f"archived_{source.name}", archive_metadata, *columns)
+    for name in indexes:
+        Index(f"ix_archived_{source.name}_{name}", table.c[name])
+    return table
+
+
+archived_dispatch = _archive_table(
+    models.Dispatch.__table__, True, ["creator_id", "status", "created_at"]
+)
+archived_dispatch.append_column(Column("archived_at", DateTime, nullable=False))
+archived_assignee_link = _archive_table(
+    models.DispatchAssigneeLink.__table__, True, ["assignee_id"]
+)
+archived_shelf_link = _archive_table(
+    models.DispatchShelfLink.__table__, True, ["shelf_id"]
+)
+archived_file = _archive_table(models.DispatchFile.__table__, False, ["dispatch_id"])
+archived_history = _archive_table(
+    models.DispatchHistory.__table__, False, ["dispatch_id"]
+)
+archived_comment = _archive_table(models.Comment.__table__, False, ["dispatch_id"])
+
+# Sub-resource name -> (archive table, model used to read it back).
+ARCHIVED_ENTRIES: Dict[str, Tuple[Table, type]] = {
+    "history": (archived_history, models.DispatchHistory),
+    "comments": (archived_comment, models.Comment),
+}
+
+# Live table -> archive table, children before parents (delete order).
+ARCHIVED_TABLES: Dict[Table, Table] = {
+    models.DispatchAssigneeLink.__table__: archived_assignee_link,
+    models.DispatchShelfLink.__table__: archived_shelf_link,
+    models.DispatchFile.__table__: archived_file,
+    models.DispatchHistory.__table__: archived_history,
+    models.Comment.__table__: archived_comment,
+}
+
+archive_engine = (
+    create_engine(settings.ARCHIVE_DATABASE_URL, echo=False)
+    if settings.ARCHIVE_DATABASE_URL
+    else engine
+)
+
+
+def engine_for(live_engine: Engine) -> Engine:
+    """
+    The archive of a shard's live database. ARCHIVE_DATABASE_URL only moves
+    the default shard's archive; other shards keep theirs alongside.
+    """
+    return archive_engine if live_engine is engine else live_engine
+
+
+def create_archive_tables():
+    """Creates the archive tables (in the archive database, if separate)."""
+    for live_engine in shard_engines.values():
+        ensure_schema(archive_metadata, engine_for(live_engine), "archive")
+
+
+def get_archive_session(shard: str = Depends(get_current_shard)):
+    """Dependency to get a session on the archive of the caller's shard."""
+    with Session(engine_for(shard_engines[shard])) as session:
+        yield session
+
+
+# --- Archiving job ---
+
+
+def _select_candidates(conn, cutoff: datetime, batch_size: int) -> List[int]:
+    dispatch = models.Dispatch.__table__
+    history = models.DispatchHistory.__table__
+    recent_activity = (
+        select(history.c.id)
+        .where(history.c.dispatch_id == dispatch.c.id, history.c.timestamp >= cutoff)
+        .exists()
+    )
+    # Never archive the newest row, so SQLite cannot reuse its id.
+    newest_id = select(func.max(dispatch.c.id)).scalar_subquery()
+    statement = (
+        select(dispatch.c.id)
+        .where(
+            dispatch.c.status.in_(CLOSED_STATUSES),
+            dispatch.c.created_at < cutoff,
+            ~recent_activity,
+            dispatch.c.id != newest_id,
+        )
+        .order_by(dispatch.c.id)
+        .limit(batch_size)
+    )
+    return list(conn.execute(statement).scalars())
+
+
+def _copy_batch(source_conn, archive_conn, ids: List[int], archived_at: datetime):
+    dispatch = models.Dispatch.__table__
+    rows = source_conn.execute(select(dispatch).where(dispatch.c.id.in_(ids)))
+    dispatch_rows = [dict(r, archived_at=archived_at) for r in rows.mappings()]
+    # Clear any leftovers of an interrupted earlier run so re-runs are safe.
+    archive_conn.execute(
+        delete(archived_dispatch).where(archived_dispatch.c.id.in_(ids))
+    )
+    archive_conn.execute(insert(archived_dispatch), dispatch_rows)
+    for live, archived in ARCHIVED_TABLES.items():
+        archive_conn.execute(delete(archived).where(archived.c.dispatch_id.in_(ids)))
+        rows = source_conn.execute(select(live).where(live.c.dispatch_id.in_(ids)))
+        child_rows = [dict(r) for r in rows.mappings()]
+        if child_rows:
+            archive_conn.execute(insert(archived), child_rows)
+
+
+def _delete_batch(conn, ids: List[int]):
+    for live in ARCHIVED_TABLES:
+        conn.execute(delete(live).where(live.c.dispatch_id.in_(ids)))
+    # Archived dispatches leave the live listings.
+    inbox = models.DispatchInbox.__table__
+    conn.execute(delete(inbox).where(inbox.c.dispatch_id.in_(ids)))
+    dispatch = models.Dispatch.__table__
+    conn.execute(delete(dispatch).where(dispatch.c.id.in_(ids)))
+
+
+def archive_closed_dispatches(
+    older_than_days: Optional[int] = None, batch_size: Optional[int] = None
+) -> int:
+    """
+    Moves COMPLETED/REJECTED dispatches with no activity in the last
+    `older_than_days` days, with all their child rows, into the archive
+    tables in batches. Returns the number of dispatches archived.
+    """
+    older_than_days = older_than_days or settings.ARCHIVE_AFTER_DAYS
+    batch_size = batch_size or settings.ARCHIVE_BATCH_SIZE
+    cutoff = datetime.utcnow() - timedelta(days=older_than_days)
+    return sum(_archive_shard(shard, cutoff, batch_size) for shard in shard_engines)
+
+
+def _archive_shard(shard: str, cutoff: datetime, batch_size: int) -> int:
+    live_engine = shard_engines[shard]
+    target = engine_for(live_engine)
+    total = 0
+    while True:
+        archived_at = datetime.utcnow()
+        if target is live_engine:
+            with live_engine.begin() as conn:
+                ids = _select_candidates(conn, cutoff, batch_size)
+                if ids:
+                    _copy_batch(conn, conn, ids, archived_at)
+                    _delete_batch(conn, ids)
+        else:
+            # Two databases: commit the archive copy first, then delete the
+            # live rows. A crash in between only leaves a copy that the next
+            # run overwrites.
+            with live_engine.connect() as conn:
+                ids = _select_candidates(conn, cutoff, batch_size)
+                if ids:
+                    with target.begin() as archive_conn:
+                        _copy_batch(conn, archive_conn, ids, archived_at)
+            if ids:
+                with live_engine.begin() as conn:
+                    _delete_batch(conn, ids)
+        if not ids:
+            break
+        # Cached access checks would still find the live rows.
+        access.cache.invalidate(shard, set(ids))
+        total += len(ids)
+        logger.info(f"Archived {len(ids)} dispatches ({total} so far)")
+    return total
+
+
+async def run_periodically():
+    """Background task running the archiving job every ARCHIVE_INTERVAL_SECONDS."""
+    while True:
+        await asyncio.sleep(settings.ARCHIVE_INTERVAL_SECONDS)
+        try:
+            await asyncio.to_thread(archive_closed_dispatches)
+        except Exception:
+            logger.exception("Archiving run failed")
+
+
+# --- Read access ---
+
+
+def list_archived_dispatches(
+    session: Session,
+    *,
+    visible_to: Optional[int] = None,
+    direction: Optional[str] = None,
+    assignee_id: Optional[int] = None,
+    creator_id: Optional[int] = None,
+    shelf_id: Optional[int] = None,
+    status: Optional[models.DispatchStatus] = None,
+    search: Optional[str] = None,
+    sort_by: str = "created_at",
+    sort_dir: str = "desc",
+    limit: int = 100,
+) -> Tuple[int, List[schemas.DispatchRead]]:
+    """
+    Mirrors the live listing filters on the archive tables. Returns the total
+    match count and the first `limit` items in the requested order.
+    """
+    d = archived_dispatch.c
+    links = archived_assignee_link.c
+    statement = select(archived_dispatch)
+
+    if shelf_id:
+        shelf_links = select(archived_shelf_link.c.dispatch_id).where(
+            archived_shelf_link.c.shelf_id == shelf_id
+        )
+        statement = statement.where(d.id.in_(shelf_links))
+    if direction == "incoming" or assignee_id:
+        assigned = select(links.dispatch_id).where(
+            links.assignee_id == (assignee_id or visible_to)
+        )
+        statement = statement.where(d.id.in_(assigned))
+    elif direction == "outgoing":
+        statement = statement.where(d.creator_id == visible_to)
+    elif visible_to is not None and not shelf_id:
+        assigned = select(links.dispatch_id).where(links.assignee_id == visible_to)
+        statement = statement.where((d.creator_id == visible_to) | (d.id.in_(assigned)))
+    if creator_id:
+        statement = statement.where(d.creator_id == creator_id)
+    if status:
+        statement = statement.where(d.status == status)
+    if search:
+        statement = statement.where(
+            d.title.contains(search) | d.content.contains(search)
+        )
+
+    total = session.exec(
+        select(func.count()).select_from(statement.subquery())
+    ).scalar_one()
+    if total == 0 or limit <= 0:
+        return total, []
+
+    sort_column = d.get(sort_by, d.created_at)
+    statement = statement.order_by(
+        sort_column.desc() if sort_dir == "desc" else sort_column.asc()
+    )
+    rows = session.exec(statement.limit(limit)).mappings().all()
+    assignees = _assignee_ids_by_dispatch(session, [r["id"] for r in rows])
+    return total, [_to_read_model(r, assignees.get(r["id"], [])) for r in rows]
+
+
+def get_archived_dispatch_details(
+    session: Session, live_session: Session, dispatch_id: int
+) -> Optional[schemas.DispatchReadWithDetails]:
+    """Rebuilds the detail view of an archived dispatch, or None."""
+    row = (
+        session.exec(
+            select(archived_dispatch).where(archived_dispatch.c.id == dispatch_id)
+        )
+        .mappings()
+        .first()
+    )
+    if row is None:
+        return None
+
+    def children(table: Table, model):
+        rows = session.exec(
+            select(table).where(table.c.dispatch_id == dispatch_id).order_by(table.c.id)
+        ).mappings()
+        return [model.model_validate(dict(r)) for r in rows]
+
+    shelf_ids = (
+        session.exec(
+            select(archived_shelf_link.c.shelf_id).where(
+                archived_shelf_link.c.dispatch_id == dispatch_id
+            )
+        )
+        .scalars()
+        .all()
+    )
+    shelves = (
+        live_session.exec(select(models.Shelf).where(models.Shelf.id.in_(shelf_ids)))
+        .scalars()
+        .all()
+        if shelf_ids
+        else []
+    )
+    base = _to_read_model(
+        row, _assignee_ids_by_dispatch(session, [dispatch_id]).get(dispatch_id, [])
+    )
+    return schemas.DispatchReadWithDetails(
+        **base.model_dump(),
+        files=children(archived_file, models.DispatchFile),
+        history=children(archived_history, models.DispatchHistory),
+        comments=children(archived_comment, models.Comment),
+        shelves=[schemas.ShelfRead.model_validate(s) for s in shelves],
+    )
+
+
+def get_archived_participants(
+    session: Session, dispatch_id: int
+) -> Optional[Tuple[int, List[int]]]:
+    """Returns (creator_id, assignee_ids) of an archived dispatch, or None."""
+    creator_id = session.exec(
+        select(archived_dispatch.c.creator_id).where(
+            archived_dispatch.c.id == dispatch_id
+        )
+    ).scalar_one_or_none()
+    if creator_id is None:
+        return None
+    assignees = _assignee_ids_by_dispatch(session, [dispatch_id])
+    return creator_id, assignees.get(dispatch_id, [])
+
+
+def select_archived_entries(name: str, dispatch_id: int):
+    """Statement selecting an archived dispatch's history or comments rows."""
+    table, _ = ARCHIVED_ENTRIES[name]
+    return select(table).where(table.c.dispatch_id == dispatch_id)
+
+
+def _assignee_ids_by_dispatch(session: Session, ids: List[int]) -> Dict[int, List[int]]:
+    result: Dict[int, List[int]] = {}
+    if not ids:
+        return result
+    links = archived_assignee_link.c
+    for dispatch_id, assignee_id in session.exec(
+        select(links.dispatch_id, links.assignee_id).where(links.dispatch_id.in_(ids))
+    ):
+        result.setdefault(dispatch_id, []).append(assignee_id)
+    return result
+
+
+def _to_read_model(row, assignee_ids: List[int]) -> schemas.DispatchRead:
+    return schemas.DispatchRead(
+        id=row["id"],
+        title=row["title"],
+        content=row["content"],
+        status=row["status"],
+        created_at=row["created_at"],
+        creator_id=row["creator_id"],
+        assignee_ids=assignee_ids,
+        version=row["version"],
+        scheduled_at=row["scheduled_at"],
+        due_at=row["due_at"],
+        overdue_at=row["overdue_at"],
+        archived=True,
+    )
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        prog="python -m hpc_dispatch.archive",
+        description="Move old COMPLETED/REJECTED dispatches into the archive.",
+    )
+    parser.add_argument("--older-than-days", type=int, default=None)
+    parser.add_argument("--batch-size", type=int, default=None)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    create_archive_tables()
+    count = archive_closed_dispatches(args.older_than_days, args.batch_size)
+    print(f"Archived {count} dispatches.")
@@ -0,0 +1,319 @@
+"""
+Attachment metadata: the size, MIME type and ETag of each DispatchFile,
+fetched with HEAD requests through the shared HTTP client and stored on the
+row, so clients no longer have to HEAD every file themselves.
+
+New files are enriched in the background right after their dispatch is
+created; a periodic pass re-checks metadata older than
+FILE_METADATA_MAX_AGE_HOURS with a conditional request (If-None-Match), so
+unchanged files cost a 304 and no body.
+
+Only hosts in FILE_METADATA_ALLOWED_HOSTS are contacted (none when the list
+is empty), and only at public addresses: each hop is resolved here, checked,
+and connected to by address, with redirects followed by hand.
+"""
+
+import asyncio
+import ipaddress
+import logging
+import socket
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Set
+from urllib.parse import urljoin, urlsplit
+
+import httpx
+from sqlalchemy import or_, select, update
+from sqlalchemy.engine import Engine
+
+from . import models
+from .config import settings
+from .database import DEFAULT_SHARD, http_client_store, shard_engines
+
+logger = logging.getLogger(__name__)
+
+files_table = models.DispatchFile.__table__
+
+# Answers worth another attempt; any other 4xx is final.
+RETRY_STATUSES = {408, 425, 429, 500, 502, 503, 504}
+MAX_REDIRECTS = 5
+
+
+class URLNotAllowed(Exception):
+    """The URL, or a redirect from it, points somewhere we must not fetch."""
+
+
+def _host_allowed(url: str) -> bool:
+    parts = urlsplit(url)
+    if parts.scheme not in ("http", "https") or not parts.hostname:
+        return False
+    return any(
+        parts.hostname == host or parts.hostname.endswith(f".{host}")
+        for host in settings.FILE_METADATA_ALLOWED_HOSTS
+    )
+
+
+def _address_allowed(address: str) -> bool:
+    ip = ipaddress.ip_address(address.split("%")[0])
+    if ip.version == 6 and ip.ipv4_mapped:
+        ip = ip.ipv4_mapped
+    if ip.is_loopback or ip.is_link_local or ip.is_multicast or ip.is_unspecified:
+        return False
+    return ip.is_global or (
+        settings.FILE_METADATA_ALLOW_PRIVATE_ADDRESSES and ip.is_private
+    )
+
+
+async def _resolve(url: httpx.URL) -> str:
+    """
+    An address to connect to for `url`. Refuses the host if any of its
+    addresses is not allowed, so the check cannot be raced by DNS.
+    """
+    port = url.port or (443 if url.scheme == "https" else 80)
+    try:
+        infos = await asyncio.get_running_loop().getaddrinfo(
+            url.host, port, type=socket.SOCK_STREAM
+        )
+    except socket.gaierror as e:
+        raise httpx.ConnectError(f"Cannot resolve {url.host}: {e}")
+    addresses = [info[4][0] for info in infos]
+    if not all(_address_allowed(address) for address in addresses):
+        raise URLNotAllowed(f"{url.host} resolves to a non-public address")
+    return addresses[0]
+
+
+def _parse(response: httpx.Response) -> dict:
+    length = response.headers.get("content-length")
+    if response.status_code == 206:
+        # `Content-Range: bytes 0-0/1234` from the ranged GET fallback.
+        total = response.headers.get("content-range", "").rpartition("/")[2]
+        length = total if total.isdigit() else None
+    return {
+        "content_length": int(length) if length and length.isdigit() else None,
+        "content_type": response.headers.get("content-type"),
+        "etag": response.headers.get("etag"),
+        "metadata_error": None,
+    }
+
+
+async def _send(
+    client: httpx.AsyncClient, method: str, url: str, headers: Dict[str, str]
+) -> httpx.Response:
+    if not _host_allowed(url):
+        raise URLNotAllowed("URL not allowed")
+    target = httpx.URL(url)
+    address = await _resolve(target)
+    request = client.build_request(
+        method,
+        target.copy_with(host=address),
+        headers={**headers, "Host": target.netloc.decode("ascii")},
+        timeout=settings.FILE_METADATA_TIMEOUT_SECONDS,
+        # TLS still verifies the certificate against the host name.
+        extensions={"sni_hostname": target.host},
+    )
+    # Only the headers are needed: the body is never read.
+    response = await client.send(request, stream=True)
+    await response.aclose()
+    return response
+
+
+async def _request(
+    client: httpx.AsyncClient, url: str, headers: Dict[str, str]
+) -> httpx.Response:
+    method = "HEAD"
+    for _ in range(MAX_REDIRECTS + 1):
+        response = await _send(client, method, url, headers)
+        if method == "HEAD" and response.status_code in (405, 501):
+            # HEAD not supported: ask for the first byte instead.
+            method = "GET"
+            headers = {**headers, "Range": "bytes=0-0"}
+            response = await _send(client, method, url, headers)
+        if not response.is_redirect:
+            return response
+        url = urljoin(url, response.headers["location"])
+    raise httpx.TooManyRedirects("Too many redirects")
+
+
+async def fetch_metadata(
+    client: httpx.AsyncClient, url: str, etag: Optional[str] = None
+) -> dict:
+    """
+    Column values for the file at `url`. With a known `etag` the request is
+    conditional; an unchanged file only refreshes `metadata_checked_at`.
+    Failures are returned in `metadata_error`, never raised.
+    """
+    now = datetime.utcnow()
+    headers = {"If-None-Match": etag} if etag else {}
+    delay = 0.5
+    error = None
+    attempts = max(1, settings.FILE_METADATA_RETRIES)
+    for attempt in range(1, attempts + 1):
+        try:
+            response = await _request(client, url, headers)
+        except URLNotAllowed as e:
+            error = str(e)
+            break
+        except (httpx.InvalidURL, httpx.UnsupportedProtocol) as e:
+            error = repr(e)
+            break
+        except httpx.HTTPError as e:
+            error = repr(e)
+        else:
+            if response.status_code == 304:
+                return {"metadata_checked_at": now, "metadata_error": None}
+            if response.status_code < 400:
+                return dict(_parse(response), metadata_checked_at=now)
+            error = f"HTTP {response.status_code}"
+            if response.status_code not in RETRY_STATUSES:
+                break
+        if attempt < attempts:
+            await asyncio.sleep(delay)
+            delay *= 2
+    logger.info(f"Could not fetch metadata for {url}: {error}")
+    # Keep the last known values; only record the failure.
+    return {"metadata_checked_at": now, "metadata_error": error[:500]}
+
+
+# --- Storage (sync, run in a worker thread) ---
+
+
+def _load(bind: Engine, file_ids: List[int]) -> List[dict]:
+    with bind.connect() as conn:
+        rows = conn.execute(
+            select(files_table.c.id, files_table.c.file_url, files_table.c.etag).where(
+                files_table.c.id.in_(file_ids)
+            )
+        ).mappings()
+        return [dict(row) for row in rows]
+
+
+def _load_stale(bind: Engine, limit: int) -> List[dict]:
+    now = datetime.utcnow()
+    checked_at = files_table.c.metadata_checked_at
+    with bind.connect() as conn:
+        rows = conn.execute(
+            select(files_table.c.id, files_table.c.file_url, files_table.c.etag)
+            .where(
+                or_(
+                    checked_at.is_(None),
+                    checked_at
+                    < now - timedelta(hours=settings.FILE_METADATA_MAX_AGE_HOURS),
+                    (files_table.c.metadata_error.is_not(None))
+                    & (
+                        checked_at
+                        < now
+                        - timedelta(minutes=settings.FILE_METADATA_ERROR_RETRY_MINUTES)
+                    ),
+                )
+            )
+            .order_by(checked_at.is_not(None), checked_at)
+            .limit(limit)
+        ).mappings()
+        return [dict(row) for row in rows]
+
+
+def _store(bind: Engine, results: Dict[int, dict]):
+    with bind.begin() as conn:
+        for file_id, values in results.items():
+            conn.execute(
+                update(files_table).where(files_table.c.id == file_id).values(**values)
+            )
+
+
+class MetadataEnricher:
+    """
+    Runs metadata fetches on the event loop, never more than
+    FILE_METADATA_CONCURRENCY at a time in this worker, whether they come
+    from new dispatches or from the refresh pass.
+    """
+
+    def __init__(self):
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._tasks: Set[asyncio.Task] = set()
+        self._refresh_task: Optional[asyncio.Task] = None
+
+    def submit(self, file_ids: Iterable[int], shard: str = DEFAULT_SHARD):
+        """Schedules enrichment of committed files (from any thread)."""
+        file_ids = list(file_ids)
+        if file_ids and self._loop and settings.FILE_METADATA_ENABLED:
+            self._loop.call_soon_threadsafe(self._spawn, file_ids, shard)
+
+    def _spawn(self, file_ids: List[int], shard: str):
+        task = asyncio.create_task(self.enrich(file_ids, shard))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def enrich(self, file_ids: List[int], shard: str = DEFAULT_SHARD) -> int:
+        bind = shard_engines[shard]
+        rows = await asyncio.to_thread(_load, bind, file_ids)
+        await self._enrich_rows(bind, rows)
+        return len(rows)
+
+    async def refresh_stale(self) -> int:
+        """
+        Re-checks one batch of stale files per shard. Returns the size of the
+        largest batch, so a full one means more are stale.
+        """
+        largest = 0
+        for bind in shard_engines.values():
+            rows = await asyncio.to_thread(
+                _load_stale, bind, settings.FILE_METADATA_REFRESH_BATCH_SIZE
+            )
+            await self._enrich_rows(bind, rows)
+            largest = max(largest, len(rows))
+        return largest
+
+    async def _enrich_rows(self, bind: Engine, rows: List[dict]):
+        if not rows:
+            return
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(settings.FILE_METADATA_CONCURRENCY)
+        client = http_client_store["client"]
+
+        async def fetch(row: dict):
+            async with self._semaphore:
+                values = await fetch_metadata(client, row["file_url"], row["etag"])
+            return row["id"], values
+
+        results = await asyncio.gather(*(fetch(row) for row in rows))
+        await asyncio.to_thread(_store, bind, dict(results))
+
+    async def run_refresh(self):
+        while True:
+            await asyncio.sleep(settings.FILE_METADATA_REFRESH_INTERVAL_SECONDS)
+            try:
+                checked = 0
+                while True:
+                    batch = await self.refresh_stale()
+                    checked += batch
+                    if batch < settings.FILE_METADATA_REFRESH_BATCH_SIZE:
+                        break
+                if checked:
+                    logger.info(f"Refreshed metadata of {checked} file(s)")
+            except Exception:
+                logger.exception("Attachment metadata refresh failed")
+
+    def start(self):
+        if not settings.FILE_METADATA_ENABLED:
+            return
+        if not settings.FILE_METADATA_ALLOWED_HOSTS:
+            logger.warning(
+                "FILE_METADATA_ALLOWED_HOSTS is empty; attachment metadata is off"
+            )
+            return
+        self._loop = asyncio.get_running_loop()
+        self._semaphore = asyncio.Semaphore(settings.FILE_METADATA_CONCURRENCY)
+        if settings.FILE_METADATA_REFRESH_INTERVAL_SECONDS:
+            self._refresh_task = asyncio.create_task(self.run_refresh())
+
+    async def stop(self):
+        if self._refresh_task:
+            self._refresh_task.cancel()
+            self._refresh_task = None
+        for task in list(self._tasks):
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._loop = None
+
+
+enricher = MetadataEnricher()
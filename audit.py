@@ -0,0 +1,396 @@
+import asyncio
+import fcntl
+import glob
+import json
+import logging
+import os
+import queue
+import threading
+import uuid
+from collections import Counter
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import event, insert, select
+from sqlmodel import Session
+
+from . import models
+from .config import settings
+from .database import DEFAULT_SHARD, session_shard, shard_engines
+
+logger = logging.getLogger(__name__)
+
+_PENDING_KEY = "audit_pending"
+_READY_KEY = "audit_ready"
+
+
+def record(
+    session: Session,
+    dispatch: models.Dispatch,
+    actor_id: int,
+    action: models.DispatchAction,
+    details: Optional[str] = None,
+):
+    """
+    Records a history entry for `dispatch`.
+
+    In sync mode (the default) the row is written in the caller's transaction.
+    In async mode the event is spooled to disk just before the caller's
+    transaction commits and handed to the audit pipeline once it has; a
+    rollback marks it void in the spool.
+    """
+    if not pipeline.running:
+        # Adding through the many-to-one side avoids loading the whole
+        # `dispatch.history` collection just to append to it.
+        session.add(
+            models.DispatchHistory(
+                dispatch=dispatch, actor_id=actor_id, action=action, details=details
+            )
+        )
+        return
+    event_data = dict(
+        actor_id=actor_id,
+        action=action.value,
+        details=details,
+        timestamp=datetime.utcnow().isoformat(),
+    )
+    if session_shard(session) != DEFAULT_SHARD:
+        event_data["shard"] = session_shard(session)
+    session.info.setdefault(_PENDING_KEY, []).append((dispatch, event_data))
+
+
+# --- Session hooks: events are durable before the commit, queued after it ---
+
+
+@event.listens_for(Session, "before_commit")
+def _spool_pending_events(session):
+    pending = session.info.pop(_PENDING_KEY, None)
+    if not pending:
+        return
+    session.flush()  # new dispatches get their ids here
+    txn = uuid.uuid4().hex
+    events = [
+        dict(event_data, dispatch_id=dispatch.id, txn=txn)
+        for dispatch, event_data in pending
+    ]
+    # A crash from here on replays the spool, so a committed change never
+    # loses its history. A crash before the commit lands may replay events
+    # of a transaction that never committed; a rollback we see is marked.
+    session.info[_READY_KEY] = (pipeline.spool(events), events)
+
+
+@event.listens_for(Session, "after_commit")
+def _submit_committed_events(session):
+    ready = session.info.pop(_READY_KEY, None)
+    if ready:
+        pipeline.submit(*ready)
+
+
+@event.listens_for(Session, "after_soft_rollback")
+def _discard_events(session, previous_transaction):
+    session.info.pop(_PENDING_KEY, None)
+    ready = session.info.pop(_READY_KEY, None)
+    if ready:
+        pipeline.cancel(*ready)
+
+
+# --- Pipeline ---
+
+
+def _to_row(event_data: dict) -> dict:
+    return dict(
+        dispatch_id=event_data["dispatch_id"],
+        actor_id=event_data["actor_id"],
+        action=models.DispatchAction(event_data["action"]),
+        details=event_data["details"],
+        timestamp=datetime.fromisoformat(event_data["timestamp"]),
+    )
+
+
+def _insert_events(events: List[dict], dedupe: bool = False) -> int:
+    """Writes events to the shard each was recorded on."""
+    by_shard: Dict[str, List[dict]] = {}
+    for event_data in events:
+        shard = event_data.get("shard", DEFAULT_SHARD)
+        by_shard.setdefault(shard, []).append(_to_row(event_data))
+    return sum(_insert_history(shard, rows, dedupe) for shard, rows in by_shard.items())
+
+
+def _insert_history(shard: str, rows: List[dict], dedupe: bool = False) -> int:
+    """Batch-inserts history rows, skipping dispatches deleted meanwhile."""
+    if not rows:
+        return 0
+    dispatch = models.Dispatch.__table__
+    history = models.DispatchHistory.__table__
+    dispatch_ids = {r["dispatch_id"] for r in rows}
+    with shard_engines[shard].begin() as conn:
+        existing_ids = set(
+            conn.execute(
+                select(dispatch.c.id).where(dispatch.c.id.in_(dispatch_ids))
+            ).scalars()
+        )
+        rows = [r for r in rows if r["dispatch_id"] in existing_ids]
+        if dedupe and rows:
+            # Replayed events may already have been written before a crash;
+            # (dispatch, actor, action, timestamp) identifies an event.
+            written = set(
+                conn.execute(
+                    select(
+                        history.c.dispatch_id,
+                        history.c.actor_id,
+                        history.c.action,
+                        history.c.timestamp,
+                    ).where(history.c.dispatch_id.in_(dispatch_ids))
+                ).all()
+            )
+            rows = [
+                r
+                for r in rows
+                if (r["dispatch_id"], r["actor_id"], r["action"], r["timestamp"])
+                not in written
+            ]
+        for start in range(0, len(rows), settings.AUDIT_BATCH_SIZE):
+            conn.execute(
+                insert(history), rows[start : start + settings.AUDIT_BATCH_SIZE]
+            )
+    return len(rows)
+
+
+class _SpoolFile:
+    """
+    An append-only JSON-lines file, exclusively flock'ed while in use.
+
+    Appends are group-committed: writers only hold `_write_lock` to copy
+    their lines into the OS buffer, and one fsync covers every line
+    written before it started, so concurrent commits share a disk sync
+    instead of queueing for one each.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        # Events spooled here and neither written to the database nor
+        # rolled back; the file is deleted once this drops to 0.
+        self.pending = 0
+        self._write_lock = threading.Lock()
+        self._sync_lock = threading.Lock()
+        self._written = 0  # appends handed to the OS
+        self._synced = 0  # appends known to be on disk
+        self.file = open(path, "a", encoding="utf-8")
+        try:
+            fcntl.flock(self.file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            self.file.close()
+            raise
+
+    def append(self, events: List[dict]):
+        lines = "".join(json.dumps(e) + "\n" for e in events)
+        with self._write_lock:
+            self.file.write(lines)
+            self.file.flush()
+            self._written += 1
+            mine = self._written
+        if not settings.AUDIT_SPOOL_FSYNC:
+            return
+        with self._sync_lock:
+            if self._synced >= mine:
+                return  # a concurrent fsync already covered this append
+            covered = self._written
+            os.fsync(self.file.fileno())
+            self._synced = covered
+
+    def discard(self):
+        os.remove(self.path)
+        self.file.close()
+
+
+def _read_spool(path: str) -> List[dict]:
+    events = []
+    rolled_back = set()
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                # A torn last line from a crash mid-write; the commit that
+                # produced it never returned to the client.
+                logger.warning(f"Skipping corrupt audit spool line in {path}")
+                continue
+            if "rolled_back" in entry:
+                rolled_back.add(entry["rolled_back"])
+            else:
+                events.append(entry)
+    return [e for e in events if e.get("txn") not in rolled_back]
+
+
+class AuditPipeline:
+    """
+    Bounded in-process queue of committed history events, flushed to the
+    database in batches by a background task. Every event is appended to a
+    local spool file before its transaction commits; a spool is deleted only
+    once all its events are in the database (or rolled back), and orphaned
+    spools are replayed on startup.
+    """
+
+    def __init__(self):
+        self.running = False
+        self._queue: "queue.Queue[Tuple[_SpoolFile, dict]]" = queue.Queue()
+        self._lock = threading.Lock()
+        self._spool: Optional[_SpoolFile] = None
+        # Rotated-out spools still waiting for some of their events.
+        self._sealed: List[_SpoolFile] = []
+        self._failed: List[Tuple[_SpoolFile, dict]] = []
+        self._spool_seq = 0
+        self._task: Optional[asyncio.Task] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def _new_spool(self) -> _SpoolFile:
+        self._spool_seq += 1
+        name = f"audit-{os.getpid()}-{self._spool_seq}.jsonl"
+        return _SpoolFile(os.path.join(settings.AUDIT_SPOOL_DIR, name))
+
+    def spool(self, events: List[dict]) -> Optional[_SpoolFile]:
+        """Makes events durable before their transaction commits."""
+        with self._lock:
+            spool = self._spool
+            if spool is None:
+                return None  # stopped: submit() writes them synchronously
+            # Counted first, so the file is not deleted under the append.
+            spool.pending += len(events)
+        spool.append(events)
+        return spool
+
+    def submit(self, spool: Optional[_SpoolFile], events: List[dict]):
+        """Enqueues spooled events once committed (called from request threads)."""
+        overflow = []
+        with self._lock:
+            if spool is None or not self.running:
+                overflow = events
+            else:
+                for event_data in events:
+                    try:
+                        self._queue.put_nowait((spool, event_data))
+                    except queue.Full:
+                        overflow.append(event_data)
+            backlog = self._queue.qsize()
+        if overflow:
+            # Queue full (or pipeline stopped): apply backpressure by writing
+            # synchronously rather than dropping events.
+            _insert_events(overflow)
+            if spool is not None:
+                self._release(Counter({spool: len(overflow)}))
+        if backlog >= settings.AUDIT_BATCH_SIZE and self._loop and self._wakeup:
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+
+    def cancel(self, spool: Optional[_SpoolFile], events: List[dict]):
+        """Voids spooled events whose transaction rolled back."""
+        if spool is None:
+            return
+        spool.append([{"rolled_back": events[0]["txn"]}])
+        self._release(Counter({spool: len(events)}))
+
+    def _release(self, counts: Counter):
+        """Deletes sealed spools none of whose events are outstanding."""
+        with self._lock:
+            for spool, count in counts.items():
+                spool.pending -= count
+            done = [s for s in self._sealed if s.pending == 0]
+            self._sealed = [s for s in self._sealed if s.pending]
+        for spool in done:
+            spool.discard()
+
+    def flush(self) -> int:
+        """Writes everything queued so far. Returns the number of rows written."""
+        with self._lock:
+            items, self._failed = self._failed, []
+            retrying = bool(items)
+            while True:
+                try:
+                    items.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            if not items:
+                return 0
+            # Later events go to a fresh file; this one is deleted once the
+            # events still in flight (spooled, not yet committed) are done.
+            if self._spool is not None:
+                self._sealed.append(self._spool)
+                self._spool = self._new_spool()
+
+        try:
+            written = _insert_events([e for _, e in items], dedupe=retrying)
+        except Exception:
+            logger.exception("Audit flush failed; events stay spooled for retry")
+            with self._lock:
+                self._failed = items + self._failed
+            return 0
+        self._release(Counter(spool for spool, _ in items))
+        return written
+
+    def replay_orphaned_spools(self) -> int:
+        """Replays spool files left behind by crashed processes."""
+        replayed = 0
+        for path in sorted(
+            glob.glob(os.path.join(settings.AUDIT_SPOOL_DIR, "*.jsonl"))
+        ):
+            try:
+                spool = _SpoolFile(path)
+            except BlockingIOError:
+                continue  # owned by a live process
+            events = _read_spool(path)
+            replayed += _insert_events(events, dedupe=True)
+            spool.discard()
+        if replayed:
+            logger.warning(f"Replayed {replayed} audit events from orphaned spools")
+        return replayed
+
+    async def _run(self):
+        while self.running:
+            try:
+                await asyncio.wait_for(
+                    self._wakeup.wait(), settings.AUDIT_FLUSH_INTERVAL_SECONDS
+                )
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await asyncio.to_thread(self.flush)
+            except Exception:
+                logger.exception("Audit flush failed")
+
+    def start(self):
+        """Starts the pipeline in the running event loop (async mode only)."""
+        if settings.AUDIT_MODE != "async":
+            return
+        os.makedirs(settings.AUDIT_SPOOL_DIR, exist_ok=True)
+        self.replay_orphaned_spools()
+        self._queue = queue.Queue(maxsize=settings.AUDIT_QUEUE_SIZE)
+        self._spool = self._new_spool()
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        self.running = True
+        self._task = asyncio.create_task(self._run())
+        logger.info("Audit pipeline started (async mode)")
+
+    async def stop(self):
+        """Stops the flusher and writes out every remaining event."""
+        if not self.running:
+            return
+        self.running = False
+        self._wakeup.set()
+        await self._task
+        await asyncio.to_thread(self.flush)
+        with self._lock:
+            spools = [self._spool, *self._sealed]
+            self._spool, self._sealed = None, []
+        for spool in spools:
+            if spool.pending:
+                # Still uncommitted or unwritten: left open (a commit may
+                # still append to it) and replayed on the next start.
+                logger.warning(f"Keeping audit spool {spool.path} for replay")
+            else:
+                spool.discard()
+        logger.info("Audit pipeline stopped, all events flushed")
+
+
+pipeline = AuditPipeline()
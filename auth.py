@@ -1,23 +1,37 @@
 import httpx
 import logging
+from collections import OrderedDict
+from typing import Optional
+
 from fastapi import Depends, HTTPException, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 
 from .config import settings
-from .database import get_http_client
 from .models import User
 
 logger = logging.getLogger(__name__)
 
 MOCK_USERS = {
     "lecturer1": User(
-        id=101, full_name="Mock Lecturer 1", user_type="lecturer", is_admin=False
+        id=101,
+        full_name="Mock Lecturer 1",
+        user_type="lecturer",
+        is_admin=False,
+        department="cs",
     ),
     "lecturer2": User(
-        id=102, full_name="Mock Lecturer 2", user_type="lecturer", is_admin=False
+        id=102,
+        full_name="Mock Lecturer 2",
+        user_type="lecturer",
+        is_admin=False,
+        department="cs",
     ),
     "lecturer3": User(
-        id=103, full_name="Mock Lecturer 3", user_type="lecturer", is_admin=False
+        id=103,
+        full_name="Mock Lecturer 3",
+        user_type="lecturer",
+        is_admin=False,
+        department="math",
     ),
     "admin": User(
         id=999, full_name="Mock Admin Lecturer", user_type="lecturer", is_admin=True
@@ -26,10 +40,26 @@ MOCK_USERS = {
 
 http_bearer_scheme = HTTPBearer()
 
+# Bearer token -> user ID of recent successful authentications, so the
+# rate limiter can key on the user before authenticating the request.
+_token_user_ids: "OrderedDict[str, int]" = OrderedDict()
+_TOKEN_USER_IDS_MAX = 10_000
+
+
+def _remember_token(token: str, user: User) -> User:
+    _token_user_ids[token] = user.id
+    _token_user_ids.move_to_end(token)
+    if len(_token_user_ids) > _TOKEN_USER_IDS_MAX:
+        _token_user_ids.popitem(last=False)
+    return user
+
+
+def user_id_for_token(token: str) -> Optional[int]:
+    return _token_user_ids.get(token)
+
 
 async def get_current_user(
     creds: HTTPAuthorizationCredentials = Depends(http_bearer_scheme),
-    client: httpx.AsyncClient = Depends(get_http_client),
 ) -> User:
     """Dependency to get the current user from token or mock."""
     if settings.MOCK_AUTH_ENABLED:
@@ -40,8 +70,12 @@ async def get_current_user(
                 status_code=status.HTTP_401_UNAUTHORIZED,
                 detail=f"Invalid mock user token. Valid are: {list(MOCK_USERS.keys())}",
             )
-        return user
+        return _remember_token(token, user)
+
+    # Imported here: database depends on this module for shard routing.
+    from .database import http_client_store
 
+    client: httpx.AsyncClient = http_client_store["client"]
     token = creds.credentials
     try:
         headers = {"Authorization": f"Bearer {token}"}
@@ -51,7 +85,7 @@ async def get_current_user(
         if response.status_code == 200:
             user_data = response.json()
             if user_data and "data" in user_data and user_data["data"] is not None:
-                return User(**user_data["data"])
+                return _remember_token(token, User(**user_data["data"]))
 
         logger.warning(
             f"User service validation failed with status {response.status_code}"
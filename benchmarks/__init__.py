@@ -0,0 +1,25 @@
+"""
+Reproducible load-test and benchmark suite.
+
+Usage (from the directory containing the `hpc_dispatch` package):
+
+    python -m hpc_dispatch.benchmarks generate --preset small --out bench.db
+    python -m hpc_dispatch.benchmarks run --db bench.db --out results.json
+    python -m hpc_dispatch.benchmarks compare baseline.json results.json
+    python -m hpc_dispatch.benchmarks coldstart --db bench.db --target-ms 2500
+    python -m hpc_dispatch.benchmarks contention --rounds 20 --clients 8
+    python -m hpc_dispatch.benchmarks shards --dispatches 20
+    python -m hpc_dispatch.benchmarks schedule --dispatches 50 --workers 4
+
+`run` also records the median cold start (see hpc_dispatch.startup), and
+`compare` fails when it exceeds its target or regresses. `contention` fires
+concurrent forward/status requests at single dispatches and fails when one
+is lost, fails with a server error, or bypasses its If-Match precondition.
+`shards` runs the app on several SQLite files, one per department shard,
+and checks routing, isolation and the admin fan-out. `schedule` races
+several schedulers over the same deadlines and checks that each scheduled
+send and overdue flag happens once, on time.
+
+Everything runs offline: the app is driven in-process through an ASGI
+transport, and the user service is replaced by a local stub (or mock auth).
+"""
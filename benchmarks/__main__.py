@@ -0,0 +1,145 @@
+import argparse
+import dataclasses
+import json
+import logging
+import os
+import sys
+
+from .contention import run_contention
+from .generator import PRESETS, generate
+from .runner import COLD_START_TARGET_MS, compare, measure_cold_start, run
+from .scenarios import SCENARIOS
+from .scheduling import run_scheduling_check
+from .sharding import run_sharding_check
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m hpc_dispatch.benchmarks")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    gen = sub.add_parser("generate", help="Build a seeded synthetic SQLite dataset")
+    gen.add_argument("--preset", choices=list(PRESETS), default="small")
+    gen.add_argument("--out", default="bench.db")
+    gen.add_argument("--seed", type=int, default=None)
+    gen.add_argument("--dispatches", type=int, default=None)
+    gen.add_argument("--users", type=int, default=None)
+
+    run_p = sub.add_parser("run", help="Run load scenarios and write a JSON report")
+    run_p.add_argument("--db", default="bench.db")
+    run_p.add_argument("--out", default="bench_results.json")
+    run_p.add_argument(
+        "--scenario", action="append", choices=list(SCENARIOS), dest="scenarios"
+    )
+    run_p.add_argument("--operations", type=int, default=1000)
+    run_p.add_argument("--concurrency", type=int, default=8)
+    run_p.add_argument("--warmup", type=int, default=50)
+    run_p.add_argument(
+        "--auth",
+        choices=["mock", "stub"],
+        default="mock",
+        help="'mock' uses MOCK_AUTH_ENABLED, 'stub' a local user-service stub",
+    )
+    run_p.add_argument("--actors", type=int, default=20)
+    run_p.add_argument("--seed", type=int, default=42)
+    run_p.add_argument(
+        "--cold-start-repeats",
+        type=int,
+        default=3,
+        help="Cold starts to measure before the scenarios (0 to skip)",
+    )
+    run_p.add_argument(
+        "--cold-start-target-ms", type=float, default=COLD_START_TARGET_MS
+    )
+
+    cold_p = sub.add_parser(
+        "coldstart", help="Check the median cold-start time against a target"
+    )
+    cold_p.add_argument("--db", default="bench.db")
+    cold_p.add_argument("--repeats", type=int, default=5)
+    cold_p.add_argument("--target-ms", type=float, default=COLD_START_TARGET_MS)
+
+    cont_p = sub.add_parser(
+        "contention",
+        help="Stress concurrent forward/status transitions and check invariants",
+    )
+    cont_p.add_argument("--rounds", type=int, default=20)
+    cont_p.add_argument("--clients", type=int, default=8)
+
+    shard_p = sub.add_parser(
+        "shards",
+        help="Check department sharding on several local SQLite files",
+    )
+    shard_p.add_argument("--dispatches", type=int, default=20)
+
+    sched_p = sub.add_parser(
+        "schedule",
+        help="Check scheduled sends and overdue flags with competing schedulers",
+    )
+    sched_p.add_argument("--dispatches", type=int, default=50)
+    sched_p.add_argument("--workers", type=int, default=4)
+
+    cmp_p = sub.add_parser("compare", help="Compare two JSON reports")
+    cmp_p.add_argument("baseline")
+    cmp_p.add_argument("candidate")
+    cmp_p.add_argument("--threshold", type=float, default=0.10)
+
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+
+    if args.command == "generate":
+        overrides = {
+            k: v
+            for k, v in dict(
+                seed=args.seed, dispatches=args.dispatches, users=args.users
+            ).items()
+            if v is not None
+        }
+        spec = dataclasses.replace(PRESETS[args.preset], **overrides)
+        if os.path.exists(args.out):
+            os.remove(args.out)
+        summary = generate(spec, f"sqlite:///{os.path.abspath(args.out)}")
+        print(json.dumps(summary["rows"], indent=2))
+        return 0
+
+    if args.command == "run":
+        run(
+            db_path=args.db,
+            out_path=args.out,
+            scenarios=args.scenarios,
+            operations=args.operations,
+            concurrency=args.concurrency,
+            warmup=args.warmup,
+            auth_mode=args.auth,
+            actors=args.actors,
+            seed=args.seed,
+            cold_start_repeats=args.cold_start_repeats,
+            cold_start_target_ms=args.cold_start_target_ms,
+        )
+        print(f"Wrote {args.out}")
+        return 0
+
+    if args.command == "coldstart":
+        result = measure_cold_start(args.db, args.repeats, args.target_ms)
+        print(json.dumps(result, indent=2))
+        return 0 if result["within_target"] else 1
+
+    if args.command == "contention":
+        result = run_contention(args.rounds, args.clients)
+        print(json.dumps(result, indent=2))
+        return 0 if result["passed"] else 1
+
+    if args.command == "shards":
+        result = run_sharding_check(args.dispatches)
+        print(json.dumps(result, indent=2))
+        return 0 if result["passed"] else 1
+
+    if args.command == "schedule":
+        result = run_scheduling_check(args.dispatches, args.workers)
+        print(json.dumps(result, indent=2))
+        return 0 if result["passed"] else 1
+
+    return 0 if compare(args.baseline, args.candidate, args.threshold) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
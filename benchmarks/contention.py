@@ -0,0 +1,153 @@
+"""
+Concurrency stress test for dispatch transitions.
+
+Fires bursts of concurrent forward and status requests at single dispatches
+and checks invariants that racing read-modify-write cycles break:
+
+- forward storm: every request forwards to the same new assignee; none may
+  fail (a duplicate `DispatchAssigneeLink` insert surfaces as a 500);
+- conditional storm: every request carries the same `If-Match` version;
+  exactly one may succeed, the others must get 412;
+- unconditional storm: no `If-Match`; every request must eventually apply
+  (internal retry), each leaving one history entry, and the final status
+  must be the one written by the last applied update.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import tempfile
+from collections import Counter
+from typing import Dict, List
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+CREATOR = {"Authorization": "Bearer lecturer1"}
+ASSIGNEE = {"Authorization": "Bearer lecturer2"}
+FORWARD_TO = 103
+STATUSES = ["in_progress", "pending", "rejected", "completed"]
+
+
+async def _round(client: httpx.AsyncClient, clients: int) -> Dict[str, List[str]]:
+    violations: Dict[str, List[str]] = {}
+
+    def fail(check: str, message: str):
+        violations.setdefault(check, []).append(message)
+
+    created = await client.post(
+        "/dispatches",
+        headers=CREATOR,
+        json={"title": "contended", "content": "c", "assignee_ids": [102], "files": []},
+    )
+    dispatch_id = created.json()["id"]
+    await client.post(f"/dispatches/{dispatch_id}/send", headers=CREATOR)
+
+    # Forward storm.
+    responses = await asyncio.gather(
+        *(
+            client.post(
+                f"/dispatches/{dispatch_id}/forward",
+                headers=ASSIGNEE,
+                json={"new_assignee_id": FORWARD_TO},
+            )
+            for _ in range(clients)
+        )
+    )
+    codes = Counter(r.status_code for r in responses)
+    if set(codes) != {200}:
+        fail("forward", f"dispatch {dispatch_id}: status codes {dict(codes)}")
+
+    # Conditional storm: all clients saw the same version.
+    current = await client.get(f"/dispatches/{dispatch_id}", headers=CREATOR)
+    etag = current.headers.get("etag", f'"{current.json().get("version")}"')
+    responses = await asyncio.gather(
+        *(
+            client.put(
+                f"/dispatches/{dispatch_id}/status",
+                headers={**ASSIGNEE, "If-Match": etag},
+                json={"status": STATUSES[i % 2]},
+            )
+            for i in range(clients)
+        )
+    )
+    codes = Counter(r.status_code for r in responses)
+    if codes.get(200) != 1 or codes.get(412) != clients - 1:
+        fail("if_match", f"dispatch {dispatch_id}: status codes {dict(codes)}")
+
+    # Unconditional storm.
+    responses = await asyncio.gather(
+        *(
+            client.put(
+                f"/dispatches/{dispatch_id}/status",
+                headers=ASSIGNEE,
+                json={"status": STATUSES[i % len(STATUSES)]},
+            )
+            for i in range(clients)
+        )
+    )
+    codes = Counter(r.status_code for r in responses)
+    if set(codes) != {200}:
+        fail("retry", f"dispatch {dispatch_id}: status codes {dict(codes)}")
+    details = (await client.get(f"/dispatches/{dispatch_id}", headers=CREATOR)).json()
+    updates = [h for h in details["history"] if h["action"] == "status_updated"]
+    applied = 1 + codes.get(200, 0)  # plus the conditional winner
+    if len(updates) != applied:
+        fail(
+            "retry",
+            f"dispatch {dispatch_id}: {applied} updates answered 200, "
+            f"{len(updates)} recorded",
+        )
+    last_status = updates[-1]["details"].removeprefix("Status changed to ")
+    if details["status"] != last_status:
+        fail(
+            "retry",
+            f"dispatch {dispatch_id}: final status {details['status']}, "
+            f"last recorded update {last_status}",
+        )
+    if sorted(details["assignee_ids"]) != [102, FORWARD_TO]:
+        fail("forward", f"dispatch {dispatch_id}: assignees {details['assignee_ids']}")
+    return violations
+
+
+async def _run(rounds: int, clients: int) -> dict:
+    from ..main import app
+
+    violations: Dict[str, List[str]] = {}
+    async with app.router.lifespan_context(app):
+        # Unhandled errors must come back as 500s, not raise here.
+        transport = httpx.ASGITransport(app=app, raise_app_exceptions=False)
+        async with httpx.AsyncClient(
+            transport=transport, base_url="http://bench"
+        ) as client:
+            for _ in range(rounds):
+                for check, messages in (await _round(client, clients)).items():
+                    violations.setdefault(check, []).extend(messages)
+    return {
+        "rounds": rounds,
+        "clients": clients,
+        "passed": not violations,
+        "violations": {check: len(m) for check, m in violations.items()},
+        "examples": {check: m[:3] for check, m in violations.items()},
+    }
+
+
+def run_contention(rounds: int = 20, clients: int = 8) -> dict:
+    """Runs the storms on a fresh temporary SQLite database."""
+    work_dir = tempfile.mkdtemp(prefix="hpc-dispatch-contention-")
+    db_path = os.path.join(work_dir, "contention.db")
+    # Settings are read at import time (see runner.run).
+    os.environ["DATABASE_URL"] = f"sqlite:///{db_path}"
+    os.environ["MOCK_AUTH_ENABLED"] = "true"
+    os.environ["RATE_LIMIT_ENABLED"] = "false"
+    os.environ["FILE_METADATA_ENABLED"] = "false"
+    try:
+        result = asyncio.run(_run(rounds, clients))
+    finally:
+        for name in os.listdir(work_dir):
+            os.remove(os.path.join(work_dir, name))
+        os.rmdir(work_dir)
+    logger.info(f"Contention result: {json.dumps(result['violations'])}")
+    return result
@@ -0,0 +1,260 @@
+import logging
+import random
+import time
+from dataclasses import asdict, dataclass
+from datetime import datetime, timedelta
+from typing import Dict, List
+
+from sqlalchemy import insert
+from sqlmodel import SQLModel, create_engine
+
+from .. import inbox, models
+
+logger = logging.getLogger(__name__)
+
+# IDs of the users behind the mock tokens in `auth.MOCK_USERS`. They are
+# always part of the population so mock-auth runs have data to work on.
+MOCK_USER_IDS = [101, 102, 103, 999]
+ADMIN_USER_ID = 999
+
+# Host of the generated attachment URLs, answered by the runner's stub.
+FILE_HOST = "files.example.test"
+
+# Fixed reference point so generated timestamps do not depend on "now".
+EPOCH = datetime(2025, 1, 1)
+
+STATUS_WEIGHTS = {
+    models.DispatchStatus.DRAFT: 10,
+    models.DispatchStatus.PENDING: 20,
+    models.DispatchStatus.IN_PROGRESS: 20,
+    models.DispatchStatus.COMPLETED: 40,
+    models.DispatchStatus.REJECTED: 10,
+}
+
+
+@dataclass
+class DatasetSpec:
+    """Shape of a synthetic dataset. Same spec + seed => same database."""
+
+    dispatches: int = 10_000
+    users: int = 500
+    max_assignees: int = 4
+    max_files: int = 3
+    avg_history: int = 6
+    avg_comments: int = 3
+    # A small share of dispatches get very long histories/comment threads.
+    long_thread_share: float = 0.01
+    long_thread_length: int = 300
+    shelf_users: int = 200
+    shelves_per_user: int = 20
+    shelf_depth: int = 8
+    dispatches_per_shelf: int = 15
+    # Share of dispatches created by / assigned to the mock users.
+    mock_user_share: float = 0.05
+    years: int = 5
+    seed: int = 42
+    batch_size: int = 5_000
+
+
+PRESETS: Dict[str, DatasetSpec] = {
+    "tiny": DatasetSpec(dispatches=500, users=50, shelf_users=20),
+    "small": DatasetSpec(),
+    "medium": DatasetSpec(dispatches=100_000, users=5_000, shelf_users=1_000),
+    "large": DatasetSpec(
+        dispatches=1_000_000,
+        users=50_000,
+        shelf_users=5_000,
+        mock_user_share=0.001,
+    ),
+}
+
+
+class _BatchWriter:
+    """Buffers rows per table and flushes them as multi-row inserts."""
+
+    def __init__(self, conn, batch_size: int):
+        self.conn = conn
+        self.batch_size = batch_size
+        self.buffers: Dict[str, List[dict]] = {}
+        self.counts: Dict[str, int] = {}
+
+    def add(self, table, row: dict):
+        buffer = self.buffers.setdefault(table.name, [])
+        buffer.append(row)
+        if len(buffer) >= self.batch_size:
+            self._flush(table)
+
+    def _flush(self, table):
+        rows = self.buffers.get(table.name)
+        if rows:
+            self.conn.execute(insert(table), rows)
+            self.counts[table.name] = self.counts.get(table.name, 0) + len(rows)
+            self.buffers[table.name] = []
+
+    def flush_all(self):
+        for table in SQLModel.metadata.sorted_tables:
+            self._flush(table)
+
+
+def generate(spec: DatasetSpec, database_url: str) -> dict:
+    """Creates the schema at `database_url` and fills it with synthetic data."""
+    rng = random.Random(spec.seed)
+    engine = create_engine(database_url)
+    SQLModel.metadata.drop_all(engine)
+    SQLModel.metadata.create_all(engine)
+
+    user_ids = list(range(1, spec.users + 1))
+    user_ids += [uid for uid in MOCK_USER_IDS if uid not in user_ids]
+    statuses = list(STATUS_WEIGHTS)
+    status_weights = list(STATUS_WEIGHTS.values())
+    span_seconds = spec.years * 365 * 24 * 3600
+    shelf_owner_ids = set(MOCK_USER_IDS) | set(
+        rng.sample(user_ids, min(spec.shelf_users, len(user_ids)))
+    )
+    dispatches_by_owner: Dict[int, List[int]] = {uid: [] for uid in shelf_owner_ids}
+
+    dispatch_t = models.Dispatch.__table__
+    assignee_t = models.DispatchAssigneeLink.__table__
+    file_t = models.DispatchFile.__table__
+    history_t = models.DispatchHistory.__table__
+    comment_t = models.Comment.__table__
+    shelf_t = models.Shelf.__table__
+    shelf_link_t = models.DispatchShelfLink.__table__
+
+    started = time.perf_counter()
+    with engine.begin() as conn:
+        writer = _BatchWriter(conn, spec.batch_size)
+        history_id = comment_id = file_id = 0
+
+        for dispatch_id in range(1, spec.dispatches + 1):
+            if rng.random() < spec.mock_user_share:
+                creator_id = rng.choice(MOCK_USER_IDS[:3])
+            else:
+                creator_id = rng.choice(user_ids)
+            status = rng.choices(statuses, status_weights)[0]
+            created_at = EPOCH - timedelta(seconds=rng.randrange(span_seconds))
+            writer.add(
+                dispatch_t,
+                dict(
+                    id=dispatch_id,
+                    title=f"Dispatch {dispatch_id} from user {creator_id}",
+                    content=f"Synthetic content #{rng.getrandbits(32):08x}",
+                    status=status,
+                    created_at=created_at,
+                    creator_id=creator_id,
+                ),
+            )
+            if creator_id in dispatches_by_owner:
+                dispatches_by_owner[creator_id].append(dispatch_id)
+
+            assignees = set(rng.sample(user_ids, rng.randint(1, spec.max_assignees)))
+            if rng.random() < spec.mock_user_share:
+                assignees.add(rng.choice(MOCK_USER_IDS[:3]))
+            assignees.discard(creator_id)
+            for assignee_id in assignees or {rng.choice(MOCK_USER_IDS[:3])}:
+                writer.add(
+                    assignee_t, dict(dispatch_id=dispatch_id, assignee_id=assignee_id)
+                )
+                if assignee_id in dispatches_by_owner:
+                    dispatches_by_owner[assignee_id].append(dispatch_id)
+
+            for _ in range(rng.randint(0, spec.max_files)):
+                file_id += 1
+                writer.add(
+                    file_t,
+                    dict(
+                        id=file_id,
+                        file_url=f"https://{FILE_HOST}/{dispatch_id}/{file_id}.pdf",
+                        filename=f"{file_id}.pdf",
+                        dispatch_id=dispatch_id,
+                    ),
+                )
+
+            long_thread = rng.random() < spec.long_thread_share
+            n_history = (
+                spec.long_thread_length
+                if long_thread
+                else rng.randint(1, 2 * spec.avg_history - 1)
+            )
+            n_comments = (
+                spec.long_thread_length
+                if long_thread
+                else rng.randint(0, 2 * spec.avg_comments)
+            )
+            participants = [creator_id, *assignees]
+            timestamp = created_at
+            for i in range(n_history):
+                history_id += 1
+                timestamp += timedelta(minutes=rng.randint(1, 600))
+                action = (
+                    models.DispatchAction.CREATED
+                    if i == 0
+                    else rng.choice(list(models.DispatchAction)[1:])
+                )
+                writer.add(
+                    history_t,
+                    dict(
+                        id=history_id,
+                        action=action,
+                        details=None,
+                        timestamp=timestamp,
+                        actor_id=rng.choice(participants),
+                        dispatch_id=dispatch_id,
+                    ),
+                )
+            for _ in range(n_comments):
+                comment_id += 1
+                writer.add(
+                    comment_t,
+                    dict(
+                        id=comment_id,
+                        content=f"Comment {comment_id}",
+                        created_at=created_at
+                        + timedelta(minutes=rng.randint(1, 60 * 24 * 30)),
+                        user_id=rng.choice(participants),
+                        dispatch_id=dispatch_id,
+                    ),
+                )
+
+        shelf_id = 0
+        for owner_id in sorted(shelf_owner_ids):
+            owner_shelves: List[int] = []
+            owned = dispatches_by_owner[owner_id]
+            for i in range(spec.shelves_per_user):
+                shelf_id += 1
+                # The first `shelf_depth` shelves form a chain (deep tree),
+                # the rest hang off random existing shelves or the root.
+                if i == 0:
+                    parent_id = None
+                elif i < spec.shelf_depth:
+                    parent_id = owner_shelves[-1]
+                else:
+                    parent_id = rng.choice(owner_shelves + [None])
+                writer.add(
+                    shelf_t,
+                    dict(
+                        id=shelf_id,
+                        name=f"Shelf {i} of {owner_id}",
+                        user_id=owner_id,
+                        parent_id=parent_id,
+                    ),
+                )
+                owner_shelves.append(shelf_id)
+                if owned:
+                    for linked_id in set(
+                        rng.sample(owned, min(spec.dispatches_per_shelf, len(owned)))
+                    ):
+                        writer.add(
+                            shelf_link_t,
+                            dict(dispatch_id=linked_id, shelf_id=shelf_id),
+                        )
+
+        writer.flush_all()
+
+    # The listings read the denormalized inbox; derive it from the rows above.
+    inbox.rebuild(engine, spec.batch_size)
+    logger.info(
+        f"Generated dataset in {time.perf_counter() - started:.1f}s: {writer.counts}"
+    )
+    engine.dispose()
+    return {"rows": writer.counts, "spec": asdict(spec)}
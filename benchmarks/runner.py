@@ -0,0 +1,353 @@
+import asyncio
+import json
+import logging
+import os
+import platform
+import random
+import shutil
+import subprocess
+import time
+import zlib
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+
+import httpx
+
+from ..startup import median_profile, profile_startup
+from .generator import ADMIN_USER_ID, FILE_HOST
+from .scenarios import SCENARIOS, Actor, build_context
+
+logger = logging.getLogger(__name__)
+
+PACKAGE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Median wall-clock time from interpreter launch to a started application.
+COLD_START_TARGET_MS = 2500.0
+
+
+def percentile(sorted_values: List[float], pct: float) -> float:
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, int(round(pct / 100 * len(sorted_values) + 0.5)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def summarize(latencies_ms: List[float], errors: int, duration_s: float) -> dict:
+    values = sorted(latencies_ms)
+    return {
+        "requests": len(values),
+        "errors": errors,
+        "throughput_rps": round(len(values) / duration_s, 2) if duration_s else 0.0,
+        "latency_ms": {
+            "mean": round(sum(values) / len(values), 3) if values else 0.0,
+            "p50": round(percentile(values, 50), 3),
+            "p95": round(percentile(values, 95), 3),
+            "p99": round(percentile(values, 99), 3),
+            "max": round(values[-1], 3) if values else 0.0,
+        },
+    }
+
+
+def stub_file_host(request: httpx.Request) -> httpx.Response:
+    """Local stand-in for the file host, answering attachment HEADs."""
+    etag = f'"{zlib.crc32(request.url.path.encode()):08x}"'
+    if request.headers.get("If-None-Match") == etag:
+        return httpx.Response(304, headers={"ETag": etag})
+    return httpx.Response(
+        200,
+        headers={
+            "Content-Length": str(len(request.url.path) * 1024),
+            "Content-Type": "application/pdf",
+            "ETag": etag,
+        },
+    )
+
+
+def stub_user_service(request: httpx.Request) -> httpx.Response:
+    """Local stand-in for the HPC user service `/me` endpoint."""
+    if request.url.host == FILE_HOST:
+        return stub_file_host(request)
+    token = request.headers.get("Authorization", "").removeprefix("Bearer ")
+    if not request.url.path.endswith("/me") or not token.startswith("user-"):
+        return httpx.Response(401, json={"data": None})
+    user_id = int(token.removeprefix("user-"))
+    return httpx.Response(
+        200,
+        json={
+            "data": {
+                "id": user_id,
+                "full_name": f"Bench User {user_id}",
+                "user_type": "lecturer",
+                "is_admin": user_id == ADMIN_USER_ID,
+            }
+        },
+    )
+
+
+def git_revision() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=PACKAGE_DIR,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Recorder:
+    """Collects per-route latencies and error counts for one scenario."""
+
+    def __init__(self, client: httpx.AsyncClient):
+        self.client = client
+        self.latencies: Dict[str, List[float]] = {}
+        self.errors: Dict[str, int] = {}
+        self.statuses: Dict[str, int] = {}
+
+    async def call(self, label: str, actor: Optional[Actor], method: str, url, **kw):
+        headers = actor.headers if actor else {}
+        started = time.perf_counter()
+        try:
+            response = await self.client.request(method, url, headers=headers, **kw)
+        except Exception as e:
+            logger.error(f"{label} raised {e!r}")
+            response = None
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        self.latencies.setdefault(label, []).append(elapsed_ms)
+        code = str(response.status_code) if response is not None else "exception"
+        self.statuses[code] = self.statuses.get(code, 0) + 1
+        if response is None or response.status_code >= 400:
+            self.errors[label] = self.errors.get(label, 0) + 1
+        return response
+
+
+async def _run_scenario(
+    app, name: str, ctx, operations: int, concurrency: int, warmup: int, seed: int
+) -> dict:
+    weighted = SCENARIOS[name]
+    ops = [op for _, op in weighted]
+    weights = [w for w, _ in weighted]
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(
+        transport=transport, base_url="http://bench"
+    ) as client:
+        warm = Recorder(client)
+        warm_rng = random.Random(seed - 1)
+        for _ in range(warmup):
+            op = warm_rng.choices(ops, weights)[0]
+            await op(warm.call, ctx, warm_rng)
+
+        recorder = Recorder(client)
+        remaining = operations
+
+        async def worker(index: int):
+            nonlocal remaining
+            rng = random.Random(seed * 1000 + index)
+            while remaining > 0:
+                remaining -= 1
+                op = rng.choices(ops, weights)[0]
+                await op(recorder.call, ctx, rng)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker(i) for i in range(concurrency)))
+        duration_s = time.perf_counter() - started
+
+    all_latencies = [v for values in recorder.latencies.values() for v in values]
+    result = summarize(all_latencies, sum(recorder.errors.values()), duration_s)
+    result.update(
+        duration_s=round(duration_s, 3),
+        operations=operations,
+        statuses=recorder.statuses,
+        endpoints={
+            label: summarize(values, recorder.errors.get(label, 0), duration_s)
+            for label, values in sorted(recorder.latencies.items())
+        },
+    )
+    return result
+
+
+async def _run_all(
+    db_path: str,
+    scenarios: List[str],
+    operations: int,
+    concurrency: int,
+    warmup: int,
+    auth_mode: str,
+    actors: int,
+    seed: int,
+) -> dict:
+    work_path = os.path.abspath(db_path) + ".bench-work"
+    # Settings are read at import time, so configure the environment before
+    # the application modules are imported for the first time.
+    os.environ["DATABASE_URL"] = f"sqlite:///{work_path}"
+    os.environ["MOCK_AUTH_ENABLED"] = "true" if auth_mode == "mock" else "false"
+    os.environ.setdefault("HPC_USER_SERVICE_URL", "http://user-service.bench/api/v1")
+    # Keep the rate limiter on (its overhead is part of what is measured)
+    # but with limits the synthetic load cannot reach.
+    os.environ.setdefault(
+        "RATE_LIMITS",
+        json.dumps(
+            {g: [1e9, 10**9] for g in ("dispatches", "shelves", "stats", "admin")}
+        ),
+    )
+
+    from .. import database
+    from ..main import app
+
+    results = {}
+    for name in scenarios:
+        # Every scenario starts from a pristine copy of the dataset.
+        database.engine.dispose()
+        shutil.copyfile(db_path, work_path)
+        ctx = build_context(f"sqlite:///{work_path}", auth_mode, actors, seed)
+        async with app.router.lifespan_context(app):
+            # Also serves attachment metadata requests in mock auth mode.
+            await database.http_client_store["client"].aclose()
+            database.http_client_store["client"] = httpx.AsyncClient(
+                transport=httpx.MockTransport(stub_user_service)
+            )
+            logger.info(f"Running scenario '{name}' ({operations} operations)...")
+            results[name] = await _run_scenario(
+                app, name, ctx, operations, concurrency, warmup, seed
+            )
+            logger.info(
+                f"'{name}': {results[name]['throughput_rps']} req/s, "
+                f"p95 {results[name]['latency_ms']['p95']} ms, "
+                f"{results[name]['errors']} errors"
+            )
+    database.engine.dispose()
+    os.remove(work_path)
+    return results
+
+
+def measure_cold_start(
+    db_path: str, repeats: int = 5, target_ms: float = COLD_START_TARGET_MS
+) -> dict:
+    """
+    Median cold start of fresh interpreters against a copy of `db_path`.
+    A first, uncounted start records the schema version, as a deploy would.
+    """
+    work_path = os.path.abspath(db_path) + ".coldstart.bench-work"
+    shutil.copyfile(db_path, work_path)
+    env = {
+        "DATABASE_URL": f"sqlite:///{work_path}",
+        "MOCK_AUTH_ENABLED": "true",
+        "ARCHIVE_INTERVAL_SECONDS": "0",
+    }
+    try:
+        profile_startup(env)
+        result = median_profile(repeats, env)
+    finally:
+        os.remove(work_path)
+    result["target_ms"] = target_ms
+    result["within_target"] = result["wall_ms"] <= target_ms
+    logger.info(
+        f"Cold start: {result['wall_ms']} ms (target {target_ms} ms) "
+        f"phases {result['phases_ms']}"
+    )
+    return result
+
+
+def run(
+    db_path: str,
+    out_path: str,
+    scenarios: Optional[List[str]] = None,
+    operations: int = 1000,
+    concurrency: int = 8,
+    warmup: int = 50,
+    auth_mode: str = "mock",
+    actors: int = 20,
+    seed: int = 42,
+    cold_start_repeats: int = 3,
+    cold_start_target_ms: float = COLD_START_TARGET_MS,
+) -> dict:
+    """Runs the scenarios against a copy of `db_path` and writes a JSON report."""
+    scenarios = scenarios or list(SCENARIOS)
+    started_at = datetime.now(timezone.utc).isoformat()
+    cold_start = None
+    if cold_start_repeats:
+        # Measured first, in separate processes, before this process imports
+        # the application.
+        cold_start = measure_cold_start(
+            db_path, cold_start_repeats, cold_start_target_ms
+        )
+    results = asyncio.run(
+        _run_all(
+            db_path, scenarios, operations, concurrency, warmup, auth_mode, actors, seed
+        )
+    )
+    report = {
+        "meta": {
+            "git_revision": git_revision(),
+            "started_at": started_at,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "database": os.path.basename(db_path),
+            "auth_mode": auth_mode,
+            "operations": operations,
+            "concurrency": concurrency,
+            "warmup": warmup,
+            "seed": seed,
+        },
+        "cold_start": cold_start,
+        "scenarios": results,
+    }
+    with open(out_path, "w") as f:
+        json.dump(report, f, indent=2)
+    return report
+
+
+def compare(baseline_path: str, candidate_path: str, threshold: float = 0.10) -> bool:
+    """
+    Prints throughput and p95 deltas between two reports. Returns False when
+    any scenario regresses by more than `threshold` (a fraction).
+    """
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    with open(candidate_path) as f:
+        candidate = json.load(f)
+
+    ok = True
+    print(
+        f"baseline {baseline['meta'].get('git_revision')} -> "
+        f"candidate {candidate['meta'].get('git_revision')}"
+    )
+    new_start, old_start = candidate.get("cold_start"), baseline.get("cold_start")
+    if new_start:
+        delta = _delta(old_start["wall_ms"], new_start["wall_ms"]) if old_start else 0.0
+        print(
+            f"\ncold start {new_start['wall_ms']:.0f} ms ({delta:+6.1%}), "
+            f"target {new_start['target_ms']:.0f} ms"
+        )
+        if not new_start["within_target"] or delta > threshold:
+            ok = False
+    for name, new in candidate["scenarios"].items():
+        old = baseline["scenarios"].get(name)
+        if old is None:
+            print(f"{name}: no baseline")
+            continue
+        rows = [("TOTAL", old, new)] + [
+            (label, old["endpoints"][label], stats)
+            for label, stats in new["endpoints"].items()
+            if label in old["endpoints"]
+        ]
+        print(f"\n{name}")
+        print(f"  {'endpoint':<48} {'rps':>18} {'p95 ms':>20}")
+        for label, o, n in rows:
+            rps_delta = _delta(o["throughput_rps"], n["throughput_rps"])
+            p95_delta = _delta(o["latency_ms"]["p95"], n["latency_ms"]["p95"])
+            print(
+                f"  {label:<48} {n['throughput_rps']:>9.1f} ({rps_delta:+6.1%})"
+                f" {n['latency_ms']['p95']:>10.2f} ({p95_delta:+6.1%})"
+            )
+            if label == "TOTAL" and (rps_delta < -threshold or p95_delta > threshold):
+                ok = False
+    return ok
+
+
+def _delta(old: float, new: float) -> float:
+    return (new - old) / old if old else 0.0
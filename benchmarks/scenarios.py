@@ -0,0 +1,432 @@
+import random
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, Dict, List, Tuple
+
+from sqlalchemy import func, select
+from sqlmodel import Session, create_engine
+
+from .. import models
+from .generator import ADMIN_USER_ID, FILE_HOST, MOCK_USER_IDS
+
+MOCK_TOKENS = {101: "lecturer1", 102: "lecturer2", 103: "lecturer3", 999: "admin"}
+
+
+@dataclass
+class Actor:
+    user_id: int
+    token: str
+    dispatch_ids: List[int] = field(default_factory=list)
+    shelf_ids: List[int] = field(default_factory=list)
+
+    @property
+    def headers(self) -> dict:
+        return {"Authorization": f"Bearer {self.token}"}
+
+
+@dataclass
+class BenchContext:
+    """The users a scenario acts as, with a sample of IDs they may touch."""
+
+    actors: List[Actor]
+    admin: Actor
+    search_terms: List[str]
+
+
+def stub_token(user_id: int) -> str:
+    return f"user-{user_id}"
+
+
+def build_context(
+    database_url: str, auth_mode: str, actor_count: int, seed: int
+) -> BenchContext:
+    """Samples actors and the dispatch/shelf IDs visible to them."""
+    rng = random.Random(seed)
+    engine = create_engine(database_url)
+    with Session(engine) as session:
+        if auth_mode == "mock":
+            user_ids = MOCK_USER_IDS[:3]
+        else:
+            # Prefer the busiest creators so actors have realistic inboxes.
+            creators = session.exec(
+                select(models.Dispatch.creator_id)
+                .group_by(models.Dispatch.creator_id)
+                .order_by(func.count().desc())
+                .limit(actor_count * 4)
+            ).all()
+            user_ids = rng.sample(
+                [uid for (uid,) in creators], min(actor_count, len(creators))
+            )
+
+        actors = []
+        for user_id in user_ids:
+            token = MOCK_TOKENS[user_id] if auth_mode == "mock" else stub_token(user_id)
+            assigned = select(models.DispatchAssigneeLink.dispatch_id).where(
+                models.DispatchAssigneeLink.assignee_id == user_id
+            )
+            dispatch_ids = session.exec(
+                select(models.Dispatch.id)
+                .where(
+                    (models.Dispatch.creator_id == user_id)
+                    | (models.Dispatch.id.in_(assigned))
+                )
+                .limit(500)
+            ).all()
+            shelf_ids = session.exec(
+                select(models.Shelf.id).where(models.Shelf.user_id == user_id)
+            ).all()
+            actors.append(
+                Actor(
+                    user_id=user_id,
+                    token=token,
+                    dispatch_ids=[i for (i,) in dispatch_ids],
+                    shelf_ids=[i for (i,) in shelf_ids],
+                )
+            )
+    engine.dispose()
+
+    admin_token = (
+        MOCK_TOKENS[ADMIN_USER_ID] if auth_mode == "mock" else stub_token(ADMIN_USER_ID)
+    )
+    return BenchContext(
+        actors=actors,
+        admin=Actor(user_id=ADMIN_USER_ID, token=admin_token),
+        search_terms=["Dispatch", "Synthetic", "from user 1", "zz-no-match"],
+    )
+
+
+# An operation issues one or more requests through `call(label, actor,
+# method, url, **kwargs)`, which times each request under its route label.
+Call = Callable[..., Awaitable]
+Operation = Callable[[Call, BenchContext, random.Random], Awaitable[None]]
+
+
+def _pick(rng: random.Random, items: list):
+    return rng.choice(items) if items else None
+
+
+async def op_root(call, ctx, rng):
+    await call("GET /", None, "GET", "/")
+
+
+async def op_plug(call, ctx, rng):
+    await call("GET /plug", None, "GET", "/plug")
+
+
+async def op_health(call, ctx, rng):
+    await call("GET /health", None, "GET", "/health")
+
+
+async def op_health_live(call, ctx, rng):
+    await call("GET /health/live", None, "GET", "/health/live")
+
+
+async def op_health_ready(call, ctx, rng):
+    # Answered from the per-worker cache most of the time (see health.py).
+    await call("GET /health/ready", None, "GET", "/health/ready")
+
+
+async def op_metrics(call, ctx, rng):
+    await call("GET /metrics", None, "GET", "/metrics")
+
+
+async def op_list_dispatches(call, ctx, rng):
+    actor = rng.choice(ctx.actors)
+    params = {
+        "direction": rng.choice([None, "incoming", "outgoing"]),
+        "status": rng.choice([None, None, "pending", "completed"]),
+        "sort_by": rng.choice(["created_at", "title", "status"]),
+        "limit": rng.choice([20, 50, 100]),
+        "skip": rng.choice([0, 0, 0, 100]),
+    }
+    params = {k: v for k, v in params.items() if v is not None}
+    await call("GET /dispatches", actor, "GET", "/dispatches", params=params)
+
+
+async def op_search_dispatches(call, ctx, rng):
+    actor = rng.choice(ctx.actors)
+    params = {"search": rng.choice(ctx.search_terms), "limit": 20}
+    await call("GET /dispatches?search", actor, "GET", "/dispatches", params=params)
+
+
+async def op_list_shelf_dispatches(call, ctx, rng):
+    actor = rng.choice(ctx.actors)
+    shelf_id = _pick(rng, actor.shelf_ids)
+    if shelf_id is None:
+        return
+    params = {"shelf_id": shelf_id, "limit": 50}
+    await call("GET /dispatches?shelf_id", actor, "GET", "/dispatches", params=params)
+
+
+async def op_dispatch_details(call, ctx, rng):
+    actor = rng.choice(ctx.actors)
+    dispatch_id = _pick(rng, actor.dispatch_ids)
+    if dispatch_id is None:
+        return
+    await call("GET /dispatches/{id}", actor, "GET", f"/dispatches/{dispatch_id}")
+
+
+async def _dispatch_entries(call, ctx, rng, name: str):
+    """First page of a comments/history sub-resource, then the next one."""
+    actor = rng.choice(ctx.actors)
+    dispatch_id = _pick(rng, actor.dispatch_ids)
+    if dispatch_id is None:
+        return
+    label = f"GET /dispatches/{{id}}/{name}"
+    url = f"/dispatches/{dispatch_id}/{name}"
+    params = {"limit": rng.choice([10, 50]), "order": rng.choice(["asc", "desc"])}
+    response = await call(label, actor, "GET", url, params=params)
+    if response is None or response.status_code != 200:
+        return
+    next_cursor = response.json()["next_cursor"]
+    if next_cursor is not None:
+        await call(label, actor, "GET", url, params={**params, "cursor": next_cursor})
+
+
+async def op_dispatch_comments(call, ctx, rng):
+    await _dispatch_entries(call, ctx, rng, "comments")
+
+
+async def op_dispatch_history(call, ctx, rng):
+    await _dispatch_entries(call, ctx, rng, "history")
+
+
+async def op_dispatch_lifecycle(call, ctx, rng):
+    """create -> update -> send -> status -> comment -> forward."""
+    picked = rng.sample(ctx.actors, min(3, len(ctx.actors)))
+    creator, assignee, other = (picked * 3)[:3]
+    response = await call(
+        "POST /dispatches",
+        creator,
+        "POST",
+        "/dispatches",
+        json={
+            "title": f"Bench dispatch {rng.getrandbits(32):08x}",
+            "content": "Created by the benchmark suite",
+            "assignee_ids": [assignee.user_id],
+            "files": [f"https://{FILE_HOST}/bench/report.pdf"],
+        },
+    )
+    if response is None or response.status_code != 201:
+        return
+    dispatch_id = response.json()["id"]
+    await call(
+        "PUT /dispatches/{id}",
+        creator,
+        "PUT",
+        f"/dispatches/{dispatch_id}",
+        json={"content": "Updated by the benchmark suite"},
+    )
+    await call(
+        "POST /dispatches/{id}/send",
+        creator,
+        "POST",
+        f"/dispatches/{dispatch_id}/send",
+    )
+    await call(
+        "PUT /dispatches/{id}/status",
+        assignee,
+        "PUT",
+        f"/dispatches/{dispatch_id}/status",
+        json={"status": "in_progress"},
+    )
+    await call(
+        "POST /dispatches/{id}/comments",
+        assignee,
+        "POST",
+        f"/dispatches/{dispatch_id}/comments",
+        json={"content": "On it."},
+    )
+    await call(
+        "POST /dispatches/{id}/forward",
+        assignee,
+        "POST",
+        f"/dispatches/{dispatch_id}/forward",
+        json={"new_assignee_id": other.user_id},
+    )
+    creator.dispatch_ids.append(dispatch_id)
+    assignee.dispatch_ids.append(dispatch_id)
+
+
+async def op_draft_delete(call, ctx, rng):
+    creator = rng.choice(ctx.actors)
+    response = await call(
+        "POST /dispatches",
+        creator,
+        "POST",
+        "/dispatches",
+        json={
+            "title": "Throwaway draft",
+            "content": "Deleted right away",
+            "assignee_ids": [rng.choice(ctx.actors).user_id],
+            "files": [],
+        },
+    )
+    if response is None or response.status_code != 201:
+        return
+    await call(
+        "DELETE /dispatches/{id}",
+        creator,
+        "DELETE",
+        f"/dispatches/{response.json()['id']}",
+    )
+
+
+async def op_list_shelves(call, ctx, rng):
+    actor = rng.choice(ctx.actors)
+    await call("GET /shelves", actor, "GET", "/shelves")
+
+
+async def op_shelf_details(call, ctx, rng):
+    actor = rng.choice(ctx.actors)
+    shelf_id = _pick(rng, actor.shelf_ids)
+    if shelf_id is None:
+        return
+    await call("GET /shelves/{id}", actor, "GET", f"/shelves/{shelf_id}")
+
+
+async def op_shelf_lifecycle(call, ctx, rng):
+    """create -> rename -> add dispatch -> remove dispatch -> delete."""
+    actor = rng.choice(ctx.actors)
+    response = await call(
+        "POST /shelves",
+        actor,
+        "POST",
+        "/shelves",
+        json={"name": "Bench shelf", "parent_id": _pick(rng, actor.shelf_ids)},
+    )
+    if response is None or response.status_code != 201:
+        return
+    shelf = response.json()
+    await call(
+        "PUT /shelves/{id}",
+        actor,
+        "PUT",
+        f"/shelves/{shelf['id']}",
+        json={"name": "Bench shelf (renamed)", "parent_id": shelf["parent_id"]},
+    )
+    dispatch_id = _pick(rng, actor.dispatch_ids)
+    if dispatch_id is not None:
+        link = f"/shelves/{shelf['id']}/dispatches/{dispatch_id}"
+        await call("POST /shelves/{id}/dispatches/{dispatch_id}", actor, "POST", link)
+        await call(
+            "DELETE /shelves/{id}/dispatches/{dispatch_id}", actor, "DELETE", link
+        )
+    await call("DELETE /shelves/{id}", actor, "DELETE", f"/shelves/{shelf['id']}")
+
+
+async def op_shelf_bulk(call, ctx, rng):
+    """create two shelves -> bulk-add -> bulk-move -> bulk-remove -> delete."""
+    actor = rng.choice(ctx.actors)
+    if not actor.dispatch_ids:
+        return
+    shelves = []
+    for name in ("Bench bulk source", "Bench bulk target"):
+        response = await call(
+            "POST /shelves", actor, "POST", "/shelves", json={"name": name}
+        )
+        if response is None or response.status_code != 201:
+            break
+        shelves.append(response.json()["id"])
+    if len(shelves) == 2:
+        source, target = shelves
+        ids = rng.sample(actor.dispatch_ids, min(20, len(actor.dispatch_ids)))
+        base = f"/shelves/{source}/dispatches"
+        await call(
+            "POST /shelves/{id}/dispatches/bulk-add",
+            actor,
+            "POST",
+            f"{base}/bulk-add",
+            json={"dispatch_ids": ids},
+        )
+        await call(
+            "POST /shelves/{id}/dispatches/bulk-move",
+            actor,
+            "POST",
+            f"{base}/bulk-move",
+            json={"dispatch_ids": ids, "target_shelf_id": target},
+        )
+        await call(
+            "POST /shelves/{id}/dispatches/bulk-remove",
+            actor,
+            "POST",
+            f"/shelves/{target}/dispatches/bulk-remove",
+            json={"dispatch_ids": ids},
+        )
+    for shelf_id in shelves:
+        await call("DELETE /shelves/{id}", actor, "DELETE", f"/shelves/{shelf_id}")
+
+
+async def op_my_stats(call, ctx, rng):
+    actor = rng.choice(ctx.actors)
+    await call("GET /dispatches/stats/my", actor, "GET", "/dispatches/stats/my")
+
+
+async def op_system_stats(call, ctx, rng):
+    await call(
+        "GET /dispatches/stats/system", ctx.admin, "GET", "/dispatches/stats/system"
+    )
+
+
+async def op_admin_dispatches(call, ctx, rng):
+    params = {
+        "status": rng.choice([None, "pending", "completed"]),
+        "creator_id": rng.choice([None, rng.choice(ctx.actors).user_id]),
+        "limit": 50,
+    }
+    params = {k: v for k, v in params.items() if v is not None}
+    await call(
+        "GET /admin/dispatches", ctx.admin, "GET", "/admin/dispatches", params=params
+    )
+
+
+SCENARIOS: Dict[str, List[Tuple[int, Operation]]] = {
+    # Every router endpoint, equally weighted.
+    "all_endpoints": [
+        (1, op)
+        for op in [
+            op_root,
+            op_plug,
+            op_health,
+            op_health_live,
+            op_health_ready,
+            op_metrics,
+            op_list_dispatches,
+            op_search_dispatches,
+            op_list_shelf_dispatches,
+            op_dispatch_details,
+            op_dispatch_comments,
+            op_dispatch_history,
+            op_dispatch_lifecycle,
+            op_draft_delete,
+            op_list_shelves,
+            op_shelf_details,
+            op_shelf_lifecycle,
+            op_shelf_bulk,
+            op_my_stats,
+            op_system_stats,
+            op_admin_dispatches,
+        ]
+    ],
+    # Typical frontend traffic: mostly inbox listings and detail views.
+    "read_mostly": [
+        (40, op_list_dispatches),
+        (25, op_dispatch_details),
+        (5, op_search_dispatches),
+        (5, op_list_shelf_dispatches),
+        (5, op_my_stats),
+        (10, op_list_shelves),
+        (5, op_dispatch_lifecycle),
+        (5, op_shelf_lifecycle),
+    ],
+    "write_heavy": [
+        (50, op_dispatch_lifecycle),
+        (10, op_draft_delete),
+        (15, op_shelf_lifecycle),
+        (15, op_dispatch_details),
+        (10, op_list_dispatches),
+    ],
+    "admin": [
+        (40, op_system_stats),
+        (60, op_admin_dispatches),
+    ],
+}
@@ -0,0 +1,169 @@
+"""
+Scheduler check: scheduled sends and overdue flags with competing workers.
+
+Runs the app (whose own scheduler learns about new deadlines as they are
+committed) next to extra scheduler instances standing in for other workers,
+which only see deadlines through their frequent resyncs. Then checks that:
+
+- send: every scheduled DRAFT was sent once, by the scheduler; the first
+  one within WAKE_LATENESS_MS of `scheduled_at` (the scheduler woke up on
+  time rather than at a poll) and the last within MAX_LATENESS_MS;
+- overdue: every open dispatch past its `due_at` was flagged exactly once;
+- closed: dispatches completed before their deadline were left alone;
+- leases: no lease is left behind.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import tempfile
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List
+
+import httpx
+from sqlalchemy import create_engine, text
+
+logger = logging.getLogger(__name__)
+
+CREATOR = {"Authorization": "Bearer lecturer1"}
+ASSIGNEE = {"Authorization": "Bearer lecturer2"}
+# How late the first and the last of the scheduled sends may fire.
+WAKE_LATENESS_MS = 250.0
+MAX_LATENESS_MS = 5000.0
+
+
+def _leftover_leases(url: str) -> int:
+    engine = create_engine(url)
+    try:
+        with engine.connect() as conn:
+            return conn.execute(
+                text(
+                    "SELECT count(*) FROM dispatch "
+                    "WHERE scheduler_lease_until IS NOT NULL"
+                )
+            ).scalar_one()
+    finally:
+        engine.dispose()
+
+
+async def _check(
+    client: httpx.AsyncClient, url: str, dispatches: int
+) -> Dict[str, List[str]]:
+    violations: Dict[str, List[str]] = {}
+    lateness: List[float] = []
+
+    def fail(check: str, message: str):
+        violations.setdefault(check, []).append(message)
+
+    now = datetime.now(timezone.utc)
+    send_at = now + timedelta(seconds=1.5)
+    due_at = now + timedelta(seconds=2.5)
+
+    async def create(scheduled_at) -> dict:
+        response = await client.post(
+            "/dispatches",
+            headers=CREATOR,
+            json={
+                "title": "scheduled",
+                "content": "c",
+                "assignee_ids": [102],
+                "files": [],
+                "scheduled_at": scheduled_at and scheduled_at.isoformat(),
+                "due_at": due_at.isoformat(),
+            },
+        )
+        return response.json()
+
+    scheduled = await asyncio.gather(*(create(send_at) for _ in range(dispatches)))
+    closed = await asyncio.gather(*(create(None) for _ in range(dispatches // 4 + 1)))
+    for dispatch in closed:
+        await client.post(f"/dispatches/{dispatch['id']}/send", headers=CREATOR)
+        await client.put(
+            f"/dispatches/{dispatch['id']}/status",
+            headers=ASSIGNEE,
+            json={"status": "completed"},
+        )
+
+    await asyncio.sleep((due_at - datetime.now(timezone.utc)).total_seconds() + 1.5)
+
+    async def history(dispatch_id: int) -> dict:
+        response = await client.get(f"/dispatches/{dispatch_id}", headers=CREATOR)
+        return response.json()
+
+    for dispatch in scheduled:
+        details = await history(dispatch["id"])
+        sent = [h for h in details["history"] if h["action"] == "sent"]
+        overdue = [h for h in details["history"] if h["action"] == "overdue"]
+        if details["status"] != "pending" or len(sent) != 1:
+            fail("send", f"{dispatch['id']}: {details['status']}, {len(sent)} sent")
+        elif sent[0]["details"] != "Sent as scheduled":
+            fail("send", f"{dispatch['id']}: sent by hand ({sent[0]['details']})")
+        else:
+            fired = datetime.fromisoformat(sent[0]["timestamp"])
+            late_ms = (fired - send_at.replace(tzinfo=None)).total_seconds() * 1000
+            lateness.append(late_ms)
+        if len(overdue) != 1 or not details["overdue_at"]:
+            fail("overdue", f"{dispatch['id']}: flagged {len(overdue)} times")
+    for dispatch in closed:
+        details = await history(dispatch["id"])
+        if details["overdue_at"] or any(
+            h["action"] == "overdue" for h in details["history"]
+        ):
+            fail("closed", f"{dispatch['id']}: flagged after completion")
+
+    leases = await asyncio.to_thread(_leftover_leases, url)
+    if leases:
+        fail("leases", f"{leases} lease(s) left behind")
+    if lateness:
+        first, last = min(lateness), max(lateness)
+        logger.info(f"Scheduled sends fired {first:.0f}-{last:.0f} ms late")
+        if first > WAKE_LATENESS_MS or last > MAX_LATENESS_MS:
+            fail("send", f"sends fired {first:.0f}-{last:.0f} ms late")
+    return violations
+
+
+async def _run(url: str, dispatches: int, workers: int) -> Dict[str, List[str]]:
+    from ..main import app
+    from ..scheduler import DispatchScheduler
+
+    async with app.router.lifespan_context(app):
+        others = [DispatchScheduler() for _ in range(workers - 1)]
+        tasks = [asyncio.create_task(s.run()) for s in others]
+        transport = httpx.ASGITransport(app=app, raise_app_exceptions=False)
+        try:
+            async with httpx.AsyncClient(
+                transport=transport, base_url="http://bench"
+            ) as client:
+                return await _check(client, url, dispatches)
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+
+def run_scheduling_check(dispatches: int = 50, workers: int = 4) -> dict:
+    """Runs the checks on a fresh temporary SQLite database."""
+    work_dir = tempfile.mkdtemp(prefix="hpc-dispatch-scheduler-")
+    url = f"sqlite:///{os.path.join(work_dir, 'scheduler.db')}"
+    # Settings are read at import time (see runner.run).
+    os.environ["DATABASE_URL"] = url
+    os.environ["MOCK_AUTH_ENABLED"] = "true"
+    os.environ["RATE_LIMIT_ENABLED"] = "false"
+    os.environ["FILE_METADATA_ENABLED"] = "false"
+    # Other workers only learn about deadlines by resyncing.
+    os.environ["SCHEDULER_RESYNC_SECONDS"] = "0.2"
+    try:
+        violations = asyncio.run(_run(url, dispatches, workers))
+    finally:
+        for name in os.listdir(work_dir):
+            os.remove(os.path.join(work_dir, name))
+        os.rmdir(work_dir)
+    result = {
+        "dispatches": dispatches,
+        "workers": workers,
+        "passed": not violations,
+        "violations": violations,
+    }
+    logger.info(f"Scheduler result: {json.dumps(violations)}")
+    return result
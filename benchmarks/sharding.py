@@ -0,0 +1,172 @@
+"""
+Department sharding check on local SQLite files.
+
+Runs the app with a default shard plus one shard per mock department
+("cs": lecturer1 and lecturer2, "math": lecturer3) and checks that:
+
+- routing: each department's dispatches land in its own database file,
+  and none in the default shard (the admin's);
+- isolation: listings only show the caller's shard;
+- fan-out: admin stats and the admin listing cover every shard;
+- targeting: admins reach another shard's dispatch with `X-Shard`;
+- assignees: dispatches cannot be assigned or forwarded to users of a
+  department on another shard, who would never see them.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import tempfile
+from typing import Dict, List
+
+import httpx
+from sqlalchemy import create_engine, text
+
+logger = logging.getLogger(__name__)
+
+LECTURER = {"Authorization": "Bearer lecturer1"}  # cs
+COLLEAGUE = {"Authorization": "Bearer lecturer2"}  # cs
+MATH = {"Authorization": "Bearer lecturer3"}  # math
+ADMIN = {"Authorization": "Bearer admin"}  # no department: default shard
+SHARDS = ["cs", "math"]
+
+
+def _count_dispatches(url: str) -> int:
+    engine = create_engine(url)
+    try:
+        with engine.connect() as conn:
+            return conn.execute(text("SELECT count(*) FROM dispatch")).scalar_one()
+    finally:
+        engine.dispose()
+
+
+async def _check(
+    client: httpx.AsyncClient, urls: Dict[str, str], dispatches: int
+) -> Dict[str, List[str]]:
+    violations: Dict[str, List[str]] = {}
+
+    def fail(check: str, message: str):
+        violations.setdefault(check, []).append(message)
+
+    async def create(headers: dict, assignee_id: int) -> dict:
+        response = await client.post(
+            "/dispatches",
+            headers=headers,
+            json={
+                "title": "sharded",
+                "content": "c",
+                "assignee_ids": [assignee_id],
+                "files": [],
+            },
+        )
+        return response.json()
+
+    await asyncio.gather(
+        *(create(LECTURER, 102) for _ in range(dispatches)),
+        *(create(MATH, 103) for _ in range(dispatches)),
+    )
+    math_dispatch = await create(MATH, 103)
+    per_shard = {"default": 0, "cs": dispatches, "math": dispatches + 1}
+
+    for shard, expected in per_shard.items():
+        found = await asyncio.to_thread(_count_dispatches, urls[shard])
+        if found != expected:
+            fail("routing", f"{shard}: {found} dispatches stored, expected {expected}")
+
+    for headers, expected in ((COLLEAGUE, dispatches), (MATH, dispatches + 1)):
+        page = (await client.get("/dispatches", headers=headers)).json()
+        if page["total"] != expected:
+            fail("isolation", f"{headers}: listing total {page['total']}")
+
+    total = sum(per_shard.values())
+    stats = (await client.get("/dispatches/stats/system", headers=ADMIN)).json()
+    if stats["total_dispatches"] != total:
+        fail("fan_out", f"stats total {stats['total_dispatches']}, expected {total}")
+    creators = {s["user_id"]: s["count"] for s in stats["top_creators"]}
+    if creators != {101: dispatches, 103: dispatches + 1}:
+        fail("fan_out", f"top creators {creators}")
+    page = (
+        await client.get("/admin/dispatches", headers=ADMIN, params={"limit": total})
+    ).json()
+    shards = sorted({d["shard"] for d in page["items"]})
+    if page["total"] != total or len(page["items"]) != total or shards != SHARDS:
+        fail(
+            "fan_out",
+            f"listing total {page['total']}, {len(page['items'])} items from {shards}",
+        )
+
+    path = f"/dispatches/{math_dispatch['id']}"
+    targeted = await client.get(path, headers={**ADMIN, "X-Shard": "math"})
+    if targeted.status_code != 200 or targeted.json()["creator_id"] != 103:
+        fail("targeting", f"X-Shard: math answered {targeted.status_code}")
+    own = await client.get(path, headers=ADMIN)
+    if own.status_code != 404:
+        fail("targeting", f"admin's own shard answered {own.status_code}")
+
+    cs_body = {"title": "cross", "content": "c", "assignee_ids": [103], "files": []}
+    attempts = {
+        "create cs -> math": await client.post(
+            "/dispatches", headers=LECTURER, json=cs_body
+        ),
+        "create default -> cs": await client.post(
+            "/dispatches", headers=ADMIN, json=dict(cs_body, assignee_ids=[102])
+        ),
+    }
+    draft = (
+        await client.post(
+            "/dispatches", headers=LECTURER, json=dict(cs_body, assignee_ids=[102])
+        )
+    ).json()
+    attempts["update cs -> math"] = await client.put(
+        f"/dispatches/{draft['id']}", headers=LECTURER, json={"assignee_ids": [103]}
+    )
+    await client.post(f"{path}/send", headers=MATH)
+    attempts["forward math -> cs"] = await client.post(
+        f"{path}/forward", headers=MATH, json={"new_assignee_id": 101}
+    )
+    for name, response in attempts.items():
+        if response.status_code != 400:
+            fail("assignees", f"{name} answered {response.status_code}")
+    return violations
+
+
+async def _run(urls: Dict[str, str], dispatches: int) -> Dict[str, List[str]]:
+    from ..main import app
+
+    async with app.router.lifespan_context(app):
+        transport = httpx.ASGITransport(app=app, raise_app_exceptions=False)
+        async with httpx.AsyncClient(
+            transport=transport, base_url="http://bench"
+        ) as client:
+            return await _check(client, urls, dispatches)
+
+
+def run_sharding_check(dispatches: int = 20) -> dict:
+    """Runs the checks on fresh temporary SQLite shards."""
+    work_dir = tempfile.mkdtemp(prefix="hpc-dispatch-shards-")
+    urls = {
+        shard: f"sqlite:///{os.path.join(work_dir, f'{shard}.db')}"
+        for shard in ["default", *SHARDS]
+    }
+    # Settings are read at import time (see runner.run).
+    os.environ["DATABASE_URL"] = urls["default"]
+    os.environ["SHARD_DATABASE_URLS"] = json.dumps({s: urls[s] for s in SHARDS})
+    os.environ["SHARD_MAP"] = json.dumps({s: s for s in SHARDS})
+    os.environ["MOCK_AUTH_ENABLED"] = "true"
+    os.environ["RATE_LIMIT_ENABLED"] = "false"
+    os.environ["FILE_METADATA_ENABLED"] = "false"
+    try:
+        violations = asyncio.run(_run(urls, dispatches))
+    finally:
+        for name in os.listdir(work_dir):
+            os.remove(os.path.join(work_dir, name))
+        os.rmdir(work_dir)
+    result = {
+        "shards": ["default", *SHARDS],
+        "dispatches": dispatches,
+        "passed": not violations,
+        "violations": violations,
+    }
+    logger.info(f"Sharding result: {json.dumps(violations)}")
+    return result
@@ -1,12 +1,21 @@
 from pydantic_settings import BaseSettings
-from typing import List
+from typing import Dict, List, Optional, Tuple
 
 
 class AppSettings(BaseSettings):
     """Manages application settings using environment variables."""
 
     DATABASE_URL: str = "sqlite:///./dispatch.db"
+    # Department sharding (see database.py): extra databases by shard name
+    # and department -> shard. Departments not in the map, and users without
+    # one, stay on the "default" shard (DATABASE_URL). No extra databases
+    # means no sharding.
+    SHARD_DATABASE_URLS: Dict[str, str] = {}
+    SHARD_MAP: Dict[str, str] = {}
+    SHARD_FANOUT_WORKERS: int = 8
     HPC_USER_SERVICE_URL: str = "http://127.0.0.1:8090/api/v1"
+    # Batch profile lookup: GET {URL}{PATH}?ids=1,2,3 -> {"data": [user, ...]}
+    HPC_USER_SERVICE_BATCH_PATH: str = "/users"
     CORS_ORIGINS: List[str] = [
         "http://localhost",
         "http://localhost:3000",
@@ -15,6 +24,178 @@ class AppSettings(BaseSettings):
     ]
     MOCK_AUTH_ENABLED: bool = False
 
+    # SQL profiling (opt-in). Budgets are keyed by "METHOD /route/{template}";
+    # a budget of 0 means unlimited.
+    SQL_PROFILING_ENABLED: bool = False
+    SQL_SLOW_QUERY_MS: float = 100.0
+    SQL_QUERY_BUDGET: int = 0
+    SQL_QUERY_BUDGETS: Dict[str, int] = {}
+    SQL_QUERY_BUDGET_STRICT: bool = False
+
+    # Archiving of closed dispatches. Without ARCHIVE_DATABASE_URL the archive
+    # tables live in the main database; an interval of 0 disables the
+    # in-process job (run `python -m hpc_dispatch.archive` instead).
+    ARCHIVE_DATABASE_URL: Optional[str] = None
+    ARCHIVE_AFTER_DAYS: int = 365
+    ARCHIVE_BATCH_SIZE: int = 500
+    ARCHIVE_INTERVAL_SECONDS: int = 0
+
+    # Dispatch history writes: "sync" writes them in the request transaction,
+    # "async" batches them through the audit pipeline (see audit.py).
+    AUDIT_MODE: str = "sync"
+    AUDIT_QUEUE_SIZE: int = 10_000
+    AUDIT_BATCH_SIZE: int = 500
+    AUDIT_FLUSH_INTERVAL_SECONDS: float = 0.5
+    AUDIT_SPOOL_DIR: str = "./audit_spool"
+    AUDIT_SPOOL_FSYNC: bool = True
+
+    # User profile resolution for `expand=users`. Entries older than the TTL
+    # are still served for USER_CACHE_STALE_SECONDS while being refreshed.
+    USER_CACHE_TTL_SECONDS: float = 300.0
+    USER_CACHE_STALE_SECONDS: float = 3600.0
+    USER_CACHE_MAX_SIZE: int = 50_000
+    USER_LOOKUP_TIMEOUT_SECONDS: float = 0.5
+    USER_LOOKUP_BATCH_SIZE: int = 100
+
+    # Token-bucket rate limits per route group: (tokens per second, burst),
+    # per user. The "shared" backend keeps the buckets in a memory-mapped
+    # file so all workers on a host share them; "memory" is per process.
+    RATE_LIMIT_ENABLED: bool = True
+    RATE_LIMITS: Dict[str, Tuple[float, int]] = {
+        "dispatches": (10.0, 60),
+        "shelves": (10.0, 60),
+        "stats": (1.0, 10),
+        "admin": (2.0, 20),
+    }
+    RATE_LIMIT_BACKEND: str = "memory"
+    RATE_LIMIT_SHARED_PATH: str = "/dev/shm/hpc_dispatch_ratelimit"
+    RATE_LIMIT_MAX_KEYS: int = 100_000
+
+    # Admission control (per worker): concurrent requests per route class and
+    # in total (sized to the threadpool), and how many requests may queue and
+    # for how long before being shed with a 503. Bypass paths are never
+    # queued; expensive paths are admitted after writes and plain reads.
+    ADMISSION_ENABLED: bool = True
+    ADMISSION_MAX_CONCURRENCY: int = 40
+    ADMISSION_LIMITS: Dict[str, int] = {"write": 40, "read": 32, "expensive": 4}
+    ADMISSION_QUEUE_SIZES: Dict[str, int] = {
+        "write": 200,
+        "read": 100,
+        "expensive": 10,
+    }
+    ADMISSION_MAX_WAIT_MS: Dict[str, float] = {
+        "write": 5000.0,
+        "read": 2000.0,
+        "expensive": 1000.0,
+    }
+    ADMISSION_BYPASS_PATHS: List[str] = [
+        "/health",
+        "/health/live",
+        "/health/ready",
+        "/metrics",
+    ]
+    ADMISSION_EXPENSIVE_PATHS: List[str] = [
+        "/dispatches/stats/system",
+        "/admin/dispatches",
+    ]
+
+    # Readiness probes (/health/ready): results are cached per worker for
+    # HEALTH_CACHE_SECONDS. A dependency slower than its threshold, or a pool
+    # with less free headroom than the given fraction, is reported degraded.
+    HEALTH_CACHE_SECONDS: float = 2.0
+    HEALTH_PROBE_TIMEOUT_SECONDS: float = 1.0
+    HEALTH_DB_DEGRADED_MS: float = 100.0
+    HEALTH_POOL_MIN_HEADROOM: float = 0.2
+    HEALTH_USER_SERVICE_PATH: str = "/health"
+    HEALTH_USER_SERVICE_DEGRADED_MS: float = 300.0
+
+    # Idempotency-Key support on the mutating dispatch POSTs. Stored responses
+    # expire after the TTL; a duplicate waits up to IDEMPOTENCY_WAIT_SECONDS
+    # for the original, which is presumed dead after IDEMPOTENCY_LOCK_SECONDS.
+    IDEMPOTENCY_TTL_SECONDS: int = 86_400
+    IDEMPOTENCY_LOCK_SECONDS: int = 60
+    IDEMPOTENCY_WAIT_SECONDS: float = 10.0
+    IDEMPOTENCY_PURGE_INTERVAL_SECONDS: float = 60.0
+    IDEMPOTENCY_PURGE_BATCH_SIZE: int = 1000
+
+    # Transactional outbox for downstream consumers. Events are only written
+    # when a sink is configured: "file" (JSON lines, a local queue stand-in)
+    # or "webhook". The relay runs in-process unless disabled, e.g. to run
+    # `python -m hpc_dispatch.outbox` separately. However many relays run,
+    # one per shard delivers at a time, holding a lease that must outlast the
+    # delivery of a batch (webhook retries included).
+    OUTBOX_SINK: Optional[str] = None
+    OUTBOX_FILE_PATH: str = "./outbox_events.jsonl"
+    OUTBOX_WEBHOOK_URL: Optional[str] = None
+    OUTBOX_WEBHOOK_SECRET: Optional[str] = None
+    OUTBOX_WEBHOOK_RETRIES: int = 3
+    OUTBOX_WEBHOOK_TIMEOUT_SECONDS: float = 5.0
+    OUTBOX_RELAY_IN_PROCESS: bool = True
+    OUTBOX_BATCH_SIZE: int = 100
+    OUTBOX_POLL_INTERVAL_SECONDS: float = 1.0
+    OUTBOX_BACKOFF_MAX_SECONDS: float = 60.0
+    OUTBOX_RETENTION_HOURS: int = 72
+    OUTBOX_LEASE_SECONDS: int = 60
+
+    # Attempts of a dispatch write that keeps losing optimistic-concurrency
+    # races (see versioning.py) before answering 409.
+    DISPATCH_WRITE_RETRIES: int = 3
+
+    # Dispatch access checks (see access.py): relations are cached per worker
+    # for the TTL and dropped on assignment changes made by this worker; a
+    # TTL of 0 disables the cache.
+    ACCESS_CACHE_TTL_SECONDS: float = 5.0
+    ACCESS_CACHE_MAX_SIZE: int = 10_000
+
+    # Scheduled sends and overdue flags (see scheduler.py). Each worker wakes
+    # at the earliest deadline it knows of, and rereads the upcoming ones
+    # (BATCH_SIZE per kind and shard) every RESYNC seconds to catch those set
+    # through other workers. A job is leased to one worker for LEASE seconds;
+    # up to CONCURRENCY due jobs run at once.
+    SCHEDULER_ENABLED: bool = True
+    SCHEDULER_RESYNC_SECONDS: float = 30.0
+    SCHEDULER_BATCH_SIZE: int = 500
+    SCHEDULER_CONCURRENCY: int = 4
+    SCHEDULER_LEASE_SECONDS: int = 60
+
+    # Most dispatch IDs accepted by one bulk shelf add/remove/move call.
+    SHELF_BULK_MAX_ITEMS: int = 1000
+
+    # Attachment metadata (see attachments.py). New files are HEADed after
+    # their dispatch is created, at most FILE_METADATA_CONCURRENCY requests at
+    # a time per worker; a background pass re-checks metadata older than the
+    # max age (failures sooner). Only the listed hosts (and their subdomains)
+    # are contacted, so an empty list turns the feature off; private addresses
+    # are refused unless allowed, loopback and link-local ones always.
+    FILE_METADATA_ENABLED: bool = True
+    FILE_METADATA_CONCURRENCY: int = 8
+    FILE_METADATA_RETRIES: int = 3
+    FILE_METADATA_TIMEOUT_SECONDS: float = 5.0
+    FILE_METADATA_ALLOWED_HOSTS: List[str] = []
+    FILE_METADATA_ALLOW_PRIVATE_ADDRESSES: bool = False
+    FILE_METADATA_MAX_AGE_HOURS: int = 24
+    FILE_METADATA_ERROR_RETRY_MINUTES: int = 15
+    FILE_METADATA_REFRESH_INTERVAL_SECONDS: int = 300
+    FILE_METADATA_REFRESH_BATCH_SIZE: int = 100
+
+    # Multi-process server (`python -m hpc_dispatch.server`). 0 workers means
+    # one per CPU core. The server applies the schema once before forking and
+    # turns SCHEMA_SETUP_ON_STARTUP off in its workers.
+    SERVER_HOST: str = "0.0.0.0"
+    SERVER_PORT: int = 8000
+    SERVER_WORKERS: int = 0
+    SERVER_GRACEFUL_TIMEOUT_SECONDS: int = 30
+    SCHEMA_SETUP_ON_STARTUP: bool = True
+
+    # Versioned migrations (see migrations.py), applied during schema setup
+    # unless disabled. Backfills (e.g. filling the inbox) write rows in
+    # batches with a pause between them; DDL gives up on a lock after the timeout (Postgres) and retries.
+    MIGRATIONS_ON_STARTUP: bool = True
+    MIGRATION_LOCK_TIMEOUT_MS: int = 5000
+    MIGRATION_DDL_RETRIES: int = 5
+    MIGRATION_BACKFILL_BATCH_SIZE: int = 1000
+    MIGRATION_BACKFILL_PAUSE_SECONDS: float = 0.05
+
     class Config:
         env_file = ".env"
         env_file_encoding = "utf-8"
@@ -1,26 +1,211 @@
+import functools
+import hashlib
+import logging
+import ssl
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Callable, Dict, Optional, TypeVar
+
+from fastapi import Depends, Header, HTTPException, status
+from sqlalchemy import Column, DateTime, MetaData, String, Table, exc, select
+from sqlalchemy.engine import Engine
 from sqlmodel import create_engine, SQLModel, Session
 import httpx
+from .auth import get_current_user
 from .config import settings
+from .models import User
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
 
 # Database setup
 engine = create_engine(settings.DATABASE_URL, echo=False)
 
+# Department sharding: every shard is a complete database of its own (live,
+# archive and bookkeeping tables), and a department's dispatches, shelves
+# and inbox live on exactly one shard. "default" is DATABASE_URL.
+DEFAULT_SHARD = "default"
+shard_engines: Dict[str, Engine] = {DEFAULT_SHARD: engine}
+for _name, _url in settings.SHARD_DATABASE_URLS.items():
+    if _name == DEFAULT_SHARD:
+        raise ValueError(f"Shard name {DEFAULT_SHARD!r} is reserved for DATABASE_URL")
+    shard_engines[_name] = create_engine(_url, echo=False)
+_unknown = set(settings.SHARD_MAP.values()) - set(shard_engines)
+if _unknown:
+    raise ValueError(f"SHARD_MAP refers to unknown shards: {sorted(_unknown)}")
+SHARDED = len(shard_engines) > 1
+
 # Shared httpx client store
 # This will be populated during the application's lifespan
 http_client_store: dict = {}
 
 
+# One row per schema component ("main", "archive") holding a fingerprint of
+# the table definitions last applied, so startup can skip `create_all` (and
+# its per-table catalog queries) when nothing changed.
+schema_metadata = MetaData()
+schema_version = Table(
+    "schema_version",
+    schema_metadata,
+    Column("component", String, primary_key=True),
+    Column("fingerprint", String, nullable=False),
+    Column("applied_at", DateTime, nullable=False),
+)
+
+
+def schema_fingerprint(metadata: MetaData) -> str:
+    """Stable hash of the tables, columns, indexes and foreign keys."""
+    parts = []
+    for name in sorted(metadata.tables):
+        table = metadata.tables[name]
+        parts.append(f"table {name}")
+        for column in table.columns:
+            parts.append(
+                f"  column {column.name} {column.type!r} "
+                f"nullable={column.nullable} pk={column.primary_key}"
+            )
+        for index in sorted(table.indexes, key=lambda i: i.name or ""):
+            columns = ",".join(c.name for c in index.columns)
+            parts.append(f"  index {index.name} ({columns}) unique={index.unique}")
+        for fk in sorted(table.foreign_keys, key=lambda f: f.target_fullname):
+            parts.append(f"  fk {fk.parent.name} -> {fk.target_fullname}")
+    return hashlib.sha256("\n".join(parts).encode()).hexdigest()[:16]
+
+
+def ensure_schema(metadata: MetaData, bind, component: str) -> bool:
+    """
+    Runs `create_all` for `metadata` unless the recorded fingerprint for
+    `component` already matches. Returns True if the schema was applied.
+    """
+    fingerprint = schema_fingerprint(metadata)
+    with bind.connect() as conn:
+        try:
+            current = conn.execute(
+                select(schema_version.c.fingerprint).where(
+                    schema_version.c.component == component
+                )
+            ).scalar_one_or_none()
+        except exc.DBAPIError:
+            current = None  # no schema_version table yet
+    if current == fingerprint:
+        logger.info(f"Schema '{component}' is up to date ({fingerprint})")
+        return False
+
+    metadata.create_all(bind)
+    schema_metadata.create_all(bind)
+    with bind.begin() as conn:
+        conn.execute(
+            schema_version.delete().where(schema_version.c.component == component)
+        )
+        conn.execute(
+            schema_version.insert().values(
+                component=component,
+                fingerprint=fingerprint,
+                applied_at=datetime.utcnow(),
+            )
+        )
+    logger.info(f"Applied schema '{component}' ({current} -> {fingerprint})")
+    return True
+
+
 def create_db_and_tables():
-    """Creates all database tables based on SQLModel metadata."""
-    SQLModel.metadata.create_all(engine)
+    """
+    Creates all database tables based on SQLModel metadata, then applies
+    pending migrations (which alter tables that already exist), on every
+    shard.
+    """
+    for bind in shard_engines.values():
+        ensure_schema(SQLModel.metadata, bind, "main")
+        if settings.MIGRATIONS_ON_STARTUP:
+            from . import migrations
+
+            migrations.upgrade(bind)
+
+
+def department_shard(department: Optional[str]) -> str:
+    """The shard holding the data of `department`."""
+    return settings.SHARD_MAP.get(department, DEFAULT_SHARD)
+
+
+def shard_for(user: User) -> str:
+    """The shard holding the data of `user`'s department."""
+    return department_shard(user.department)
 
 
-def get_session():
-    """Dependency to get a database session."""
-    with Session(engine) as session:
+def get_current_shard(
+    current_user: User = Depends(get_current_user),
+    x_shard: Optional[str] = Header(
+        None, description="Admins only: work on this shard instead of their own."
+    ),
+) -> str:
+    """Dependency resolving the shard of the request."""
+    if x_shard is None or not current_user.is_admin:
+        return shard_for(current_user)
+    if x_shard not in shard_engines:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Unknown shard. Valid are: {list(shard_engines)}",
+        )
+    return x_shard
+
+
+def open_session(shard: str = DEFAULT_SHARD) -> Session:
+    """A session on `shard`; `session.info["shard"]` names it for the hooks."""
+    return Session(shard_engines[shard], info={"shard": shard})
+
+
+def session_shard(session: Session) -> str:
+    return session.info.get("shard", DEFAULT_SHARD)
+
+
+def get_session(shard: str = Depends(get_current_shard)):
+    """Dependency to get a database session on the caller's shard."""
+    with open_session(shard) as session:
         yield session
 
 
+@functools.lru_cache(maxsize=None)
+def _fan_out_pool() -> ThreadPoolExecutor:
+    return ThreadPoolExecutor(
+        max_workers=min(settings.SHARD_FANOUT_WORKERS, len(shard_engines)),
+        thread_name_prefix="shard-fan-out",
+    )
+
+
+def fan_out(work: Callable[[str, Session], T]) -> Dict[str, T]:
+    """
+    Runs `work(shard, session)` on every shard concurrently, each in its own
+    session and thread. Returns the results by shard; the first failure is
+    raised.
+    """
+
+    def run(shard: str) -> T:
+        with open_session(shard) as session:
+            return work(shard, session)
+
+    if not SHARDED:
+        return {DEFAULT_SHARD: run(DEFAULT_SHARD)}
+    futures = {shard: _fan_out_pool().submit(run, shard) for shard in shard_engines}
+    return {shard: future.result() for shard, future in futures.items()}
+
+
+def dispose_engines(close: bool = True):
+    """Drops the connection pools of every shard (e.g. around a fork)."""
+    for bind in shard_engines.values():
+        bind.dispose(close=close)
+
+
+@functools.lru_cache(maxsize=None)
+def ssl_context() -> ssl.SSLContext:
+    """
+    TLS context for the shared HTTP client. Loading the CA bundle is one of
+    the slower startup steps, so it is built once per process (or once in
+    the pre-fork master, see server.py).
+    """
+    return httpx.create_ssl_context()
+
+
 async def get_http_client() -> httpx.AsyncClient:
     """Dependency to get the shared httpx.AsyncClient instance."""
     return http_client_store["client"]
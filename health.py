@@ -0,0 +1,156 @@
+import asyncio
+import logging
+import time
+from datetime import datetime
+from typing import Optional
+
+from sqlalchemy import text
+from sqlalchemy.engine import Engine
+
+from .config import settings
+from .database import DEFAULT_SHARD, http_client_store, shard_engines
+
+logger = logging.getLogger(__name__)
+
+OK, DEGRADED, DOWN, SKIPPED = "ok", "degraded", "down", "skipped"
+
+
+def _elapsed_ms(started: float) -> float:
+    return round((time.perf_counter() - started) * 1000, 2)
+
+
+def check_pool(bind: Engine) -> dict:
+    """Connection pool headroom of this worker (no I/O)."""
+    pool = bind.pool
+    if not hasattr(pool, "checkedout") or not hasattr(pool, "size"):
+        return {"status": SKIPPED, "pool": type(pool).__name__}
+    max_overflow = getattr(pool, "_max_overflow", 0)
+    capacity = pool.size() + max(max_overflow, 0)
+    checked_out = pool.checkedout()
+    headroom = capacity - checked_out
+    if headroom <= 0:
+        state = DOWN
+    elif headroom / capacity < settings.HEALTH_POOL_MIN_HEADROOM:
+        state = DEGRADED
+    else:
+        state = OK
+    return {
+        "status": state,
+        "checked_out": checked_out,
+        "capacity": capacity,
+        "headroom": headroom,
+    }
+
+
+def _select_one(bind: Engine):
+    with bind.connect() as conn:
+        conn.execute(text("SELECT 1"))
+
+
+async def check_database(bind: Engine) -> dict:
+    """Round-trip time of `SELECT 1`."""
+    started = time.perf_counter()
+    try:
+        await asyncio.wait_for(
+            asyncio.to_thread(_select_one, bind), settings.HEALTH_PROBE_TIMEOUT_SECONDS
+        )
+    except Exception as e:
+        return {"status": DOWN, "latency_ms": _elapsed_ms(started), "error": repr(e)}
+    latency_ms = _elapsed_ms(started)
+    state = DEGRADED if latency_ms > settings.HEALTH_DB_DEGRADED_MS else OK
+    return {"status": state, "latency_ms": latency_ms}
+
+
+async def check_user_service() -> dict:
+    """Latency of an unauthenticated request; any non-5xx answer means up."""
+    if settings.MOCK_AUTH_ENABLED:
+        return {"status": SKIPPED}
+    client = http_client_store.get("client")
+    if client is None:
+        return {"status": DOWN, "error": "HTTP client not started"}
+    started = time.perf_counter()
+    try:
+        response = await client.get(
+            f"{settings.HPC_USER_SERVICE_URL}{settings.HEALTH_USER_SERVICE_PATH}",
+            timeout=settings.HEALTH_PROBE_TIMEOUT_SECONDS,
+        )
+    except Exception as e:
+        return {"status": DOWN, "latency_ms": _elapsed_ms(started), "error": repr(e)}
+    latency_ms = _elapsed_ms(started)
+    if response.status_code >= 500:
+        state = DOWN
+    elif latency_ms > settings.HEALTH_USER_SERVICE_DEGRADED_MS:
+        state = DEGRADED
+    else:
+        state = OK
+    return {
+        "status": state,
+        "latency_ms": latency_ms,
+        "http_status": response.status_code,
+    }
+
+
+class ReadinessProbe:
+    """
+    Runs the dependency checks at most once per HEALTH_CACHE_SECONDS per
+    worker; concurrent callers share the run in progress. Orchestrator
+    polling therefore adds a bounded, tiny load whatever its frequency.
+    """
+
+    def __init__(self):
+        self._result: Optional[dict] = None
+        self._checked_at = 0.0
+        self._lock: Optional[asyncio.Lock] = None
+
+    async def get(self) -> dict:
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            age = time.monotonic() - self._checked_at
+            if self._result is None or age >= settings.HEALTH_CACHE_SECONDS:
+                self._result = await self._run()
+                self._checked_at = time.monotonic()
+                age = 0.0
+        return dict(self._result, age_ms=round(age * 1000))
+
+    async def _run(self) -> dict:
+        started = time.perf_counter()
+        checks, probes = {}, {}
+        for shard, bind in shard_engines.items():
+            # "database" and "pool" are the default shard, "database:cs" etc.
+            # the others; all shards are probed concurrently.
+            suffix = "" if shard == DEFAULT_SHARD else f":{shard}"
+            pool = check_pool(bind)
+            if pool["status"] == DOWN:
+                # A probe query would just wait for the pool timeout.
+                checks[f"database{suffix}"] = {
+                    "status": DOWN,
+                    "error": "connection pool exhausted",
+                }
+            else:
+                checks[f"database{suffix}"] = None
+                probes[f"database{suffix}"] = check_database(bind)
+            checks[f"pool{suffix}"] = pool
+        checks["user_service"] = None
+        probes["user_service"] = check_user_service()
+        results = await asyncio.gather(*probes.values())
+        checks.update(zip(probes, results))
+        states = {c["status"] for c in checks.values()}
+        if DOWN in states:
+            overall = "unavailable"
+        elif DEGRADED in states:
+            overall = "degraded"
+        else:
+            overall = "ok"
+        if overall != "ok":
+            failing = {n: c["status"] for n, c in checks.items() if c["status"] != OK}
+            logger.warning(f"Readiness {overall}: {failing}")
+        return {
+            "status": overall,
+            "checked_at": datetime.utcnow().isoformat(),
+            "duration_ms": _elapsed_ms(started),
+            "checks": checks,
+        }
+
+
+readiness = ReadinessProbe()
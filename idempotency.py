@@ -0,0 +1,346 @@
+import asyncio
+import hashlib
+import json
+import logging
+import re
+import time
+from datetime import datetime, timedelta
+from typing import List, Optional, Tuple
+
+from fastapi import HTTPException
+from fastapi.security import HTTPAuthorizationCredentials
+from sqlalchemy import delete, exc, insert, select, update
+
+from . import models
+from .auth import get_current_user
+from .config import settings
+from .database import engine
+from .ratelimit import RateLimit
+
+logger = logging.getLogger(__name__)
+
+IDEMPOTENCY_HEADER = "idempotency-key"
+REPLAYED_HEADER = b"idempotent-replayed"
+# Response headers stored with the body and sent again on replay.
+STORED_HEADERS = {b"content-type", b"etag", b"location"}
+
+# Mutating endpoints that honour the header.
+IDEMPOTENT_ROUTES = [
+    re.compile(p)
+    for p in (
+        r"^/dispatches/?$",
+        r"^/dispatches/\d+/send$",
+        r"^/dispatches/\d+/forward$",
+        r"^/dispatches/\d+/comments$",
+    )
+]
+
+records = models.IdempotencyRecord.__table__
+
+# The routers' own rate limit; all IDEMPOTENT_ROUTES are dispatch routes.
+_rate_limit = RateLimit("dispatches")
+
+
+def _sha256(*parts: bytes) -> str:
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(part)
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+# --- Storage (sync, run in a worker thread) ---
+
+_last_purge = 0.0
+
+
+def _purge_expired(now: datetime):
+    global _last_purge
+    if time.monotonic() - _last_purge < settings.IDEMPOTENCY_PURGE_INTERVAL_SECONDS:
+        return
+    _last_purge = time.monotonic()
+    with engine.begin() as conn:
+        expired = conn.execute(
+            select(records.c.key_hash)
+            .where(records.c.expires_at < now)
+            .limit(settings.IDEMPOTENCY_PURGE_BATCH_SIZE)
+        ).scalars()
+        conn.execute(delete(records).where(records.c.key_hash.in_(list(expired))))
+
+
+def _claim(key_hash: str, request_hash: str) -> Optional[dict]:
+    """
+    Inserts an in-progress record for the key. Returns None when this
+    request now owns the key, or the existing record otherwise.
+    """
+    now = datetime.utcnow()
+    _purge_expired(now)
+    with engine.begin() as conn:
+        existing = (
+            conn.execute(select(records).where(records.c.key_hash == key_hash))
+            .mappings()
+            .first()
+        )
+        abandoned = (
+            existing is not None
+            and existing["status_code"] is None
+            and existing["created_at"]
+            < now - timedelta(seconds=settings.IDEMPOTENCY_LOCK_SECONDS)
+        )
+        if existing is not None and existing["expires_at"] >= now and not abandoned:
+            return dict(existing)
+        if existing is not None:
+            # Expired, or left in progress by a crashed worker.
+            conn.execute(delete(records).where(records.c.key_hash == key_hash))
+    try:
+        with engine.begin() as conn:
+            conn.execute(
+                insert(records).values(
+                    key_hash=key_hash,
+                    request_hash=request_hash,
+                    created_at=now,
+                    expires_at=now
+                    + timedelta(seconds=settings.IDEMPOTENCY_TTL_SECONDS),
+                )
+            )
+        return None
+    except exc.IntegrityError:
+        # A concurrent duplicate claimed the key first.
+        with engine.connect() as conn:
+            existing = (
+                conn.execute(select(records).where(records.c.key_hash == key_hash))
+                .mappings()
+                .first()
+            )
+        return dict(existing) if existing else _claim(key_hash, request_hash)
+
+
+def _fetch(key_hash: str) -> Optional[dict]:
+    with engine.connect() as conn:
+        row = (
+            conn.execute(select(records).where(records.c.key_hash == key_hash))
+            .mappings()
+            .first()
+        )
+    return dict(row) if row else None
+
+
+def _complete(
+    key_hash: str, status_code: int, headers: List[Tuple[bytes, bytes]], body: bytes
+):
+    with engine.begin() as conn:
+        conn.execute(
+            update(records)
+            .where(records.c.key_hash == key_hash)
+            .values(
+                status_code=status_code,
+                content_type=dict(headers).get(b"content-type", b"").decode(),
+                response_headers=json.dumps(
+                    [
+                        [name.decode(), value.decode("latin-1")]
+                        for name, value in headers
+                    ]
+                ),
+                response_body=body.decode("utf-8"),
+            )
+        )
+
+
+def _release(key_hash: str):
+    with engine.begin() as conn:
+        conn.execute(delete(records).where(records.c.key_hash == key_hash))
+
+
+# --- Middleware ---
+
+
+class IdempotencyMiddleware:
+    """
+    Makes POSTs to IDEMPOTENT_ROUTES that carry an `Idempotency-Key` header
+    safe to retry. The first request claims the key; once it succeeds (2xx)
+    its response is stored and any retry with the same key gets that
+    response back without re-executing. A duplicate arriving while the
+    original is still running waits for it. Failed requests release the key
+    so they can be retried for real. Keys are scoped to the caller's
+    credentials and expire after IDEMPOTENCY_TTL_SECONDS.
+
+    Duplicates are answered here without reaching the routes, so the caller
+    is first rate limited and authenticated as a route would be: a revoked
+    or expired token replays nothing.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if (
+            scope["type"] != "http"
+            or scope["method"] != "POST"
+            or not any(p.match(scope["path"]) for p in IDEMPOTENT_ROUTES)
+        ):
+            await self.app(scope, receive, send)
+            return
+        headers = dict(scope["headers"])
+        key = headers.get(IDEMPOTENCY_HEADER.encode())
+        if not key:
+            await self.app(scope, receive, send)
+            return
+        if len(key) > 255:
+            await _send_json(send, 400, {"detail": "Idempotency-Key is too long."})
+            return
+
+        # Buffer the body: it is part of the request fingerprint and must be
+        # replayed to the application afterwards.
+        messages, body = [], b""
+        while True:
+            message = await receive()
+            messages.append(message)
+            body += message.get("body", b"")
+            if not message.get("more_body"):
+                break
+
+        key_hash = _sha256(headers.get(b"authorization", b""), key)
+        request_hash = _sha256(
+            scope["method"].encode(),
+            scope["path"].encode(),
+            scope.get("query_string", b""),
+            body,
+        )
+
+        existing = await asyncio.to_thread(_claim, key_hash, request_hash)
+        if existing is not None:
+            rejected = await _check_caller(headers.get(b"authorization", b""))
+            if rejected is not None:
+                await _send_json(
+                    send,
+                    rejected.status_code,
+                    {"detail": rejected.detail},
+                    [
+                        (name.lower().encode(), value.encode())
+                        for name, value in (rejected.headers or {}).items()
+                    ],
+                )
+                return
+            await self._answer_duplicate(send, key_hash, request_hash, existing)
+            return
+
+        async def replay_receive():
+            if messages:
+                return messages.pop(0)
+            return await receive()
+
+        status_code, stored_headers, chunks = None, [], []
+
+        async def capture_send(message):
+            nonlocal status_code, stored_headers
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                stored_headers = [
+                    (name.lower(), value)
+                    for name, value in message.get("headers", [])
+                    if name.lower() in STORED_HEADERS
+                ]
+            elif message["type"] == "http.response.body":
+                chunks.append(message.get("body", b""))
+            await send(message)
+
+        try:
+            await self.app(scope, replay_receive, capture_send)
+        except BaseException:
+            await asyncio.to_thread(_release, key_hash)
+            raise
+        if status_code is not None and 200 <= status_code < 300:
+            await asyncio.to_thread(
+                _complete, key_hash, status_code, stored_headers, b"".join(chunks)
+            )
+        else:
+            await asyncio.to_thread(_release, key_hash)
+
+    async def _answer_duplicate(
+        self, send, key_hash: str, request_hash: str, record: dict
+    ):
+        if record["request_hash"] != request_hash:
+            await _send_json(
+                send,
+                422,
+                {"detail": "Idempotency-Key was already used for a different request."},
+            )
+            return
+        # The original is still running: wait for its outcome.
+        deadline = time.monotonic() + settings.IDEMPOTENCY_WAIT_SECONDS
+        delay = 0.05
+        while record is not None and record["status_code"] is None:
+            if time.monotonic() >= deadline:
+                await _send_json(
+                    send,
+                    409,
+                    {"detail": "A request with this Idempotency-Key is in progress."},
+                    [(b"retry-after", b"1")],
+                )
+                return
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 0.5)
+            record = await asyncio.to_thread(_fetch, key_hash)
+        if record is None:
+            # The original failed and released the key; let the client retry.
+            await _send_json(
+                send,
+                409,
+                {"detail": "The original request failed; retry it."},
+                [(b"retry-after", b"0")],
+            )
+            return
+        logger.info(f"Replayed idempotent response for {key_hash[:12]}")
+        body = record["response_body"].encode("utf-8")
+        if record["response_headers"] is not None:
+            headers = [
+                (name.encode(), value.encode("latin-1"))
+                for name, value in json.loads(record["response_headers"])
+            ]
+        else:
+            # Stored before headers were kept.
+            headers = [(b"content-type", record["content_type"].encode())]
+        await send(
+            {
+                "type": "http.response.start",
+                "status": record["status_code"],
+                "headers": [
+                    *headers,
+                    (b"content-length", str(len(body)).encode()),
+                    (REPLAYED_HEADER, b"true"),
+                ],
+            }
+        )
+        await send({"type": "http.response.body", "body": body})
+
+
+async def _check_caller(authorization: bytes) -> Optional[HTTPException]:
+    """The error a route would answer before running for this caller, if any."""
+    scheme, _, token = authorization.decode("latin-1").partition(" ")
+    if scheme.lower() != "bearer" or not token:
+        return HTTPException(status_code=403, detail="Not authenticated")
+    creds = HTTPAuthorizationCredentials(scheme=scheme, credentials=token)
+    try:
+        await _rate_limit(creds)
+        await get_current_user(creds)
+    except HTTPException as e:
+        return e
+    return None
+
+
+async def _send_json(
+    send, status_code: int, payload: dict, extra_headers: List[Tuple[bytes, bytes]] = ()
+):
+    body = json.dumps(payload).encode()
+    await send(
+        {
+            "type": "http.response.start",
+            "status": status_code,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode()),
+                *extra_headers,
+            ],
+        }
+    )
+    await send({"type": "http.response.body", "body": body})
@@ -0,0 +1,256 @@
+"""
+Per-user inbox: the denormalized `DispatchInbox` table behind the "my
+dispatches" listings and stats.
+
+Every dispatch has one "outgoing" row for its creator, one "incoming" row
+per assignee and one "all" row per distinct participant, each carrying the
+dispatch's status and creation time. Mutations call `track()`; the rows of
+tracked dispatches are rewritten in the caller's transaction when it
+commits, so they can never disagree with a committed change.
+
+`python -m hpc_dispatch.inbox check` reports drift (e.g. after manual SQL),
+`rebuild` recomputes the table from the dispatches.
+"""
+
+import logging
+import time
+from typing import Iterator, List, Set, Tuple
+
+from sqlalchemy import delete, event, exists, func, insert, inspect, select
+from sqlalchemy.engine import Connection, Engine
+from sqlmodel import Session
+
+from . import models
+
+logger = logging.getLogger(__name__)
+
+INCOMING, OUTGOING, ALL = "incoming", "outgoing", "all"
+
+_PENDING_KEY = "inbox_pending"
+
+inbox_table = models.DispatchInbox.__table__
+dispatches = models.Dispatch.__table__
+assignee_links = models.DispatchAssigneeLink.__table__
+
+Entry = Tuple[int, str, int, models.DispatchStatus, object]
+
+
+def entries(
+    dispatch_id: int,
+    creator_id: int,
+    status: models.DispatchStatus,
+    created_at,
+    assignee_ids: List[int],
+) -> Set[Entry]:
+    """Inbox rows of one dispatch, as (user_id, role, dispatch_id, ...) tuples."""
+    rows = {(creator_id, OUTGOING), (creator_id, ALL)}
+    for assignee_id in assignee_ids:
+        rows |= {(assignee_id, INCOMING), (assignee_id, ALL)}
+    return {(user_id, role, dispatch_id, status, created_at) for user_id, role in rows}
+
+
+def _as_values(rows: Set[Entry]) -> List[dict]:
+    keys = ("user_id", "role", "dispatch_id", "status", "created_at")
+    return [dict(zip(keys, row)) for row in rows]
+
+
+def track(session: Session, dispatch: models.Dispatch):
+    """Rewrites the dispatch's inbox rows when `session` commits."""
+    session.info.setdefault(_PENDING_KEY, {})[id(dispatch)] = dispatch
+
+
+@event.listens_for(Session, "before_commit")
+def _write_tracked_dispatches(session):
+    pending = session.info.pop(_PENDING_KEY, None)
+    if not pending:
+        return
+    session.flush()
+    connection = session.connection()
+    for dispatch in pending.values():
+        state = inspect(dispatch)
+        connection.execute(
+            delete(inbox_table).where(inbox_table.c.dispatch_id == dispatch.id)
+        )
+        if state.deleted or state.was_deleted:
+            continue
+        rows = entries(
+            dispatch.id,
+            dispatch.creator_id,
+            dispatch.status,
+            dispatch.created_at,
+            [link.assignee_id for link in dispatch.assignee_links],
+        )
+        connection.execute(insert(inbox_table), _as_values(rows))
+
+
+@event.listens_for(Session, "after_soft_rollback")
+def _discard_tracked_dispatches(session, previous_transaction):
+    session.info.pop(_PENDING_KEY, None)
+
+
+# --- Consistency check and rebuild ---
+
+
+def _expected(conn: Connection, dispatch_ids: List[int]) -> Set[Entry]:
+    assignees = {}
+    for dispatch_id, assignee_id in conn.execute(
+        select(assignee_links.c.dispatch_id, assignee_links.c.assignee_id).where(
+            assignee_links.c.dispatch_id.in_(dispatch_ids)
+        )
+    ):
+        assignees.setdefault(dispatch_id, []).append(assignee_id)
+    rows: Set[Entry] = set()
+    for dispatch_id, creator_id, status, created_at in conn.execute(
+        select(
+            dispatches.c.id,
+            dispatches.c.creator_id,
+            dispatches.c.status,
+            dispatches.c.created_at,
+        ).where(dispatches.c.id.in_(dispatch_ids))
+    ):
+        rows |= entries(
+            dispatch_id, creator_id, status, created_at, assignees.get(dispatch_id, [])
+        )
+    return rows
+
+
+def _actual(conn: Connection, dispatch_ids: List[int]) -> Set[Entry]:
+    c = inbox_table.c
+    return set(
+        conn.execute(
+            select(c.user_id, c.role, c.dispatch_id, c.status, c.created_at).where(
+                c.dispatch_id.in_(dispatch_ids)
+            )
+        )
+    )
+
+
+def _dispatch_id_batches(
+    bind: Engine, batch_size: int, only_missing: bool = False
+) -> Iterator[List[int]]:
+    last_id = 0
+    while True:
+        statement = (
+            select(dispatches.c.id)
+            .where(dispatches.c.id > last_id)
+            .order_by(dispatches.c.id)
+            .limit(batch_size)
+        )
+        with bind.connect() as conn:
+            ids = list(conn.execute(statement).scalars())
+            if only_missing and ids:
+                has_rows = select(inbox_table.c.dispatch_id).where(
+                    inbox_table.c.dispatch_id.in_(ids)
+                )
+                filled = set(conn.execute(has_rows.distinct()).scalars())
+        if not ids:
+            return
+        last_id = ids[-1]
+        if only_missing:
+            ids = [i for i in ids if i not in filled]
+            if not ids:
+                continue
+        yield ids
+
+
+def _orphans_clause():
+    return ~exists().where(dispatches.c.id == inbox_table.c.dispatch_id)
+
+
+def check(bind: Engine, batch_size: int = 1000, sample_size: int = 10) -> dict:
+    """
+    Compares the inbox with what the dispatches imply. Rows written by a
+    transaction committing during the check may show up as drift; re-run
+    to confirm.
+    """
+    report = {"dispatches": 0, "missing": 0, "unexpected": 0, "orphaned": 0}
+    samples = []
+    for ids in _dispatch_id_batches(bind, batch_size):
+        with bind.connect() as conn:
+            expected, actual = _expected(conn, ids), _actual(conn, ids)
+        report["dispatches"] += len(ids)
+        missing, unexpected = expected - actual, actual - expected
+        report["missing"] += len(missing)
+        report["unexpected"] += len(unexpected)
+        for kind, rows in (("missing", missing), ("unexpected", unexpected)):
+            for user_id, role, dispatch_id, status, _ in sorted(rows)[:sample_size]:
+                if len(samples) < sample_size:
+                    samples.append(
+                        dict(
+                            kind=kind,
+                            user_id=user_id,
+                            role=role,
+                            dispatch_id=dispatch_id,
+                            status=status.value,
+                        )
+                    )
+    orphaned = select(inbox_table.c.dispatch_id).where(_orphans_clause()).distinct()
+    with bind.connect() as conn:
+        report["orphaned"] = conn.execute(
+            select(func.count()).select_from(orphaned.subquery())
+        ).scalar_one()
+    report["consistent"] = not (
+        report["missing"] or report["unexpected"] or report["orphaned"]
+    )
+    report["samples"] = samples
+    return report
+
+
+def rebuild(
+    bind: Engine,
+    batch_size: int = 1000,
+    only_missing: bool = False,
+    pause_seconds: float = 0.0,
+) -> int:
+    """
+    Recomputes the inbox rows of every dispatch, one batch per transaction
+    with an optional pause in between (to limit lock time and replication
+    lag on a live database), and drops rows of dispatches that no longer
+    exist. With `only_missing`, only dispatches without any inbox row are
+    filled in. Returns the number of dispatches written.
+    """
+    written = 0
+    for ids in _dispatch_id_batches(bind, batch_size, only_missing):
+        with bind.begin() as conn:
+            rows = _expected(conn, ids)
+            conn.execute(delete(inbox_table).where(inbox_table.c.dispatch_id.in_(ids)))
+            if rows:
+                conn.execute(insert(inbox_table), _as_values(rows))
+        written += len(ids)
+        if pause_seconds:
+            time.sleep(pause_seconds)
+    if not only_missing:
+        with bind.begin() as conn:
+            conn.execute(delete(inbox_table).where(_orphans_clause()))
+    logger.info(f"Rebuilt inbox rows of {written} dispatch(es)")
+    return written
+
+
+if __name__ == "__main__":
+    import argparse
+    import json
+    import sys
+
+    from .database import shard_engines
+
+    parser = argparse.ArgumentParser(
+        prog="python -m hpc_dispatch.inbox",
+        description="Check or rebuild the per-user inbox table.",
+    )
+    parser.add_argument("command", choices=["check", "rebuild"])
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--shard", choices=list(shard_engines), default="default")
+    parser.add_argument(
+        "--only-missing",
+        action="store_true",
+        help="rebuild: only fill in dispatches that have no inbox rows",
+    )
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    engine = shard_engines[args.shard]
+
+    if args.command == "check":
+        result = check(engine, args.batch_size)
+        print(json.dumps(result, indent=2))
+        sys.exit(0 if result["consistent"] else 1)
+    rebuild(engine, args.batch_size, args.only_missing)
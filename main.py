@@ -1,21 +1,33 @@
 import sys
 import os
+import asyncio
 import logging
+import time
 from contextlib import asynccontextmanager
 
 # --- FIX STARTS HERE ---
 # 1. Manually add the parent directory to Python's path.
 # This must be done BEFORE any local package imports.
-current_dir = os.path.dirname(os.path.abspath(__file__))
-parent_dir = os.path.dirname(current_dir)
-if parent_dir not in sys.path:
-    sys.path.append(parent_dir)
+# Only needed when run as a top-level module (`uvicorn main:app`); when
+# imported as `hpc_dispatch.main` (e.g. by hpc_dispatch.server) it is a no-op.
+if not __package__:
+    current_dir = os.path.dirname(os.path.abspath(__file__))
+    parent_dir = os.path.dirname(current_dir)
+    if parent_dir not in sys.path:
+        sys.path.append(parent_dir)
 
 # 2. Now, use absolute imports from the 'hpc_dispatch' package.
+from hpc_dispatch import archive, attachments, audit, outbox, scheduler
+from hpc_dispatch.admission import AdmissionMiddleware
+from hpc_dispatch.idempotency import IdempotencyMiddleware
 from hpc_dispatch.config import settings
-from hpc_dispatch.database import create_db_and_tables, http_client_store
+from hpc_dispatch.database import (
+    create_db_and_tables,
+    http_client_store,
+    shard_engines,
+    ssl_context,
+)
 from hpc_dispatch.routers import dispatches, shelves, system
-from hpc_dispatch import schemas
 
 # --- FIX ENDS HERE ---
 
@@ -40,13 +52,29 @@ async def lifespan(app: FastAPI):
     else:
         logger.info(f"Connecting to User Service at: {settings.HPC_USER_SERVICE_URL}")
 
-    create_db_and_tables()
-    http_client_store["client"] = httpx.AsyncClient()
-    logger.info("Startup complete.")
+    started = time.perf_counter()
+    if settings.SCHEMA_SETUP_ON_STARTUP:
+        create_db_and_tables()
+        archive.create_archive_tables()
+    http_client_store["client"] = httpx.AsyncClient(verify=ssl_context())
+    audit.pipeline.start()
+    outbox.relay.start()
+    attachments.enricher.start()
+    scheduler.scheduler.start()
+    archive_task = None
+    if settings.ARCHIVE_INTERVAL_SECONDS:
+        archive_task = asyncio.create_task(archive.run_periodically())
+    logger.info(f"Startup complete in {(time.perf_counter() - started) * 1000:.0f} ms.")
     yield
     # Shutdown
     logger.info("Application shutting down...")
-    await http_client_store["client"].close()
+    if archive_task:
+        archive_task.cancel()
+    await scheduler.scheduler.stop()
+    await attachments.enricher.stop()
+    await outbox.relay.stop()
+    await audit.pipeline.stop()
+    await http_client_store["client"].aclose()
     logger.info("Shutdown complete.")
 
 
@@ -58,6 +86,14 @@ app = FastAPI(
     lifespan=lifespan,
 )
 
+# Innermost: only admitted requests claim idempotency keys.
+app.add_middleware(IdempotencyMiddleware)
+
+# Admission control sits inside CORS so 503 responses still carry the
+# CORS headers the browser needs to read them.
+if settings.ADMISSION_ENABLED:
+    app.add_middleware(AdmissionMiddleware)
+
 # Add CORS Middleware
 app.add_middleware(
     CORSMiddleware,
@@ -67,12 +103,16 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Opt-in SQL profiling: slow-query log, per-request query budget and the
+# X-SQL-Debug summary header.
+if settings.SQL_PROFILING_ENABLED:
+    from hpc_dispatch.profiling import SQLProfilingMiddleware, install_engine_hooks
+
+    for engine in shard_engines.values():
+        install_engine_hooks(engine)
+    app.add_middleware(SQLProfilingMiddleware)
+
 # Include the routers from the routers package
 app.include_router(system.router)
 app.include_router(dispatches.router)
 app.include_router(shelves.router)
-
-# Rebuild Pydantic models with forward references
-schemas.ShelfReadWithChildren.model_rebuild()
-schemas.ShelfReadWithDispatches.model_rebuild()
-schemas.DispatchReadWithDetails.model_rebuild()
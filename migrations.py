@@ -0,0 +1,428 @@
+"""
+Versioned schema migrations for the main database.
+
+`create_all` (see database.ensure_schema) creates missing tables but never
+alters existing ones. Migrations cover everything else: indexes, columns
+and data backfills on tables that already exist. Each migration is a
+numbered function registered with `@migration`; applied versions are
+recorded in `schema_migrations` together with timing, host and errors.
+
+Migrations must be idempotent (e.g. `IF NOT EXISTS`, backfills that select
+only rows still to be filled), so a run interrupted half-way can simply be
+repeated. Run them with `python -m hpc_dispatch.migrations upgrade`; they
+also run at startup unless MIGRATIONS_ON_STARTUP is off.
+"""
+
+import logging
+import os
+import socket
+import time
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Callable, Dict, List, Optional
+
+from sqlalchemy import (
+    Column,
+    DateTime,
+    Float,
+    Integer,
+    String,
+    Table,
+    Text,
+    exc,
+    inspect,
+    select,
+    text,
+)
+from sqlalchemy.engine import Connection, Engine
+
+from .config import settings
+from .database import schema_metadata
+
+logger = logging.getLogger(__name__)
+
+schema_migrations = Table(
+    "schema_migrations",
+    schema_metadata,
+    Column("version", Integer, primary_key=True),
+    Column("name", String, nullable=False),
+    Column("status", String, nullable=False),  # running | applied | failed
+    Column("started_at", DateTime, nullable=False),
+    Column("finished_at", DateTime),
+    Column("duration_ms", Float),
+    Column("applied_by", String),
+    Column("error", Text),
+)
+
+# Arbitrary key for the Postgres advisory lock serializing migrators.
+_ADVISORY_LOCK_KEY = 72_410_034
+
+
+class MigrationContext:
+    """Helpers available to migrations, bound to one database."""
+
+    def __init__(self, bind: Engine):
+        self.bind = bind
+        self.is_postgres = bind.dialect.name == "postgresql"
+
+    def execute(self, statement: str, transactional: bool = True):
+        """Runs one DDL statement, retrying when it cannot get its locks."""
+        for attempt in range(1, settings.MIGRATION_DDL_RETRIES + 1):
+            try:
+                if transactional:
+                    with self.bind.begin() as conn:
+                        self._set_lock_timeout(conn)
+                        conn.execute(text(statement))
+                else:
+                    with self.bind.connect() as conn:
+                        conn = conn.execution_options(isolation_level="AUTOCOMMIT")
+                        self._set_lock_timeout(conn)
+                        conn.execute(text(statement))
+                return
+            except exc.OperationalError as e:
+                if not _is_lock_error(e) or attempt == settings.MIGRATION_DDL_RETRIES:
+                    raise
+                delay = min(2**attempt, 30)
+                logger.warning(
+                    f"Lock timeout on attempt {attempt}, retrying in {delay}s: "
+                    f"{statement}"
+                )
+                time.sleep(delay)
+
+    def _set_lock_timeout(self, conn: Connection):
+        # Fail fast instead of queueing behind long transactions: a waiting
+        # DDL lock blocks every later reader and writer of the table.
+        if self.is_postgres:
+            conn.execute(
+                text(f"SET lock_timeout = {int(settings.MIGRATION_LOCK_TIMEOUT_MS)}")
+            )
+
+    def has_column(self, table: str, column: str) -> bool:
+        return column in {c["name"] for c in inspect(self.bind).get_columns(table)}
+
+    def add_column(self, table: str, column: str, ddl_type: str):
+        """Adds a column (nullable or with a constant default) if missing."""
+        if not self.has_column(table, column):
+            self.execute(f"ALTER TABLE {table} ADD COLUMN {column} {ddl_type}")
+
+    def create_index(
+        self, name: str, table: str, columns: List[str], unique: bool = False
+    ):
+        """
+        Creates an index without blocking writes on Postgres
+        (`CREATE INDEX CONCURRENTLY`); elsewhere a plain `CREATE INDEX`.
+        """
+        unique_sql = "UNIQUE " if unique else ""
+        column_sql = ", ".join(columns)
+        if not self.is_postgres:
+            self.execute(
+                f"CREATE {unique_sql}INDEX IF NOT EXISTS {name} ON {table} ({column_sql})"
+            )
+            return
+        # A failed concurrent build leaves an INVALID index behind that
+        # IF NOT EXISTS would happily accept; drop it and build again.
+        with self.bind.connect() as conn:
+            invalid = conn.execute(
+                text(
+                    "SELECT 1 FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid "
+                    "WHERE c.relname = :name AND NOT i.indisvalid"
+                ),
+                {"name": name},
+            ).first()
+        if invalid:
+            logger.warning(f"Dropping invalid index {name} left by a failed build")
+            self.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {name}", False)
+        self.execute(
+            f"CREATE {unique_sql}INDEX CONCURRENTLY IF NOT EXISTS {name} "
+            f"ON {table} ({column_sql})",
+            transactional=False,
+        )
+
+
+def _is_lock_error(error: exc.OperationalError) -> bool:
+    # Postgres lock_timeout is SQLSTATE 55P03; SQLite reports a busy database.
+    code = getattr(error.orig, "pgcode", None) or getattr(error.orig, "sqlstate", None)
+    return code == "55P03" or "database is locked" in str(error.orig)
+
+
+@dataclass
+class Migration:
+    version: int
+    name: str
+    upgrade: Callable[[MigrationContext], None]
+
+
+MIGRATIONS: List[Migration] = []
+
+
+def migration(version: int, name: str):
+    """Registers a migration. Versions must be unique and increasing."""
+
+    def decorator(func: Callable[[MigrationContext], None]):
+        if MIGRATIONS and version <= MIGRATIONS[-1].version:
+            raise ValueError(f"Migration {version} is out of order")
+        MIGRATIONS.append(Migration(version, name, func))
+        return func
+
+    return decorator
+
+
+# --- Migrations ---
+
+
+@migration(1, "Index foreign keys used to load dispatch children")
+def _index_child_foreign_keys(ctx: MigrationContext):
+    # (dispatch_id, id) also serves the keyset-paginated comments/history.
+    ctx.create_index(
+        "ix_dispatchhistory_dispatch_id_id", "dispatchhistory", ["dispatch_id", "id"]
+    )
+    ctx.create_index("ix_comment_dispatch_id_id", "comment", ["dispatch_id", "id"])
+    ctx.create_index("ix_dispatchfile_dispatch_id", "dispatchfile", ["dispatch_id"])
+    ctx.create_index("ix_dispatchshelflink_shelf_id", "dispatchshelflink", ["shelf_id"])
+
+
+@migration(2, "Index dispatch list filters")
+def _index_dispatch_lists(ctx: MigrationContext):
+    ctx.create_index(
+        "ix_dispatch_creator_id_created_at", "dispatch", ["creator_id", "created_at"]
+    )
+    ctx.create_index(
+        "ix_dispatch_status_created_at", "dispatch", ["status", "created_at"]
+    )
+
+
+@migration(3, "Add attachment metadata columns")
+def _add_file_metadata(ctx: MigrationContext):
+    from .archive import archived_file, engine_for
+
+    columns = [
+        ("content_length", "BIGINT"),
+        ("content_type", "VARCHAR"),
+        ("etag", "VARCHAR"),
+        ("metadata_checked_at", "TIMESTAMP"),
+        ("metadata_error", "VARCHAR"),
+    ]
+    for column, ddl_type in columns:
+        ctx.add_column("dispatchfile", column, ddl_type)
+    ctx.create_index(
+        "ix_dispatchfile_metadata_checked_at", "dispatchfile", ["metadata_checked_at"]
+    )
+    # The archive mirrors the live columns; it may be a separate database.
+    archive_engine = engine_for(ctx.bind)
+    archive_ctx = MigrationContext(archive_engine)
+    if inspect(archive_engine).has_table(archived_file.name):
+        for column, ddl_type in columns:
+            archive_ctx.add_column(archived_file.name, column, ddl_type)
+
+
+@migration(4, "Fill the per-user inbox")
+def _fill_inbox(ctx: MigrationContext):
+    from . import inbox
+
+    # Only dispatches without inbox rows, so an interrupted run resumes.
+    inbox.rebuild(
+        ctx.bind,
+        settings.MIGRATION_BACKFILL_BATCH_SIZE,
+        only_missing=True,
+        pause_seconds=settings.MIGRATION_BACKFILL_PAUSE_SECONDS,
+    )
+
+
+@migration(5, "Add dispatch version column")
+def _add_dispatch_version(ctx: MigrationContext):
+    from .archive import archived_dispatch, engine_for
+
+    ctx.add_column("dispatch", "version", "INTEGER NOT NULL DEFAULT 1")
+    archive_engine = engine_for(ctx.bind)
+    if inspect(archive_engine).has_table(archived_dispatch.name):
+        MigrationContext(archive_engine).add_column(
+            archived_dispatch.name, "version", "INTEGER NOT NULL DEFAULT 1"
+        )
+
+
+@migration(6, "Add dispatch schedule and deadline columns")
+def _add_dispatch_deadlines(ctx: MigrationContext):
+    from .archive import archived_dispatch, engine_for
+
+    columns = ["scheduled_at", "due_at", "overdue_at", "scheduler_lease_until"]
+    for column in columns:
+        ctx.add_column("dispatch", column, "TIMESTAMP")
+    # The scheduler's scans (see scheduler._upcoming) read these in order.
+    ctx.create_index(
+        "ix_dispatch_status_scheduled_at", "dispatch", ["status", "scheduled_at"]
+    )
+    ctx.create_index(
+        "ix_dispatch_status_overdue_at_due_at",
+        "dispatch",
+        ["status", "overdue_at", "due_at"],
+    )
+    archive_engine = engine_for(ctx.bind)
+    archive_ctx = MigrationContext(archive_engine)
+    if inspect(archive_engine).has_table(archived_dispatch.name):
+        for column in columns:
+            archive_ctx.add_column(archived_dispatch.name, column, "TIMESTAMP")
+    # Postgres stores DispatchAction as a native enum (by member name).
+    for context in {ctx.bind: ctx, archive_engine: archive_ctx}.values():
+        if context.is_postgres:
+            context.execute(
+                "ALTER TYPE dispatchaction ADD VALUE IF NOT EXISTS 'OVERDUE'",
+                transactional=False,
+            )
+
+
+@migration(7, "Add idempotency response headers column")
+def _add_idempotency_headers(ctx: MigrationContext):
+    ctx.add_column("idempotencyrecord", "response_headers", "VARCHAR")
+
+
+# --- Runner ---
+
+
+def _applied_versions(bind: Engine) -> Dict[int, dict]:
+    with bind.connect() as conn:
+        try:
+            rows = conn.execute(select(schema_migrations)).mappings().all()
+        except exc.DBAPIError:
+            return {}  # table not created yet
+    return {row["version"]: dict(row) for row in rows}
+
+
+def pending_migrations(bind: Engine) -> List[Migration]:
+    applied = _applied_versions(bind)
+    return [
+        m for m in MIGRATIONS if applied.get(m.version, {}).get("status") != "applied"
+    ]
+
+
+def _record(bind: Engine, version: int, **values):
+    with bind.begin() as conn:
+        exists = conn.execute(
+            select(schema_migrations.c.version).where(
+                schema_migrations.c.version == version
+            )
+        ).first()
+        if exists:
+            conn.execute(
+                schema_migrations.update()
+                .where(schema_migrations.c.version == version)
+                .values(**values)
+            )
+        else:
+            conn.execute(schema_migrations.insert().values(version=version, **values))
+
+
+def _apply(bind: Engine, migration: Migration):
+    started_at = datetime.utcnow()
+    started = time.perf_counter()
+    _record(
+        bind,
+        migration.version,
+        name=migration.name,
+        status="running",
+        started_at=started_at,
+        finished_at=None,
+        duration_ms=None,
+        applied_by=f"{socket.gethostname()}:{os.getpid()}",
+        error=None,
+    )
+    logger.info(f"Applying migration {migration.version}: {migration.name}")
+    try:
+        migration.upgrade(MigrationContext(bind))
+    except Exception as e:
+        _record(
+            bind,
+            migration.version,
+            status="failed",
+            finished_at=datetime.utcnow(),
+            duration_ms=(time.perf_counter() - started) * 1000,
+            error=repr(e),
+        )
+        raise
+    duration_ms = (time.perf_counter() - started) * 1000
+    _record(
+        bind,
+        migration.version,
+        status="applied",
+        finished_at=datetime.utcnow(),
+        duration_ms=duration_ms,
+    )
+    logger.info(f"Applied migration {migration.version} in {duration_ms:.0f} ms")
+
+
+def upgrade(bind: Engine, target: Optional[int] = None) -> int:
+    """Applies pending migrations up to `target`. Returns how many ran."""
+    pending = [
+        m for m in pending_migrations(bind) if target is None or m.version <= target
+    ]
+    if not pending:
+        return 0
+    schema_metadata.create_all(bind, tables=[schema_migrations])
+
+    lock_conn = None
+    if bind.dialect.name == "postgresql":
+        # Only one process migrates; the others wait here and then find
+        # nothing left to do.
+        lock_conn = bind.connect().execution_options(isolation_level="AUTOCOMMIT")
+        lock_conn.execute(text(f"SELECT pg_advisory_lock({_ADVISORY_LOCK_KEY})"))
+        pending = [
+            m for m in pending_migrations(bind) if target is None or m.version <= target
+        ]
+    try:
+        for m in pending:
+            _apply(bind, m)
+    finally:
+        if lock_conn is not None:
+            lock_conn.execute(text(f"SELECT pg_advisory_unlock({_ADVISORY_LOCK_KEY})"))
+            lock_conn.close()
+    return len(pending)
+
+
+def status(bind: Engine) -> List[dict]:
+    """Every known migration with its recorded audit row, if any."""
+    applied = _applied_versions(bind)
+    return [
+        dict(
+            applied.get(m.version, {}),
+            version=m.version,
+            name=m.name,
+            status=applied.get(m.version, {}).get("status", "pending"),
+        )
+        for m in MIGRATIONS
+    ]
+
+
+if __name__ == "__main__":
+    import argparse
+
+    from . import models  # noqa: F401 (registers the tables)
+    from .database import create_db_and_tables, shard_engines
+
+    parser = argparse.ArgumentParser(
+        prog="python -m hpc_dispatch.migrations",
+        description="Apply or inspect versioned schema migrations.",
+    )
+    sub = parser.add_subparsers(dest="command", required=True)
+    upgrade_p = sub.add_parser("upgrade", help="Create tables and apply migrations")
+    upgrade_p.add_argument("--target", type=int, default=None)
+    status_p = sub.add_parser(
+        "status", help="List migrations and when they were applied"
+    )
+    status_p.add_argument("--shard", choices=list(shard_engines), default="default")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    if args.command == "upgrade":
+        settings.MIGRATIONS_ON_STARTUP = False  # applied explicitly below
+        create_db_and_tables()
+        for shard, bind in shard_engines.items():
+            print(f"{shard}: applied {upgrade(bind, args.target)} migrations.")
+    else:
+        for row in status(shard_engines[args.shard]):
+            print(
+                f"{row['version']:>5}  {row['status']:<8} "
+                f"{str(row.get('finished_at') or ''):<26} "
+                f"{row.get('duration_ms') or 0:>9.0f} ms  "
+                f"{row.get('applied_by') or '':<24} {row['name']}"
+            )
+            if row.get("error"):
+                print(f"       error: {row['error']}")
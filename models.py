@@ -1,6 +1,7 @@
 from datetime import datetime
 from enum import Enum
 from typing import List, Optional
+from sqlalchemy import Index, UniqueConstraint
 from sqlmodel import Field, Relationship, SQLModel
 
 
@@ -9,6 +10,8 @@ class User(SQLModel):
     full_name: str
     user_type: str
     is_admin: bool = Field(default=False)
+    # Shard key when department sharding is configured (see database.py).
+    department: Optional[str] = Field(default=None)
 
 
 class DispatchStatus(str, Enum):
@@ -26,6 +29,11 @@ class DispatchAction(str, Enum):
     STATUS_UPDATED = "status_updated"
     COMMENTED = "commented"
     FORWARDED = "forwarded"
+    OVERDUE = "overdue"
+
+
+# actor_id of history entries written by the service itself (see scheduler.py).
+SYSTEM_ACTOR_ID = 0
 
 
 class DispatchShelfLink(SQLModel, table=True):
@@ -64,6 +72,12 @@ class DispatchFile(SQLModel, table=True):
     file_url: str
     filename: str
     dispatch_id: int = Field(foreign_key="dispatch.id")
+    # Filled in asynchronously by attachments.py from a HEAD request.
+    content_length: Optional[int] = Field(default=None)
+    content_type: Optional[str] = Field(default=None)
+    etag: Optional[str] = Field(default=None)
+    metadata_checked_at: Optional[datetime] = Field(default=None, index=True)
+    metadata_error: Optional[str] = Field(default=None)
     dispatch: "Dispatch" = Relationship(back_populates="files")
 
 
@@ -93,6 +107,14 @@ class Dispatch(SQLModel, table=True):
     status: DispatchStatus = Field(default=DispatchStatus.DRAFT)
     created_at: datetime = Field(default_factory=datetime.utcnow)
     creator_id: int
+    # Bumped by every write; see versioning.py.
+    version: int = Field(default=1, sa_column_kwargs={"server_default": "1"})
+    # Deadlines acted on by scheduler.py: a DRAFT is sent at `scheduled_at`;
+    # an open dispatch past `due_at` is flagged once, at `overdue_at`.
+    scheduled_at: Optional[datetime] = Field(default=None)
+    due_at: Optional[datetime] = Field(default=None)
+    overdue_at: Optional[datetime] = Field(default=None)
+    scheduler_lease_until: Optional[datetime] = Field(default=None)
     files: List[DispatchFile] = Relationship(
         back_populates="dispatch",
         sa_relationship_kwargs={"cascade": "all, delete-orphan"},
@@ -112,3 +134,79 @@ class Dispatch(SQLModel, table=True):
         back_populates="dispatch",
         sa_relationship_kwargs={"cascade": "all, delete-orphan"},
     )
+
+
+class IdempotencyRecord(SQLModel, table=True):
+    """Outcome of a request sent with an `Idempotency-Key` header."""
+
+    # sha256 of (credentials, key); the raw key and token are not stored.
+    key_hash: str = Field(primary_key=True)
+    # sha256 of method, path, query and body, to detect a reused key.
+    request_hash: str
+    # NULL while the original request is still being processed.
+    status_code: Optional[int] = Field(default=None)
+    content_type: Optional[str] = Field(default=None)
+    # JSON list of [name, value] (see idempotency.STORED_HEADERS).
+    response_headers: Optional[str] = Field(default=None)
+    response_body: Optional[str] = Field(default=None)
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+    expires_at: datetime = Field(index=True)
+
+
+class OutboxEvent(SQLModel, table=True):
+    """A dispatch event awaiting delivery to downstream consumers."""
+
+    __table_args__ = (UniqueConstraint("dispatch_id", "sequence"),)
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    # No foreign key: events outlive deleted dispatches.
+    dispatch_id: int
+    sequence: int
+    event_type: str
+    payload: str
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+    delivered_at: Optional[datetime] = Field(default=None, index=True)
+    attempts: int = Field(default=0)
+    last_error: Optional[str] = Field(default=None)
+
+
+class OutboxRelayLease(SQLModel, table=True):
+    """The relay currently delivering this database's outbox (one row)."""
+
+    id: int = Field(default=1, primary_key=True)
+    holder: str
+    lease_until: datetime
+
+
+class OutboxSequence(SQLModel, table=True):
+    """Last event sequence number handed out per dispatch."""
+
+    dispatch_id: int = Field(primary_key=True)
+    last_sequence: int = Field(default=0)
+
+
+class DispatchInbox(SQLModel, table=True):
+    """
+    Denormalized listing entry, maintained by inbox.py: one row per dispatch
+    a user sees, per role ("incoming", "outgoing", and "all" for either), so
+    each "my dispatches" view is a single index range scan.
+    """
+
+    __table_args__ = (
+        Index("ix_dispatchinbox_recent", "user_id", "role", "created_at"),
+        Index(
+            "ix_dispatchinbox_listing",
+            "user_id",
+            "role",
+            "status",
+            "created_at",
+            "dispatch_id",
+        ),
+    )
+
+    user_id: int = Field(primary_key=True)
+    role: str = Field(primary_key=True)
+    # No foreign key: rows are rewritten wholesale and archiving removes them.
+    dispatch_id: int = Field(primary_key=True, index=True)
+    status: DispatchStatus
+    created_at: datetime
@@ -0,0 +1,442 @@
+"""
+Transactional outbox for dispatch events.
+
+Mutations call `emit()`; the event row is inserted in the caller's
+transaction, so it exists if and only if the change committed. A relay
+(an in-process background task, or `python -m hpc_dispatch.outbox`)
+delivers undelivered events in id order, in batches, to the configured
+sink. Delivery is at-least-once: consumers de-duplicate on
+(dispatch_id, sequence), which increases by one per event of a dispatch.
+With department sharding each shard has its own outbox and dispatch ids,
+and events carry a `shard` field: consumers then de-duplicate on
+(shard, dispatch_id, sequence).
+
+Any number of relays may run (one per worker or host, in-process or
+standalone): per shard, only the holder of the lease in `outboxrelaylease`
+delivers, so batches go out once and in order. The others take over when
+it stops or its lease runs out.
+"""
+
+import asyncio
+import hashlib
+import hmac
+import json
+import logging
+import os
+import socket
+import uuid
+from datetime import datetime, timedelta
+from typing import List, Optional, Set, Union
+
+import httpx
+from sqlalchemy import delete, event, exc, insert, or_, select, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.engine import Engine
+from sqlmodel import Session, SQLModel
+
+from . import models
+from .config import settings
+from .database import (
+    SHARDED,
+    http_client_store,
+    session_shard,
+    shard_engines,
+)
+
+logger = logging.getLogger(__name__)
+
+DELETED = "deleted"
+
+_PENDING_KEY = "outbox_pending"
+
+events_table = models.OutboxEvent.__table__
+sequences = models.OutboxSequence.__table__
+leases = models.OutboxRelayLease.__table__
+
+
+def _snapshot(dispatch: models.Dispatch) -> dict:
+    return {
+        "id": dispatch.id,
+        "title": dispatch.title,
+        "status": dispatch.status.value,
+        "creator_id": dispatch.creator_id,
+        "assignee_ids": sorted(link.assignee_id for link in dispatch.assignee_links),
+    }
+
+
+def emit(
+    session: Session,
+    dispatch: models.Dispatch,
+    event_type: Union[models.DispatchAction, str],
+    actor_id: int,
+    **data,
+):
+    """
+    Queues a `dispatch.<event_type>` event, written when `session` commits.
+    The dispatch snapshot and SQLModel values in `data` are serialized at
+    commit time, after flush, so new rows have their ids.
+    """
+    if not settings.OUTBOX_SINK:
+        return
+    event_type = getattr(event_type, "value", event_type)  # DispatchAction
+    # A deleted dispatch can no longer be read back at commit time.
+    snapshot = _snapshot(dispatch) if event_type == DELETED else None
+    session.info.setdefault(_PENDING_KEY, []).append(
+        (dispatch, snapshot, event_type, actor_id, data)
+    )
+
+
+def _next_sequence(connection, dispatch_id: int) -> int:
+    """
+    Atomically increments the dispatch's counter. The row lock it takes also
+    orders concurrent transactions on one dispatch, so sequence order is
+    commit order.
+    """
+    dialect = connection.dialect.name
+    if dialect in ("postgresql", "sqlite"):
+        insert_fn = postgresql.insert if dialect == "postgresql" else sqlite.insert
+        statement = (
+            insert_fn(sequences)
+            .values(dispatch_id=dispatch_id, last_sequence=1)
+            .on_conflict_do_update(
+                index_elements=[sequences.c.dispatch_id],
+                set_={"last_sequence": sequences.c.last_sequence + 1},
+            )
+            .returning(sequences.c.last_sequence)
+        )
+        return connection.execute(statement).scalar_one()
+    updated = connection.execute(
+        update(sequences)
+        .where(sequences.c.dispatch_id == dispatch_id)
+        .values(last_sequence=sequences.c.last_sequence + 1)
+    )
+    if not updated.rowcount:
+        connection.execute(
+            insert(sequences).values(dispatch_id=dispatch_id, last_sequence=0)
+        )
+        return _next_sequence(connection, dispatch_id)
+    return connection.execute(
+        select(sequences.c.last_sequence).where(sequences.c.dispatch_id == dispatch_id)
+    ).scalar_one()
+
+
+def _serialize(value):
+    if isinstance(value, SQLModel):
+        return value.model_dump(mode="json")
+    return value
+
+
+@event.listens_for(Session, "before_commit")
+def _write_pending_events(session):
+    pending = session.info.pop(_PENDING_KEY, None)
+    if not pending:
+        return
+    session.flush()
+    connection = session.connection()
+    now = datetime.utcnow()
+    for dispatch, snapshot, event_type, actor_id, data in pending:
+        snapshot = snapshot or _snapshot(dispatch)
+        sequence = _next_sequence(connection, snapshot["id"])
+        payload = {
+            "type": f"dispatch.{event_type}",
+            "dispatch_id": snapshot["id"],
+            "sequence": sequence,
+            "actor_id": actor_id,
+            "occurred_at": now.isoformat(),
+            "dispatch": snapshot,
+            "data": {k: _serialize(v) for k, v in data.items()},
+        }
+        if SHARDED:
+            payload["shard"] = session_shard(session)
+        connection.execute(
+            insert(events_table).values(
+                dispatch_id=snapshot["id"],
+                sequence=sequence,
+                event_type=payload["type"],
+                payload=json.dumps(payload),
+                created_at=now,
+            )
+        )
+    session.info["outbox_written"] = True
+
+
+@event.listens_for(Session, "after_commit")
+def _wake_relay(session):
+    if session.info.pop("outbox_written", False):
+        relay.wake()
+
+
+@event.listens_for(Session, "after_soft_rollback")
+def _discard_events(session, previous_transaction):
+    session.info.pop(_PENDING_KEY, None)
+    session.info.pop("outbox_written", None)
+
+
+# --- Sinks ---
+
+
+class FileSink:
+    """Appends events as JSON lines to a local file (a queue stand-in)."""
+
+    def __init__(self, path: str):
+        self.path = path
+
+    async def deliver(self, events: List[dict]):
+        await asyncio.to_thread(self._append, events)
+
+    def _append(self, events: List[dict]):
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write("".join(json.dumps(e) + "\n" for e in events))
+            f.flush()
+            os.fsync(f.fileno())
+
+
+class WebhookSink:
+    """
+    POSTs `{"events": [...]}` to a URL, retrying with exponential backoff.
+    With a secret, the body is signed in `X-Outbox-Signature` (HMAC-SHA256).
+    """
+
+    def __init__(self, url: str, secret: Optional[str] = None):
+        self.url = url
+        self.secret = secret
+
+    async def deliver(self, events: List[dict]):
+        body = json.dumps({"events": events}).encode()
+        headers = {"Content-Type": "application/json"}
+        if self.secret:
+            signature = hmac.new(self.secret.encode(), body, hashlib.sha256)
+            headers["X-Outbox-Signature"] = f"sha256={signature.hexdigest()}"
+        client = http_client_store["client"]
+        delay = 0.5
+        for attempt in range(1, settings.OUTBOX_WEBHOOK_RETRIES + 1):
+            try:
+                response = await client.post(
+                    self.url,
+                    content=body,
+                    headers=headers,
+                    timeout=settings.OUTBOX_WEBHOOK_TIMEOUT_SECONDS,
+                )
+                response.raise_for_status()
+                return
+            except httpx.HTTPError as e:
+                if attempt == settings.OUTBOX_WEBHOOK_RETRIES:
+                    raise
+                logger.warning(f"Webhook delivery attempt {attempt} failed: {e!r}")
+                await asyncio.sleep(delay)
+                delay *= 2
+
+
+def build_sink():
+    if settings.OUTBOX_SINK == "file":
+        return FileSink(settings.OUTBOX_FILE_PATH)
+    if settings.OUTBOX_SINK == "webhook":
+        if not settings.OUTBOX_WEBHOOK_URL:
+            raise ValueError("OUTBOX_WEBHOOK_URL is required for the webhook sink")
+        return WebhookSink(settings.OUTBOX_WEBHOOK_URL, settings.OUTBOX_WEBHOOK_SECRET)
+    raise ValueError(f"Unknown OUTBOX_SINK {settings.OUTBOX_SINK!r}")
+
+
+# --- Relay ---
+
+
+def _acquire_lease(bind: Engine, holder: str) -> bool:
+    """Takes or renews the shard's relay lease; False while another holds it."""
+    now = datetime.utcnow()
+    until = now + timedelta(seconds=settings.OUTBOX_LEASE_SECONDS)
+    with bind.begin() as conn:
+        renewed = conn.execute(
+            update(leases)
+            .where(
+                leases.c.id == 1,
+                or_(leases.c.holder == holder, leases.c.lease_until < now),
+            )
+            .values(holder=holder, lease_until=until)
+        ).rowcount
+    if renewed:
+        return True
+    try:
+        with bind.begin() as conn:
+            conn.execute(insert(leases).values(id=1, holder=holder, lease_until=until))
+        return True
+    except exc.IntegrityError:
+        return False  # held by another relay
+
+
+def _release_lease(bind: Engine, holder: str):
+    with bind.begin() as conn:
+        conn.execute(
+            update(leases)
+            .where(leases.c.id == 1, leases.c.holder == holder)
+            .values(lease_until=datetime.utcnow())
+        )
+
+
+def _fetch_batch(bind: Engine) -> List[dict]:
+    with bind.connect() as conn:
+        rows = conn.execute(
+            select(events_table.c.id, events_table.c.payload)
+            .where(events_table.c.delivered_at.is_(None))
+            .order_by(events_table.c.id)
+            .limit(settings.OUTBOX_BATCH_SIZE)
+        ).all()
+    return [dict(json.loads(payload), event_id=event_id) for event_id, payload in rows]
+
+
+def _mark_delivered(bind: Engine, event_ids: List[int]):
+    with bind.begin() as conn:
+        conn.execute(
+            update(events_table)
+            .where(events_table.c.id.in_(event_ids))
+            .values(
+                delivered_at=datetime.utcnow(), attempts=events_table.c.attempts + 1
+            )
+        )
+
+
+def _mark_failed(bind: Engine, event_ids: List[int], error: str):
+    with bind.begin() as conn:
+        conn.execute(
+            update(events_table)
+            .where(events_table.c.id.in_(event_ids))
+            .values(attempts=events_table.c.attempts + 1, last_error=error[:1000])
+        )
+
+
+def _purge_delivered(bind: Engine):
+    cutoff = datetime.utcnow() - timedelta(hours=settings.OUTBOX_RETENTION_HOURS)
+    with bind.begin() as conn:
+        conn.execute(
+            delete(events_table).where(
+                events_table.c.delivered_at.is_not(None),
+                events_table.c.delivered_at < cutoff,
+            )
+        )
+
+
+class OutboxRelay:
+    """
+    Delivers undelivered events in id order. A failing batch is retried as a
+    whole after an exponential backoff, so a later event of a dispatch is
+    never delivered before an earlier one.
+    """
+
+    def __init__(self):
+        self._task: Optional[asyncio.Task] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._holder: Optional[str] = None
+        self._held: Set[str] = set()
+
+    def wake(self):
+        """Called after a commit wrote events (from any thread)."""
+        if self._loop and self._wakeup:
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+
+    async def deliver_once(self, sink) -> int:
+        """
+        Delivers one batch per shard whose lease this relay holds. Returns
+        the size of the largest batch, so a full one means more are waiting.
+        """
+        if self._holder is None:
+            # Set here, not at import: workers fork after importing.
+            self._holder = (
+                f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+            )
+        largest = 0
+        for shard, bind in shard_engines.items():
+            held = await asyncio.to_thread(_acquire_lease, bind, self._holder)
+            if held != (shard in self._held):
+                logger.info(
+                    f"Outbox relay {'took over' if held else 'lost'} shard {shard}"
+                )
+                (self._held.add if held else self._held.discard)(shard)
+            if not held:
+                continue
+            batch = await asyncio.to_thread(_fetch_batch, bind)
+            if not batch:
+                continue
+            event_ids = [e.pop("event_id") for e in batch]
+            try:
+                await sink.deliver(batch)
+            except Exception as e:
+                await asyncio.to_thread(_mark_failed, bind, event_ids, repr(e))
+                raise
+            await asyncio.to_thread(_mark_delivered, bind, event_ids)
+            largest = max(largest, len(batch))
+        return largest
+
+    async def run(self, sink):
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        backoff = 0.0
+        last_purge = 0.0
+        while True:
+            try:
+                delivered = await self.deliver_once(sink)
+                backoff = 0.0
+            except Exception as e:
+                backoff = min(
+                    max(backoff * 2, settings.OUTBOX_POLL_INTERVAL_SECONDS),
+                    settings.OUTBOX_BACKOFF_MAX_SECONDS,
+                )
+                logger.warning(f"Outbox delivery failed, retrying in {backoff}s: {e!r}")
+                await asyncio.sleep(backoff)
+                continue
+            if self._loop.time() - last_purge > 3600:
+                last_purge = self._loop.time()
+                for bind in shard_engines.values():
+                    await asyncio.to_thread(_purge_delivered, bind)
+            if delivered == settings.OUTBOX_BATCH_SIZE:
+                continue  # more are waiting
+            try:
+                await asyncio.wait_for(
+                    self._wakeup.wait(), settings.OUTBOX_POLL_INTERVAL_SECONDS
+                )
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+    def start(self):
+        if not settings.OUTBOX_SINK or not settings.OUTBOX_RELAY_IN_PROCESS:
+            return
+        self._task = asyncio.create_task(self.run(build_sink()))
+        logger.info(f"Outbox relay started ({settings.OUTBOX_SINK} sink)")
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            # Let an in-flight delivery end before the HTTP client closes.
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await self.release()
+
+    async def release(self):
+        """Hands the leases over to the other relays right away."""
+        for shard in list(self._held):
+            await asyncio.to_thread(_release_lease, shard_engines[shard], self._holder)
+        self._held.clear()
+
+
+relay = OutboxRelay()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        prog="python -m hpc_dispatch.outbox",
+        description="Run the outbox relay as a standalone process.",
+    )
+    parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    async def run_standalone():
+        http_client_store["client"] = httpx.AsyncClient()
+        try:
+            await relay.run(build_sink())
+        finally:
+            await relay.release()
+            await http_client_store["client"].aclose()
+
+    asyncio.run(run_standalone())
@@ -0,0 +1,136 @@
+import json
+import logging
+import time
+from collections import Counter
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Any, List, Optional
+
+from fastapi import Request
+from fastapi.responses import JSONResponse
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from starlette.middleware.base import BaseHTTPMiddleware
+
+from .config import settings
+
+logger = logging.getLogger(__name__)
+
+SQL_DEBUG_HEADER = "X-SQL-Debug"
+SQL_SUMMARY_HEADER = "X-SQL-Summary"
+
+
+@dataclass
+class QueryRecord:
+    statement: str
+    parameters: Any
+    duration_ms: float
+
+
+@dataclass
+class RequestProfile:
+    """All statements issued while serving a single request."""
+
+    method: str
+    path: str
+    scope: dict
+    queries: List[QueryRecord] = field(default_factory=list)
+
+    @property
+    def route(self) -> str:
+        """The route template (e.g. `/dispatches/{dispatch_id}`) once routing ran."""
+        route = self.scope.get("route")
+        return f"{self.method} {getattr(route, 'path', self.path)}"
+
+    @property
+    def total_ms(self) -> float:
+        return sum(q.duration_ms for q in self.queries)
+
+    def summary(self) -> dict:
+        repeats = Counter(q.statement for q in self.queries)
+        return {
+            "count": len(self.queries),
+            "time_ms": round(self.total_ms, 2),
+            "distinct": len(repeats),
+            "max_repeat": max(repeats.values(), default=0),
+        }
+
+
+# The middleware sets a fresh profile per request. Sync endpoints and
+# dependencies run in the threadpool with a copy of this context, so they
+# append to the same (mutable) profile object.
+_current_profile: ContextVar[Optional[RequestProfile]] = ContextVar(
+    "sql_request_profile", default=None
+)
+
+
+# The start time lives on the per-execution context, so a statement that
+# raises (and never reaches `after_cursor_execute`) leaves nothing behind.
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if context is not None:
+        context._profiling_started = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = getattr(context, "_profiling_started", None)
+    if started is None:
+        return
+    duration_ms = (time.perf_counter() - started) * 1000
+    profile = _current_profile.get()
+    if profile is None:
+        return
+    profile.queries.append(QueryRecord(statement, parameters, duration_ms))
+    if duration_ms >= settings.SQL_SLOW_QUERY_MS:
+        logger.warning(
+            f"Slow query ({duration_ms:.1f} ms) on {profile.route}: "
+            f"{statement} -- params: {parameters!r}"
+        )
+
+
+def install_engine_hooks(engine: Engine):
+    """Attaches the timing listeners to the given engine (idempotent)."""
+    if not event.contains(engine, "before_cursor_execute", _before_cursor_execute):
+        event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+
+
+def get_query_budget(route: str) -> int:
+    """Returns the query budget for a route, 0 meaning unlimited."""
+    return settings.SQL_QUERY_BUDGETS.get(route, settings.SQL_QUERY_BUDGET)
+
+
+class SQLProfilingMiddleware(BaseHTTPMiddleware):
+    """
+    Records every SQL statement issued per request, enforces the configured
+    query-count budget and, on request, returns a summary header.
+    """
+
+    async def dispatch(self, request: Request, call_next):
+        profile = RequestProfile(
+            method=request.method, path=request.url.path, scope=request.scope
+        )
+        token = _current_profile.set(profile)
+        try:
+            response = await call_next(request)
+        finally:
+            _current_profile.reset(token)
+
+        summary = profile.summary()
+        budget = get_query_budget(profile.route)
+        if budget and summary["count"] > budget:
+            logger.warning(
+                f"{profile.route} issued {summary['count']} queries "
+                f"(budget {budget}, max repeat {summary['max_repeat']})"
+            )
+            if settings.SQL_QUERY_BUDGET_STRICT:
+                return JSONResponse(
+                    status_code=500,
+                    content={
+                        "detail": f"SQL query budget exceeded for {profile.route}",
+                        "sql": summary,
+                    },
+                )
+
+        if request.headers.get(SQL_DEBUG_HEADER):
+            response.headers[SQL_SUMMARY_HEADER] = json.dumps(summary)
+        return response
@@ -0,0 +1,155 @@
+import fcntl
+import hashlib
+import logging
+import math
+import mmap
+import os
+import struct
+import time
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+from fastapi import Depends, HTTPException, status
+from fastapi.security import HTTPAuthorizationCredentials
+
+from .auth import http_bearer_scheme, user_id_for_token
+from .config import settings
+
+logger = logging.getLogger(__name__)
+
+
+def _refill(
+    tokens: float, updated: float, rate: float, burst: int, now: float
+) -> Tuple[float, float]:
+    """
+    Takes one token from a bucket last seen at `updated`. Returns the new
+    token count and 0, or the unchanged count and the seconds to wait.
+    """
+    tokens = min(burst, tokens + (now - updated) * rate)
+    if tokens >= 1:
+        return tokens - 1, 0.0
+    return tokens, (1 - tokens) / rate
+
+
+class MemoryBuckets:
+    """Per-process buckets in an LRU-bounded dict (event loop only, no locks)."""
+
+    def __init__(self, max_keys: int):
+        self.max_keys = max_keys
+        self._buckets: "OrderedDict[str, Tuple[float, float]]" = OrderedDict()
+
+    def take(self, key: str, rate: float, burst: int) -> float:
+        now = time.monotonic()
+        tokens, updated = self._buckets.pop(key, (burst, now))
+        tokens, wait = _refill(tokens, updated, rate, burst, now)
+        self._buckets[key] = (tokens, now)
+        if len(self._buckets) > self.max_keys:
+            self._buckets.popitem(last=False)
+        return wait
+
+
+class SharedBuckets:
+    """
+    Buckets in a memory-mapped file shared by all workers on the host.
+
+    The file is a fixed hash table of (key hash, tokens, updated) slots,
+    guarded by flock. A key probes a few slots; when all are taken by other
+    keys, the least recently used one is reused, so the table never grows.
+    time.monotonic() is system-wide on Linux, so timestamps are comparable
+    across processes.
+    """
+
+    SLOT = struct.Struct("<Qdd")
+    PROBES = 4
+
+    def __init__(self, path: str, slots: int):
+        self.slots = slots
+        size = slots * self.SLOT.size
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        try:
+            if os.fstat(self._fd).st_size < size:
+                os.ftruncate(self._fd, size)
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+        self._map = mmap.mmap(self._fd, size)
+
+    def take(self, key: str, rate: float, burst: int) -> float:
+        digest = hashlib.blake2b(key.encode(), digest_size=8).digest()
+        key_hash = int.from_bytes(digest, "little") or 1  # 0 marks a free slot
+        start = key_hash % self.slots
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        try:
+            now = time.monotonic()
+            victim, victim_updated = None, math.inf
+            for i in range(self.PROBES):
+                offset = ((start + i) % self.slots) * self.SLOT.size
+                slot_hash, tokens, updated = self.SLOT.unpack_from(self._map, offset)
+                if slot_hash == key_hash:
+                    break
+                if updated < victim_updated:
+                    victim, victim_updated = offset, updated
+            else:
+                offset, tokens, updated = victim, burst, now
+            tokens, wait = _refill(tokens, updated, rate, burst, now)
+            self.SLOT.pack_into(self._map, offset, key_hash, tokens, now)
+            return wait
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+
+_store = None
+
+
+def get_store():
+    global _store
+    if _store is None:
+        if settings.RATE_LIMIT_BACKEND == "shared":
+            _store = SharedBuckets(
+                settings.RATE_LIMIT_SHARED_PATH, settings.RATE_LIMIT_MAX_KEYS
+            )
+        else:
+            _store = MemoryBuckets(settings.RATE_LIMIT_MAX_KEYS)
+    return _store
+
+
+def reset():
+    """Drops per-process state; called in each worker after fork."""
+    global _store
+    _store = None
+
+
+def _client_key(token: str) -> str:
+    # Per user once the token has been authenticated, per token before.
+    user_id = user_id_for_token(token)
+    if user_id is not None:
+        return f"user:{user_id}"
+    return "token:" + hashlib.blake2b(token.encode(), digest_size=8).hexdigest()
+
+
+class RateLimit:
+    """
+    Dependency applying the token bucket of a route group (see
+    settings.RATE_LIMITS) to the caller. Runs before authentication, so a
+    client over its limit does not cost a user-service call.
+    """
+
+    def __init__(self, group: str):
+        self.group = group
+
+    async def __call__(
+        self, creds: HTTPAuthorizationCredentials = Depends(http_bearer_scheme)
+    ):
+        limit: Optional[Tuple[float, int]] = settings.RATE_LIMITS.get(self.group)
+        if not settings.RATE_LIMIT_ENABLED or not limit:
+            return
+        rate, burst = limit
+        key = f"{self.group}:{_client_key(creds.credentials)}"
+        wait = get_store().take(key, rate, burst)
+        if wait:
+            logger.info(f"Rate limited {key}")
+            raise HTTPException(
+                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                detail=f"Rate limit exceeded for '{self.group}' requests.",
+                headers={"Retry-After": str(math.ceil(wait))},
+            )
@@ -1,16 +1,34 @@
 from typing import List, Optional
-from fastapi import APIRouter, Depends, HTTPException, status, Query
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Response, status
 from sqlmodel import Session, select, func
 
-from .. import models, schemas, utils
+from .. import (
+    access,
+    archive,
+    attachments,
+    audit,
+    inbox,
+    models,
+    outbox,
+    scheduler,
+    schemas,
+    utils,
+    versioning,
+)
 from ..auth import get_current_user, get_current_lecturer
-from ..database import get_session
+from ..database import SHARDED, department_shard, get_session, session_shard
+from ..ratelimit import RateLimit
+from ..users import UserResolver, dispatch_user_ids, get_user_resolver
 
 router = APIRouter(
     prefix="/dispatches",
     tags=["Dispatches"],
+    dependencies=[Depends(RateLimit("dispatches"))],
 )
 
+EXPAND_DESCRIPTION = "'users' adds a `users` map resolving every referenced user ID"
+IF_MATCH_DESCRIPTION = "Only apply the change if the dispatch still has this ETag"
+
 
 @router.post(
     "", response_model=schemas.DispatchRead, status_code=status.HTTP_201_CREATED
@@ -19,17 +37,22 @@ def create_dispatch(
     *,
     session: Session = Depends(get_session),
     dispatch_data: schemas.DispatchCreate,
+    response: Response,
     current_user: models.User = Depends(get_current_lecturer),
+    users: UserResolver = Depends(get_user_resolver),
 ):
     if not dispatch_data.assignee_ids:
         raise HTTPException(
             status_code=400, detail="At least one assignee ID is required."
         )
+    _check_assignee_shards(session, users, dispatch_data.assignee_ids)
 
     dispatch = models.Dispatch(
         title=dispatch_data.title,
         content=dispatch_data.content,
         creator_id=current_user.id,
+        scheduled_at=dispatch_data.scheduled_at,
+        due_at=dispatch_data.due_at,
     )
 
     for assignee_id in set(dispatch_data.assignee_ids):
@@ -42,14 +65,16 @@ def create_dispatch(
             models.DispatchFile(file_url=file_url, filename=file_url.split("/")[-1])
         )
 
-    dispatch.history.append(
-        models.DispatchHistory(
-            actor_id=current_user.id, action=models.DispatchAction.CREATED
-        )
-    )
+    audit.record(session, dispatch, current_user.id, models.DispatchAction.CREATED)
+    outbox.emit(session, dispatch, models.DispatchAction.CREATED, current_user.id)
+    inbox.track(session, dispatch)
+    scheduler.track(session, dispatch)
     session.add(dispatch)
     session.commit()
     session.refresh(dispatch)
+    attachments.enricher.submit((f.id for f in dispatch.files), session_shard(session))
+    response.headers["Location"] = f"/dispatches/{dispatch.id}"
+    response.headers["ETag"] = versioning.etag(dispatch.version)
     return utils.convert_dispatch_to_read_model(dispatch)
 
 
@@ -68,6 +93,12 @@ def get_my_dispatches(
         "created_at", enum=["created_at", "title", "status"]
     ),
     sort_dir: Optional[str] = Query("desc", enum=["asc", "desc"]),
+    include_archived: bool = Query(
+        False, description="Also return archived (closed, old) dispatches"
+    ),
+    archive_session: Session = Depends(archive.get_archive_session),
+    expand: List[str] = Query([], description=EXPAND_DESCRIPTION),
+    users: UserResolver = Depends(get_user_resolver),
 ):
     statement = select(models.Dispatch)
 
@@ -81,25 +112,20 @@ def get_my_dispatches(
             models.DispatchShelfLink.shelf_id == shelf_id
         )
 
-    if direction == "incoming":
-        statement = statement.join(models.DispatchAssigneeLink).where(
-            models.DispatchAssigneeLink.assignee_id == current_user.id
-        )
-    elif direction == "outgoing":
-        statement = statement.where(models.Dispatch.creator_id == current_user.id)
-    elif not shelf_id:
-        is_assignee_query = (
-            select(models.Dispatch.id)
-            .join(models.DispatchAssigneeLink)
-            .where(models.DispatchAssigneeLink.assignee_id == current_user.id)
-        )
-        statement = statement.where(
-            (models.Dispatch.creator_id == current_user.id)
-            | (models.Dispatch.id.in_(is_assignee_query))
-        )
-
-    if status:
+    # Incoming, outgoing or both: a range scan over the caller's inbox rows.
+    entry = models.DispatchInbox
+    inbox_filters = []
+    if direction in (inbox.INCOMING, inbox.OUTGOING) or not shelf_id:
+        role = direction if direction in (inbox.INCOMING, inbox.OUTGOING) else inbox.ALL
+        inbox_filters = [entry.user_id == current_user.id, entry.role == role]
+        if status:
+            inbox_filters.append(entry.status == status)
+        statement = statement.join(
+            entry, entry.dispatch_id == models.Dispatch.id
+        ).where(*inbox_filters)
+    elif status:
         statement = statement.where(models.Dispatch.status == status)
+
     if search:
         statement = statement.where(
             (models.Dispatch.title.contains(search))
@@ -107,16 +133,100 @@ def get_my_dispatches(
         )
 
     sort_column = getattr(models.Dispatch, sort_by, models.Dispatch.created_at)
+    if inbox_filters and sort_by in ("created_at", "status"):
+        sort_column = getattr(entry, sort_by)
     statement = statement.order_by(
         sort_column.desc() if sort_dir == "desc" else sort_column.asc()
     )
 
-    count_statement = select(func.count()).select_from(statement.subquery())
+    if inbox_filters and not shelf_id and not search:
+        count_statement = select(func.count()).select_from(entry).where(*inbox_filters)
+    else:
+        count_statement = select(func.count()).select_from(
+            statement.order_by(None).subquery()
+        )
     total_count = session.exec(count_statement).one()
-    dispatches = session.exec(statement.offset(skip).limit(limit)).all()
+    if not include_archived:
+        dispatches = session.exec(statement.offset(skip).limit(limit)).all()
+        items = [utils.convert_dispatch_to_read_model(d) for d in dispatches]
+    else:
+        dispatches = session.exec(statement.limit(skip + limit)).all()
+        archived_count, archived_items = archive.list_archived_dispatches(
+            archive_session,
+            visible_to=current_user.id,
+            direction=direction,
+            shelf_id=shelf_id,
+            status=status,
+            search=search,
+            sort_by=sort_by,
+            sort_dir=sort_dir,
+            limit=skip + limit,
+        )
+        total_count += archived_count
+        items = utils.merge_sorted_pages(
+            [utils.convert_dispatch_to_read_model(d) for d in dispatches],
+            archived_items,
+            sort_by,
+            sort_dir,
+            skip,
+            limit,
+        )
 
-    items = [utils.convert_dispatch_to_read_model(d) for d in dispatches]
-    return schemas.PaginatedResponse(total=total_count, items=items)
+    page = schemas.PaginatedResponse(total=total_count, items=items)
+    if "users" in expand:
+        page.users = users.resolve(uid for d in items for uid in dispatch_user_ids(d))
+    return page
+
+
+DETAIL_SECTIONS = ("files", "history", "comments", "shelves")
+
+
+def _parse_include(include: Optional[List[str]]) -> Optional[dict]:
+    """
+    Parses `include=history:20,comments` into {"history": 20, "comments": None}.
+    Returns None when the parameter is absent (embed everything).
+    """
+    if include is None:
+        return None
+    sections = {}
+    for part in (p.strip() for value in include for p in value.split(",")):
+        if not part:
+            continue
+        name, _, recent = part.partition(":")
+        if name not in DETAIL_SECTIONS or (recent and not recent.isdigit()):
+            raise HTTPException(
+                status_code=400,
+                detail=f"Invalid include '{part}'. Use one of {list(DETAIL_SECTIONS)}, "
+                "optionally with ':N' for the most recent N entries.",
+            )
+        sections[name] = int(recent) if recent else None
+    return sections
+
+
+def _recent_entries(session: Session, model, dispatch_id: int, limit: int) -> list:
+    """The `limit` most recent history/comment rows, in chronological order."""
+    entries = session.exec(
+        select(model)
+        .where(model.dispatch_id == dispatch_id)
+        .order_by(model.id.desc())
+        .limit(limit)
+    ).all()
+    return list(reversed(entries))
+
+
+def _trim_details(
+    details: schemas.DispatchReadWithDetails, sections: Optional[dict]
+) -> schemas.DispatchReadWithDetails:
+    if sections is None:
+        return details
+    update = {}
+    for name in DETAIL_SECTIONS:
+        entries = getattr(details, name)
+        if name not in sections:
+            update[name] = []
+        elif sections[name] is not None:
+            update[name] = entries[-sections[name] :] if sections[name] else []
+    return details.model_copy(update=update)
 
 
 @router.get("/{dispatch_id}", response_model=schemas.DispatchReadWithDetails)
@@ -125,20 +235,243 @@ def get_dispatch_details(
     session: Session = Depends(get_session),
     dispatch_id: int,
     current_user: models.User = Depends(get_current_user),
+    include: Optional[List[str]] = Query(
+        None,
+        description="Sections to embed (files, history, comments, shelves); "
+        "'history:20' embeds only the 20 most recent entries. Default: all.",
+    ),
+    include_archived: bool = Query(
+        False, description="Look the dispatch up in the archive as well"
+    ),
+    archive_session: Session = Depends(archive.get_archive_session),
+    expand: List[str] = Query([], description=EXPAND_DESCRIPTION),
+    users: UserResolver = Depends(get_user_resolver),
+    response: Response,
 ):
-    dispatch = session.get(models.Dispatch, dispatch_id)
+    details = _load_dispatch_details(
+        session,
+        archive_session,
+        dispatch_id,
+        current_user,
+        _parse_include(include),
+        include_archived,
+    )
+    if "users" in expand:
+        details.users = users.resolve(dispatch_user_ids(details))
+    response.headers["ETag"] = versioning.etag(details.version)
+    return details
+
+
+def _load_dispatch_details(
+    session: Session,
+    archive_session: Session,
+    dispatch_id: int,
+    current_user: models.User,
+    sections: Optional[dict],
+    include_archived: bool,
+) -> schemas.DispatchReadWithDetails:
+    exists = access.authorize(
+        session,
+        dispatch_id,
+        current_user,
+        detail="Not authorized to view this dispatch",
+    )
+    dispatch = session.get(models.Dispatch, dispatch_id) if exists else None
+    if not dispatch and include_archived:
+        details = archive.get_archived_dispatch_details(
+            archive_session, session, dispatch_id
+        )
+        if details:
+            if not current_user.is_admin and (
+                details.creator_id != current_user.id
+                and current_user.id not in details.assignee_ids
+            ):
+                raise HTTPException(
+                    status_code=403, detail="Not authorized to view this dispatch"
+                )
+            return _trim_details(details, sections)
     if not dispatch:
         raise HTTPException(status_code=404, detail="Dispatch not found")
 
-    assignee_ids = [link.assignee_id for link in dispatch.assignee_links]
-    if not current_user.is_admin and (
-        dispatch.creator_id != current_user.id and current_user.id not in assignee_ids
+    if sections is None:
+        return utils.convert_dispatch_to_detailed_read_model(dispatch)
+
+    # Only load the sections that were asked for.
+    embedded = {}
+    if "files" in sections:
+        embedded["files"] = dispatch.files
+    if "shelves" in sections:
+        embedded["shelves"] = [
+            schemas.ShelfRead.model_validate(s) for s in dispatch.shelves
+        ]
+    for name, model in (
+        ("history", models.DispatchHistory),
+        ("comments", models.Comment),
     ):
+        if name not in sections:
+            continue
+        if sections[name] is None:
+            embedded[name] = getattr(dispatch, name)
+        else:
+            embedded[name] = _recent_entries(
+                session, model, dispatch_id, sections[name]
+            )
+    return _trim_details(
+        schemas.DispatchReadWithDetails(
+            **utils.convert_dispatch_to_read_model(dispatch).model_dump(), **embedded
+        ),
+        sections,
+    )
+
+
+def _list_entries(
+    name: str,
+    model,
+    session: Session,
+    archive_session: Session,
+    dispatch_id: int,
+    current_user: models.User,
+    cursor: Optional[int],
+    limit: int,
+    order: str,
+    include_archived: bool,
+) -> schemas.CursorPage:
+    """Shared implementation of the comments/history sub-resources."""
+    detail = "Not authorized to view this dispatch"
+    archived = None
+    if not access.authorize(session, dispatch_id, current_user, detail=detail):
+        if include_archived:
+            archived = archive.get_archived_participants(archive_session, dispatch_id)
+        if not archived:
+            raise HTTPException(status_code=404, detail="Dispatch not found")
+        creator_id, assignee_ids = archived
+        if not current_user.is_admin and (
+            creator_id != current_user.id and current_user.id not in assignee_ids
+        ):
+            raise HTTPException(status_code=403, detail=detail)
+
+    if archived:
+        table, model = archive.ARCHIVED_ENTRIES[name]
+        rows, next_cursor = utils.keyset_page(
+            archive_session,
+            archive.select_archived_entries(name, dispatch_id),
+            table.c.id,
+            cursor,
+            limit,
+            order,
+        )
+        items = [model.model_validate(dict(r._mapping)) for r in rows]
+    else:
+        items, next_cursor = utils.keyset_page(
+            session,
+            select(model).where(model.dispatch_id == dispatch_id),
+            model.id,
+            cursor,
+            limit,
+            order,
+        )
+    return schemas.CursorPage(items=items, next_cursor=next_cursor)
+
+
+@router.get(
+    "/{dispatch_id}/comments", response_model=schemas.CursorPage[models.Comment]
+)
+def get_dispatch_comments(
+    *,
+    session: Session = Depends(get_session),
+    dispatch_id: int,
+    current_user: models.User = Depends(get_current_user),
+    cursor: Optional[int] = Query(None, description="`next_cursor` of the last page"),
+    limit: int = Query(50, ge=1, le=200),
+    order: str = Query("desc", enum=["asc", "desc"]),
+    include_archived: bool = False,
+    archive_session: Session = Depends(archive.get_archive_session),
+):
+    return _list_entries(
+        "comments",
+        models.Comment,
+        session,
+        archive_session,
+        dispatch_id,
+        current_user,
+        cursor,
+        limit,
+        order,
+        include_archived,
+    )
+
+
+@router.get(
+    "/{dispatch_id}/history",
+    response_model=schemas.CursorPage[models.DispatchHistory],
+)
+def get_dispatch_history(
+    *,
+    session: Session = Depends(get_session),
+    dispatch_id: int,
+    current_user: models.User = Depends(get_current_user),
+    cursor: Optional[int] = Query(None, description="`next_cursor` of the last page"),
+    limit: int = Query(50, ge=1, le=200),
+    order: str = Query("desc", enum=["asc", "desc"]),
+    include_archived: bool = False,
+    archive_session: Session = Depends(archive.get_archive_session),
+):
+    return _list_entries(
+        "history",
+        models.DispatchHistory,
+        session,
+        archive_session,
+        dispatch_id,
+        current_user,
+        cursor,
+        limit,
+        order,
+        include_archived,
+    )
+
+
+def _check_assignee_shards(
+    session: Session, users: UserResolver, assignee_ids: List[int]
+):
+    """
+    With department sharding a dispatch is only visible on its own shard, so
+    every assignee must belong to a department stored there.
+    """
+    if not SHARDED:
+        return
+    shard = session_shard(session)
+    profiles = users.lookup(assignee_ids)
+    if set(assignee_ids) - profiles.keys():
         raise HTTPException(
-            status_code=403, detail="Not authorized to view this dispatch"
+            status_code=503, detail="Could not look up the assignees; try again."
         )
+    elsewhere = sorted(
+        i
+        for i, profile in profiles.items()
+        if profile is None or department_shard(profile.department) != shard
+    )
+    if elsewhere:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Assignees {elsewhere} are unknown or in another department.",
+        )
+
 
-    return utils.convert_dispatch_to_detailed_read_model(dispatch)
+def _authorize_write(
+    session: Session,
+    dispatch_id: int,
+    current_user: models.User,
+    roles: List[str],
+    detail: str,
+):
+    """
+    404/403 before anything is loaded; see access.py. Not cached: another
+    worker may have changed the assignees.
+    """
+    if not access.authorize(
+        session, dispatch_id, current_user, roles, detail, cached=False
+    ):
+        raise HTTPException(status_code=404, detail="Dispatch not found")
 
 
 @router.put("/{dispatch_id}", response_model=schemas.DispatchRead)
@@ -148,45 +481,58 @@ def update_dispatch(
     dispatch_id: int,
     dispatch_data: schemas.DispatchUpdate,
     current_user: models.User = Depends(get_current_lecturer),
+    if_match: Optional[str] = Header(None, description=IF_MATCH_DESCRIPTION),
+    response: Response,
+    users: UserResolver = Depends(get_user_resolver),
 ):
-    dispatch = session.get(models.Dispatch, dispatch_id)
-    if not dispatch:
-        raise HTTPException(status_code=404, detail="Dispatch not found")
+    if dispatch_data.assignee_ids is not None:
+        _check_assignee_shards(session, users, dispatch_data.assignee_ids)
 
-    is_admin = current_user.is_admin
-    is_creator = dispatch.creator_id == current_user.id
-    is_draft = dispatch.status == models.DispatchStatus.DRAFT
-
-    if not (is_admin or (is_creator and is_draft)):
-        raise HTTPException(
-            status_code=403, detail="Not authorized to modify this dispatch"
-        )
+    def apply(dispatch: models.Dispatch) -> bool:
+        is_admin = current_user.is_admin
+        is_creator = dispatch.creator_id == current_user.id
+        is_draft = dispatch.status == models.DispatchStatus.DRAFT
 
-    update_data = dispatch_data.model_dump(exclude_unset=True)
-    if "assignee_ids" in update_data:
-        if not is_draft and not is_admin:
+        if not (is_admin or (is_creator and is_draft)):
             raise HTTPException(
-                status_code=403,
-                detail="Assignees can only be changed on DRAFT dispatches.",
+                status_code=403, detail="Not authorized to modify this dispatch"
             )
-        dispatch.assignee_links = [
-            models.DispatchAssigneeLink(assignee_id=id)
-            for id in set(update_data["assignee_ids"])
-        ]
-
-    if "title" in update_data:
-        dispatch.title = update_data["title"]
-    if "content" in update_data:
-        dispatch.content = update_data["content"]
 
-    dispatch.history.append(
-        models.DispatchHistory(
-            actor_id=current_user.id, action=models.DispatchAction.MODIFIED
-        )
-    )
-    session.add(dispatch)
-    session.commit()
-    session.refresh(dispatch)
+        update_data = dispatch_data.model_dump(exclude_unset=True)
+        if "assignee_ids" in update_data:
+            if not is_draft and not is_admin:
+                raise HTTPException(
+                    status_code=403,
+                    detail="Assignees can only be changed on DRAFT dispatches.",
+                )
+            dispatch.assignee_links = [
+                models.DispatchAssigneeLink(assignee_id=id)
+                for id in set(update_data["assignee_ids"])
+            ]
+            inbox.track(session, dispatch)
+
+        if "title" in update_data:
+            dispatch.title = update_data["title"]
+        if "content" in update_data:
+            dispatch.content = update_data["content"]
+        if "scheduled_at" in update_data:
+            if not is_draft and update_data["scheduled_at"] is not None:
+                raise HTTPException(
+                    status_code=400,
+                    detail="Only DRAFT dispatches can be scheduled for sending.",
+                )
+            dispatch.scheduled_at = update_data["scheduled_at"]
+        if "due_at" in update_data and update_data["due_at"] != dispatch.due_at:
+            dispatch.due_at = update_data["due_at"]
+            dispatch.overdue_at = None  # judged against the new deadline
+        scheduler.track(session, dispatch)
+
+        audit.record(session, dispatch, current_user.id, models.DispatchAction.MODIFIED)
+        outbox.emit(session, dispatch, models.DispatchAction.MODIFIED, current_user.id)
+        return True
+
+    dispatch = versioning.write_dispatch(session, dispatch_id, if_match, apply)
+    response.headers["ETag"] = versioning.etag(dispatch.version)
     return utils.convert_dispatch_to_read_model(dispatch)
 
 
@@ -196,26 +542,29 @@ def send_dispatch(
     session: Session = Depends(get_session),
     dispatch_id: int,
     current_user: models.User = Depends(get_current_lecturer),
+    if_match: Optional[str] = Header(None, description=IF_MATCH_DESCRIPTION),
+    response: Response,
 ):
-    dispatch = session.get(models.Dispatch, dispatch_id)
-    if not dispatch:
-        raise HTTPException(status_code=404, detail="Dispatch not found")
-    if dispatch.creator_id != current_user.id:
-        raise HTTPException(
-            status_code=403, detail="Only the creator can send this dispatch"
-        )
-    if dispatch.status != models.DispatchStatus.DRAFT:
-        raise HTTPException(status_code=400, detail=f"Dispatch is not in draft state")
+    def apply(dispatch: models.Dispatch) -> bool:
+        if dispatch.creator_id != current_user.id:
+            raise HTTPException(
+                status_code=403, detail="Only the creator can send this dispatch"
+            )
+        if dispatch.status != models.DispatchStatus.DRAFT:
+            raise HTTPException(
+                status_code=400, detail=f"Dispatch is not in draft state"
+            )
 
-    dispatch.status = models.DispatchStatus.PENDING
-    dispatch.history.append(
-        models.DispatchHistory(
-            actor_id=current_user.id, action=models.DispatchAction.SENT
-        )
-    )
-    session.add(dispatch)
-    session.commit()
-    session.refresh(dispatch)
+        dispatch.status = models.DispatchStatus.PENDING
+        dispatch.scheduled_at = None
+        audit.record(session, dispatch, current_user.id, models.DispatchAction.SENT)
+        outbox.emit(session, dispatch, models.DispatchAction.SENT, current_user.id)
+        inbox.track(session, dispatch)
+        scheduler.track(session, dispatch)
+        return True
+
+    dispatch = versioning.write_dispatch(session, dispatch_id, if_match, apply)
+    response.headers["ETag"] = versioning.etag(dispatch.version)
     return utils.convert_dispatch_to_read_model(dispatch)
 
 
@@ -226,28 +575,32 @@ def update_dispatch_status(
     dispatch_id: int,
     status_update: schemas.DispatchStatusUpdate,
     current_user: models.User = Depends(get_current_lecturer),
+    if_match: Optional[str] = Header(None, description=IF_MATCH_DESCRIPTION),
+    response: Response,
 ):
-    dispatch = session.get(models.Dispatch, dispatch_id)
-    if not dispatch:
-        raise HTTPException(status_code=404, detail="Dispatch not found")
-
-    assignee_ids = [link.assignee_id for link in dispatch.assignee_links]
-    if not current_user.is_admin and current_user.id not in assignee_ids:
-        raise HTTPException(
-            status_code=403, detail="Only an assignee or admin can update the status"
+    detail = "Only an assignee or admin can update the status"
+    _authorize_write(session, dispatch_id, current_user, [access.ASSIGNEE], detail)
+
+    def apply(dispatch: models.Dispatch) -> bool:
+        # The assignees may have changed since the check above.
+        access.verify(dispatch, current_user, [access.ASSIGNEE], detail)
+        dispatch.status = status_update.status
+        audit.record(
+            session,
+            dispatch,
+            current_user.id,
+            models.DispatchAction.STATUS_UPDATED,
+            f"Status changed to {status_update.status.value}",
         )
-
-    dispatch.status = status_update.status
-    dispatch.history.append(
-        models.DispatchHistory(
-            actor_id=current_user.id,
-            action=models.DispatchAction.STATUS_UPDATED,
-            details=f"Status changed to {status_update.status.value}",
+        outbox.emit(
+            session, dispatch, models.DispatchAction.STATUS_UPDATED, current_user.id
         )
-    )
-    session.add(dispatch)
-    session.commit()
-    session.refresh(dispatch)
+        inbox.track(session, dispatch)
+        scheduler.track(session, dispatch)
+        return True
+
+    dispatch = versioning.write_dispatch(session, dispatch_id, if_match, apply)
+    response.headers["ETag"] = versioning.etag(dispatch.version)
     return utils.convert_dispatch_to_read_model(dispatch)
 
 
@@ -259,27 +612,29 @@ def add_comment_to_dispatch(
     comment_data: schemas.CommentCreate,
     current_user: models.User = Depends(get_current_user),
 ):
+    _authorize_write(
+        session,
+        dispatch_id,
+        current_user,
+        [access.CREATOR, access.ASSIGNEE],
+        "Not authorized to comment on this dispatch",
+    )
     dispatch = session.get(models.Dispatch, dispatch_id)
     if not dispatch:
         raise HTTPException(status_code=404, detail="Dispatch not found")
 
-    assignee_ids = [link.assignee_id for link in dispatch.assignee_links]
-    if not current_user.is_admin and (
-        dispatch.creator_id != current_user.id and current_user.id not in assignee_ids
-    ):
-        raise HTTPException(
-            status_code=403, detail="Not authorized to comment on this dispatch"
-        )
-
     comment = models.Comment.model_validate(
         comment_data, update={"user_id": current_user.id, "dispatch_id": dispatch_id}
     )
-    dispatch.history.append(
-        models.DispatchHistory(
-            actor_id=current_user.id, action=models.DispatchAction.COMMENTED
-        )
-    )
+    audit.record(session, dispatch, current_user.id, models.DispatchAction.COMMENTED)
     session.add(comment)
+    outbox.emit(
+        session,
+        dispatch,
+        models.DispatchAction.COMMENTED,
+        current_user.id,
+        comment=comment,
+    )
     session.commit()
     session.refresh(comment)
     return comment
@@ -298,6 +653,8 @@ def delete_dispatch(
         is_creator = dispatch.creator_id == current_user.id
         is_draft = dispatch.status == models.DispatchStatus.DRAFT
         if is_admin or (is_creator and is_draft):
+            outbox.emit(session, dispatch, outbox.DELETED, current_user.id)
+            inbox.track(session, dispatch)
             session.delete(dispatch)
             session.commit()
         else:
@@ -314,40 +671,49 @@ def forward_dispatch(
     dispatch_id: int,
     forward_data: schemas.DispatchForward,
     current_user: models.User = Depends(get_current_lecturer),
+    if_match: Optional[str] = Header(None, description=IF_MATCH_DESCRIPTION),
+    response: Response,
+    users: UserResolver = Depends(get_user_resolver),
 ):
-    dispatch = session.get(models.Dispatch, dispatch_id)
-    if not dispatch:
-        raise HTTPException(status_code=404, detail="Dispatch not found")
+    new_assignee_id = forward_data.new_assignee_id
+    detail = "Only a current assignee or admin can forward"
+    _authorize_write(session, dispatch_id, current_user, [access.ASSIGNEE], detail)
+    _check_assignee_shards(session, users, [new_assignee_id])
+
+    def apply(dispatch: models.Dispatch) -> bool:
+        # The assignees may have changed since the check above.
+        access.verify(dispatch, current_user, [access.ASSIGNEE], detail)
+        if dispatch.status in [
+            models.DispatchStatus.DRAFT,
+            models.DispatchStatus.COMPLETED,
+        ]:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Cannot forward a dispatch with status '{dispatch.status}'",
+            )
+        if new_assignee_id in [link.assignee_id for link in dispatch.assignee_links]:
+            return False
 
-    assignee_ids = [link.assignee_id for link in dispatch.assignee_links]
-    if not current_user.is_admin and current_user.id not in assignee_ids:
-        raise HTTPException(
-            status_code=403, detail="Only a current assignee or admin can forward"
+        dispatch.assignee_links.append(
+            models.DispatchAssigneeLink(assignee_id=new_assignee_id)
         )
-    if dispatch.status in [
-        models.DispatchStatus.DRAFT,
-        models.DispatchStatus.COMPLETED,
-    ]:
-        raise HTTPException(
-            status_code=400,
-            detail=f"Cannot forward a dispatch with status '{dispatch.status}'",
+        audit.record(
+            session,
+            dispatch,
+            current_user.id,
+            models.DispatchAction.FORWARDED,
+            f"Forwarded to user {new_assignee_id}",
         )
-
-    new_assignee_id = forward_data.new_assignee_id
-    if new_assignee_id in assignee_ids:
-        return utils.convert_dispatch_to_read_model(dispatch)
-
-    dispatch.assignee_links.append(
-        models.DispatchAssigneeLink(assignee_id=new_assignee_id)
-    )
-    dispatch.history.append(
-        models.DispatchHistory(
-            actor_id=current_user.id,
-            action=models.DispatchAction.FORWARDED,
-            details=f"Forwarded to user {new_assignee_id}",
+        outbox.emit(
+            session,
+            dispatch,
+            models.DispatchAction.FORWARDED,
+            current_user.id,
+            new_assignee_id=new_assignee_id,
         )
-    )
-    session.add(dispatch)
-    session.commit()
-    session.refresh(dispatch)
+        inbox.track(session, dispatch)
+        return True
+
+    dispatch = versioning.write_dispatch(session, dispatch_id, if_match, apply)
+    response.headers["ETag"] = versioning.etag(dispatch.version)
     return utils.convert_dispatch_to_read_model(dispatch)
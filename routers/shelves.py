@@ -1,14 +1,20 @@
-from typing import List
+from collections import Counter
+from typing import Dict, List, Optional, Set
 from fastapi import APIRouter, Depends, HTTPException, status
-from sqlmodel import Session
+from sqlalchemy import delete, insert
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlmodel import Session, select
 
-from .. import models, schemas
+from .. import access, models, schemas, utils
 from ..auth import get_current_user
+from ..config import settings
 from ..database import get_session
+from ..ratelimit import RateLimit
 
 router = APIRouter(
     prefix="/shelves",
     tags=["Shelves"],
+    dependencies=[Depends(RateLimit("shelves"))],
 )
 
 
@@ -62,7 +68,10 @@ def get_shelf_details(
     shelf = session.get(models.Shelf, shelf_id)
     if not shelf or shelf.user_id != current_user.id:
         raise HTTPException(status_code=404, detail="Shelf not found or not authorized")
-    return shelf
+    return schemas.ShelfReadWithDispatches(
+        **schemas.ShelfReadWithChildren.model_validate(shelf).model_dump(),
+        dispatches=[utils.convert_dispatch_to_read_model(d) for d in shelf.dispatches],
+    )
 
 
 @router.put("/{shelf_id}", response_model=schemas.ShelfRead)
@@ -113,6 +122,182 @@ def delete_shelf(
     return
 
 
+# --- Shelving dispatches ---
+
+links = models.DispatchShelfLink.__table__
+
+
+def _get_own_shelf(session: Session, shelf_id: int, user: models.User) -> models.Shelf:
+    shelf = session.get(models.Shelf, shelf_id)
+    if not shelf or shelf.user_id != user.id:
+        raise HTTPException(status_code=404, detail="Shelf not found or not authorized")
+    return shelf
+
+
+def _bulk_ids(data: schemas.ShelfBulkDispatches) -> List[int]:
+    ids = list(dict.fromkeys(data.dispatch_ids))  # de-duplicated, in order
+    if not ids:
+        raise HTTPException(status_code=400, detail="dispatch_ids is empty.")
+    if len(ids) > settings.SHELF_BULK_MAX_ITEMS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"At most {settings.SHELF_BULK_MAX_ITEMS} dispatch IDs per call.",
+        )
+    return ids
+
+
+def _access_errors(
+    session: Session, ids: List[int], user: models.User
+) -> Dict[int, Optional[schemas.ShelfBulkOutcome]]:
+    """
+    NOT_FOUND or FORBIDDEN per dispatch ID, or None where the user may shelve
+    it (creator, assignee or admin), in one query (see access.py).
+    """
+    roles = (access.CREATOR, access.ASSIGNEE)
+    found = {
+        dispatch_id: user.is_admin or relation.allows(roles)
+        for dispatch_id, relation in access.relations(session, ids, user.id).items()
+    }
+    return {
+        i: (
+            schemas.ShelfBulkOutcome.NOT_FOUND
+            if i not in found
+            else None if found[i] else schemas.ShelfBulkOutcome.FORBIDDEN
+        )
+        for i in ids
+    }
+
+
+def _linked(session: Session, shelf_id: int, ids: List[int]) -> Set[int]:
+    if not ids:
+        return set()
+    return set(
+        session.exec(
+            select(models.DispatchShelfLink.dispatch_id).where(
+                models.DispatchShelfLink.shelf_id == shelf_id,
+                models.DispatchShelfLink.dispatch_id.in_(ids),
+            )
+        ).all()
+    )
+
+
+def _insert_links(session: Session, shelf_id: int, ids: List[int]):
+    if not ids:
+        return
+    dialect = session.get_bind().dialect.name
+    if dialect in ("postgresql", "sqlite"):
+        # A concurrent request may have shelved some of them meanwhile.
+        insert_fn = postgresql.insert if dialect == "postgresql" else sqlite.insert
+        statement = insert_fn(links).on_conflict_do_nothing()
+    else:
+        statement = insert(links)
+    session.execute(statement, [dict(shelf_id=shelf_id, dispatch_id=i) for i in ids])
+
+
+def _delete_links(session: Session, shelf_id: int, ids: List[int]):
+    if ids:
+        session.execute(
+            delete(links).where(
+                links.c.shelf_id == shelf_id, links.c.dispatch_id.in_(ids)
+            )
+        )
+
+
+def _bulk_result(
+    shelf_id: int, ids: List[int], outcomes: Dict[int, schemas.ShelfBulkOutcome]
+) -> schemas.ShelfBulkResult:
+    return schemas.ShelfBulkResult(
+        shelf_id=shelf_id,
+        results=[
+            schemas.ShelfBulkItem(dispatch_id=i, outcome=outcomes[i]) for i in ids
+        ],
+        counts=Counter(outcomes.values()),
+    )
+
+
+@router.post("/{shelf_id}/dispatches/bulk-add", response_model=schemas.ShelfBulkResult)
+def bulk_add_dispatches_to_shelf(
+    *,
+    session: Session = Depends(get_session),
+    shelf_id: int,
+    data: schemas.ShelfBulkDispatches,
+    current_user: models.User = Depends(get_current_user),
+):
+    shelf = _get_own_shelf(session, shelf_id, current_user)
+    ids = _bulk_ids(data)
+    outcomes = _access_errors(session, ids, current_user)
+    allowed = [i for i in ids if outcomes[i] is None]
+    linked = _linked(session, shelf.id, allowed)
+    for i in allowed:
+        outcomes[i] = (
+            schemas.ShelfBulkOutcome.ALREADY_PRESENT
+            if i in linked
+            else schemas.ShelfBulkOutcome.ADDED
+        )
+    _insert_links(session, shelf.id, [i for i in allowed if i not in linked])
+    session.commit()
+    return _bulk_result(shelf.id, ids, outcomes)
+
+
+@router.post(
+    "/{shelf_id}/dispatches/bulk-remove", response_model=schemas.ShelfBulkResult
+)
+def bulk_remove_dispatches_from_shelf(
+    *,
+    session: Session = Depends(get_session),
+    shelf_id: int,
+    data: schemas.ShelfBulkDispatches,
+    current_user: models.User = Depends(get_current_user),
+):
+    shelf = _get_own_shelf(session, shelf_id, current_user)
+    ids = _bulk_ids(data)
+    linked = _linked(session, shelf.id, ids)
+    outcomes = {
+        i: (
+            schemas.ShelfBulkOutcome.REMOVED
+            if i in linked
+            else schemas.ShelfBulkOutcome.NOT_PRESENT
+        )
+        for i in ids
+    }
+    _delete_links(session, shelf.id, list(linked))
+    session.commit()
+    return _bulk_result(shelf.id, ids, outcomes)
+
+
+@router.post("/{shelf_id}/dispatches/bulk-move", response_model=schemas.ShelfBulkResult)
+def bulk_move_dispatches(
+    *,
+    session: Session = Depends(get_session),
+    shelf_id: int,
+    data: schemas.ShelfBulkMove,
+    current_user: models.User = Depends(get_current_user),
+):
+    """Moves dispatches from this shelf to `target_shelf_id`."""
+    shelf = _get_own_shelf(session, shelf_id, current_user)
+    target = _get_own_shelf(session, data.target_shelf_id, current_user)
+    if target.id == shelf.id:
+        raise HTTPException(
+            status_code=400, detail="Source and target shelf are the same."
+        )
+    ids = _bulk_ids(data)
+    outcomes = _access_errors(session, ids, current_user)
+    allowed = [i for i in ids if outcomes[i] is None]
+    linked = _linked(session, shelf.id, allowed)
+    for i in allowed:
+        outcomes[i] = (
+            schemas.ShelfBulkOutcome.MOVED
+            if i in linked
+            else schemas.ShelfBulkOutcome.NOT_PRESENT
+        )
+    to_move = [i for i in allowed if i in linked]
+    on_target = _linked(session, target.id, to_move)
+    _delete_links(session, shelf.id, to_move)
+    _insert_links(session, target.id, [i for i in to_move if i not in on_target])
+    session.commit()
+    return _bulk_result(shelf.id, ids, outcomes)
+
+
 @router.post("/{shelf_id}/dispatches/{dispatch_id}", response_model=schemas.ShelfRead)
 def add_dispatch_to_shelf(
     *,
@@ -121,27 +306,14 @@ def add_dispatch_to_shelf(
     dispatch_id: int,
     current_user: models.User = Depends(get_current_user)
 ):
-    shelf = session.get(models.Shelf, shelf_id)
-    if not shelf or shelf.user_id != current_user.id:
-        raise HTTPException(status_code=404, detail="Shelf not found or not authorized")
-
-    dispatch = session.get(models.Dispatch, dispatch_id)
-    if not dispatch:
+    shelf = _get_own_shelf(session, shelf_id, current_user)
+    if not access.authorize(session, dispatch_id, current_user):
         raise HTTPException(status_code=404, detail="Dispatch not found")
 
-    assignee_ids = [link.assignee_id for link in dispatch.assignee_links]
-    if not current_user.is_admin and (
-        dispatch.creator_id != current_user.id and current_user.id not in assignee_ids
-    ):
-        raise HTTPException(
-            status_code=403, detail="Not authorized to access this dispatch"
-        )
-
-    if dispatch not in shelf.dispatches:
-        shelf.dispatches.append(dispatch)
-        session.add(shelf)
+    if not _linked(session, shelf.id, [dispatch_id]):
+        _insert_links(session, shelf.id, [dispatch_id])
         session.commit()
-    session.refresh(shelf)
+        session.refresh(shelf)
     return shelf
 
 
@@ -157,9 +329,6 @@ def remove_dispatch_from_shelf(
 ):
     shelf = session.get(models.Shelf, shelf_id)
     if shelf and shelf.user_id == current_user.id:
-        dispatch = session.get(models.Dispatch, dispatch_id)
-        if dispatch and dispatch in shelf.dispatches:
-            shelf.dispatches.remove(dispatch)
-            session.add(shelf)
-            session.commit()
+        _delete_links(session, shelf.id, [dispatch_id])
+        session.commit()
     return
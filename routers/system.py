@@ -1,11 +1,22 @@
-from typing import Optional
-from fastapi import APIRouter, Depends, Query
+from collections import Counter
+from typing import List, Optional, Tuple
+from fastapi import APIRouter, Depends, Query, Response, status
+from fastapi.responses import PlainTextResponse
 from sqlmodel import Session, select, func
 
-from .. import models, schemas, utils
+from .. import admission, archive, health, inbox, models, schemas, utils
 from ..auth import get_current_user, get_current_admin, MOCK_USERS
 from ..config import settings
-from ..database import get_session
+from ..database import (
+    DEFAULT_SHARD,
+    SHARDED,
+    fan_out,
+    get_session,
+    open_session,
+    shard_engines,
+)
+from ..ratelimit import RateLimit
+from ..users import UserResolver, dispatch_user_ids, get_user_resolver
 
 router = APIRouter()
 
@@ -31,36 +42,59 @@ def health_check():
     return {"status": "ok"}
 
 
-@router.get("/dispatches/stats/my", response_model=schemas.MyStats, tags=["Statistics"])
+@router.get("/health/live", tags=["System"])
+async def liveness_check():
+    """Liveness: the worker is up and its event loop responds."""
+    return {"status": "ok"}
+
+
+@router.get("/health/ready", tags=["System"])
+async def readiness_check(response: Response):
+    """
+    Readiness: database round trip, connection pool headroom and user-service
+    latency, cached for a few seconds. 503 when a dependency is down.
+    """
+    result = await health.readiness.get()
+    if result["status"] == "unavailable":
+        response.status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    return result
+
+
+@router.get("/metrics", tags=["System"], response_class=PlainTextResponse)
+async def get_metrics():
+    """Admission-control queue metrics (Prometheus text format, per worker)."""
+    return admission.controller.prometheus()
+
+
+@router.get(
+    "/dispatches/stats/my",
+    response_model=schemas.MyStats,
+    tags=["Statistics"],
+    dependencies=[Depends(RateLimit("stats"))],
+)
 def get_my_stats(
     *,
     session: Session = Depends(get_session),
     current_user: models.User = Depends(get_current_user)
 ):
-    user_id = current_user.id
-    incoming_count = session.exec(
-        select(func.count(models.DispatchAssigneeLink.dispatch_id)).where(
-            models.DispatchAssigneeLink.assignee_id == user_id
-        )
-    ).one()
-    outgoing_count = session.exec(
-        select(func.count(models.Dispatch.id)).where(
-            models.Dispatch.creator_id == user_id
-        )
-    ).one()
-
-    is_assignee_q = (
-        select(models.Dispatch.id)
-        .join(models.DispatchAssigneeLink)
-        .where(models.DispatchAssigneeLink.assignee_id == user_id)
+    entry = models.DispatchInbox
+    role_counts = dict(
+        session.exec(
+            select(entry.role, func.count())
+            .where(
+                entry.user_id == current_user.id,
+                entry.role.in_([inbox.INCOMING, inbox.OUTGOING]),
+            )
+            .group_by(entry.role)
+        ).all()
     )
+    incoming_count = role_counts.get(inbox.INCOMING, 0)
+    outgoing_count = role_counts.get(inbox.OUTGOING, 0)
+
     status_q = session.exec(
-        select(models.Dispatch.status, func.count(models.Dispatch.id))
-        .where(
-            (models.Dispatch.creator_id == user_id)
-            | (models.Dispatch.id.in_(is_assignee_q))
-        )
-        .group_by(models.Dispatch.status)
+        select(entry.status, func.count())
+        .where(entry.user_id == current_user.id, entry.role == inbox.ALL)
+        .group_by(entry.status)
     ).all()
 
     status_counts = {s.value: 0 for s in models.DispatchStatus}
@@ -72,85 +106,171 @@ def get_my_stats(
 
 
 @router.get(
-    "/dispatches/stats/system", response_model=schemas.SystemStats, tags=["Statistics"]
+    "/dispatches/stats/system",
+    response_model=schemas.SystemStats,
+    tags=["Statistics"],
+    dependencies=[Depends(RateLimit("stats"))],
 )
 def get_system_stats(
     *,
-    session: Session = Depends(get_session),
     current_user: models.User = Depends(get_current_admin),
-    limit: int = 5
+    limit: int = 5,
+    expand: List[str] = Query([]),
+    users: UserResolver = Depends(get_user_resolver)
 ):
-    total_dispatches = session.exec(select(func.count(models.Dispatch.id))).one()
+    by_shard = fan_out(lambda shard, session: _shard_stats(session, limit))
+    total_dispatches = sum(stats["total"] for stats in by_shard.values())
+    status_counts = {s.value: 0 for s in models.DispatchStatus}
+    creators, assignees = Counter(), Counter()
+    for stats in by_shard.values():
+        for status, count in stats["status"]:
+            status_counts[status.value] += count
+        creators.update(dict(stats["creators"]))
+        assignees.update(dict(stats["assignees"]))
+
+    # Each shard's top `limit` merged: exact as long as a user's dispatches
+    # live on a single shard, i.e. users stay in one department.
+    top_creators = [
+        schemas.UserActivityStat(user_id=uid, count=c)
+        for uid, c in creators.most_common(limit)
+    ]
+    top_assignees = [
+        schemas.UserActivityStat(user_id=uid, count=c)
+        for uid, c in assignees.most_common(limit)
+    ]
+
+    stats = schemas.SystemStats(
+        total_dispatches=total_dispatches,
+        status_counts=status_counts,
+        top_creators=top_creators,
+        top_assignees=top_assignees,
+    )
+    if "users" in expand:
+        stats.users = users.resolve(s.user_id for s in top_creators + top_assignees)
+    return stats
+
+
+def _shard_stats(session: Session, limit: int) -> dict:
+    total = session.exec(select(func.count(models.Dispatch.id))).one()
     status_q = session.exec(
         select(models.Dispatch.status, func.count()).group_by(models.Dispatch.status)
     ).all()
-    status_counts = {s.value: 0 for s in models.DispatchStatus}
-    status_counts.update({status: count for status, count in status_q})
-
     creator_q = session.exec(
         select(models.Dispatch.creator_id, func.count().label("count"))
         .group_by(models.Dispatch.creator_id)
         .order_by(func.count().desc())
         .limit(limit)
     ).all()
-    top_creators = [
-        schemas.UserActivityStat(user_id=uid, count=c) for uid, c in creator_q
-    ]
-
     assignee_q = session.exec(
         select(models.DispatchAssigneeLink.assignee_id, func.count().label("count"))
         .group_by(models.DispatchAssigneeLink.assignee_id)
         .order_by(func.count().desc())
         .limit(limit)
     ).all()
-    top_assignees = [
-        schemas.UserActivityStat(user_id=uid, count=c) for uid, c in assignee_q
-    ]
-
-    return schemas.SystemStats(
-        total_dispatches=total_dispatches,
-        status_counts=status_counts,
-        top_creators=top_creators,
-        top_assignees=top_assignees,
-    )
+    return {
+        "total": total,
+        "status": status_q,
+        "creators": creator_q,
+        "assignees": assignee_q,
+    }
 
 
 @router.get(
     "/admin/dispatches",
     response_model=schemas.PaginatedResponse[schemas.DispatchRead],
     tags=["Admin"],
+    dependencies=[Depends(RateLimit("admin"))],
 )
 def get_all_dispatches(
     *,
-    session: Session = Depends(get_session),
     current_user: models.User = Depends(get_current_admin),
     assignee_id: Optional[int] = Query(None),
     creator_id: Optional[int] = Query(None),
     status: Optional[models.DispatchStatus] = None,
     search: Optional[str] = None,
     skip: int = 0,
-    limit: int = 100
+    limit: int = 100,
+    include_archived: bool = False,
+    expand: List[str] = Query([]),
+    users: UserResolver = Depends(get_user_resolver)
 ):
+    filters = dict(
+        assignee_id=assignee_id, creator_id=creator_id, status=status, search=search
+    )
+    if not SHARDED:
+        # One database: page in SQL instead of fetching `skip + limit` rows.
+        with open_session() as session:
+            total_count, items = _shard_dispatches(
+                session, DEFAULT_SHARD, filters, skip, limit, include_archived
+            )
+    else:
+        by_shard = fan_out(
+            lambda shard, session: _shard_dispatches(
+                session, shard, filters, 0, skip + limit, include_archived
+            )
+        )
+        total_count = sum(count for count, _ in by_shard.values())
+        items = utils.merge_sorted_pages(
+            [d for _, shard_items in by_shard.values() for d in shard_items],
+            [],
+            "created_at",
+            "desc",
+            skip,
+            limit,
+        )
+
+    page = schemas.PaginatedResponse(total=total_count, items=items)
+    if "users" in expand:
+        page.users = users.resolve(uid for d in items for uid in dispatch_user_ids(d))
+    return page
+
+
+def _shard_dispatches(
+    session: Session,
+    shard: str,
+    filters: dict,
+    skip: int,
+    limit: int,
+    include_archived: bool,
+) -> Tuple[int, List[schemas.DispatchRead]]:
+    """Total matches and the requested page of one shard, newest first."""
     statement = select(models.Dispatch)
-    if assignee_id:
+    if filters["assignee_id"]:
         statement = statement.join(models.DispatchAssigneeLink).where(
-            models.DispatchAssigneeLink.assignee_id == assignee_id
+            models.DispatchAssigneeLink.assignee_id == filters["assignee_id"]
         )
-    if creator_id:
-        statement = statement.where(models.Dispatch.creator_id == creator_id)
-    if status:
-        statement = statement.where(models.Dispatch.status == status)
-    if search:
+    if filters["creator_id"]:
+        statement = statement.where(models.Dispatch.creator_id == filters["creator_id"])
+    if filters["status"]:
+        statement = statement.where(models.Dispatch.status == filters["status"])
+    if filters["search"]:
         statement = statement.where(
-            (models.Dispatch.title.contains(search))
-            | (models.Dispatch.content.contains(search))
+            (models.Dispatch.title.contains(filters["search"]))
+            | (models.Dispatch.content.contains(filters["search"]))
         )
 
     count_statement = select(func.count()).select_from(statement.subquery())
     total_count = session.exec(count_statement).one()
-    dispatches = session.exec(
-        statement.order_by(models.Dispatch.created_at.desc()).offset(skip).limit(limit)
-    ).all()
-
-    items = [utils.convert_dispatch_to_read_model(d) for d in dispatches]
-    return schemas.PaginatedResponse(total=total_count, items=items)
+    statement = statement.order_by(models.Dispatch.created_at.desc())
+    if not include_archived:
+        dispatches = session.exec(statement.offset(skip).limit(limit)).all()
+        items = [utils.convert_dispatch_to_read_model(d) for d in dispatches]
+    else:
+        dispatches = session.exec(statement.limit(skip + limit)).all()
+        with Session(archive.engine_for(shard_engines[shard])) as archive_session:
+            archived_count, archived_items = archive.list_archived_dispatches(
+                archive_session, limit=skip + limit, **filters
+            )
+        total_count += archived_count
+        items = utils.merge_sorted_pages(
+            [utils.convert_dispatch_to_read_model(d) for d in dispatches],
+            archived_items,
+            "created_at",
+            "desc",
+            skip,
+            limit,
+        )
+    if SHARDED:
+        for item in items:
+            item.shard = shard
+    return total_count, items
@@ -0,0 +1,393 @@
+"""
+Scheduled sends and overdue flags.
+
+A DRAFT with `scheduled_at` is sent at that time; a PENDING or IN_PROGRESS
+dispatch still open at its `due_at` gets `overdue_at` set. Each action is
+recorded in the dispatch history (and the outbox) like a user's would be.
+
+Every worker keeps a min-heap of upcoming deadlines and sleeps until the
+earliest one instead of polling. The heap is filled from two index-ordered
+scans per shard (see migration 6), topped up by this worker's own commits
+as they happen (see `track`), and rebuilt every SCHEDULER_RESYNC_SECONDS
+to pick up deadlines set through other workers.
+
+Several workers may hold the same deadline. Before acting, a worker claims
+the row with a conditional UPDATE that sets `scheduler_lease_until`, which
+only matches while the deadline is still due and no other lease is live,
+so exactly one of them runs the job. The action itself is a regular
+versioned write (see versioning.py) that clears the lease; a worker that
+dies half-way leaves a lease that expires after SCHEDULER_LEASE_SECONDS.
+"""
+
+import asyncio
+import heapq
+import logging
+from datetime import datetime, timedelta
+from typing import Dict, List, NamedTuple, Optional
+
+from fastapi import HTTPException
+from sqlalchemy import event, or_, select, update
+from sqlalchemy.engine import Engine
+from sqlmodel import Session
+
+from . import audit, inbox, models, outbox, versioning
+from .config import settings
+from .database import open_session, session_shard, shard_engines
+
+logger = logging.getLogger(__name__)
+
+SEND, OVERDUE = "send", "overdue"
+
+OPEN_STATUSES = (models.DispatchStatus.PENDING, models.DispatchStatus.IN_PROGRESS)
+
+# A job that lost a write race is retried after this delay.
+RETRY_DELAY = timedelta(seconds=5)
+# Least time between resyncs, even with a backlog of due (possibly leased) jobs.
+MIN_RESYNC_SECONDS = 1.0
+
+_TRACKED_KEY = "scheduler_tracked"
+_JOBS_KEY = "scheduler_jobs"
+
+dispatches = models.Dispatch.__table__
+
+
+class Job(NamedTuple):
+    when: datetime
+    shard: str
+    dispatch_id: int
+    kind: str
+
+
+def _due(kind: str, now: datetime):
+    """SQL condition: the job is due on the row."""
+    if kind == SEND:
+        return (
+            dispatches.c.status == models.DispatchStatus.DRAFT,
+            dispatches.c.scheduled_at <= now,
+        )
+    return (
+        dispatches.c.status.in_(OPEN_STATUSES),
+        dispatches.c.overdue_at.is_(None),
+        dispatches.c.due_at <= now,
+    )
+
+
+def jobs_for(dispatch: models.Dispatch, shard: str) -> List[Job]:
+    """The deadlines still to act on for a dispatch."""
+    jobs = []
+    if dispatch.status == models.DispatchStatus.DRAFT and dispatch.scheduled_at:
+        jobs.append(Job(dispatch.scheduled_at, shard, dispatch.id, SEND))
+    if (
+        dispatch.status in OPEN_STATUSES
+        and dispatch.due_at
+        and dispatch.overdue_at is None
+    ):
+        jobs.append(Job(dispatch.due_at, shard, dispatch.id, OVERDUE))
+    return jobs
+
+
+def _upcoming(shard: str, limit: int):
+    """
+    The earliest `limit` deadlines of each kind on a shard, and the time up
+    to which that covers every deadline (None if none were cut off).
+    """
+    scans = [
+        (
+            SEND,
+            dispatches.c.scheduled_at,
+            [dispatches.c.status == models.DispatchStatus.DRAFT],
+        )
+    ]
+    # One scan per status, so each reads the (status, overdue_at, due_at)
+    # index in order.
+    for status in OPEN_STATUSES:
+        scans.append(
+            (
+                OVERDUE,
+                dispatches.c.due_at,
+                [
+                    dispatches.c.status == status,
+                    dispatches.c.overdue_at.is_(None),
+                ],
+            )
+        )
+    jobs: List[Job] = []
+    horizon: Optional[datetime] = None
+    with shard_engines[shard].connect() as conn:
+        for kind, column, conditions in scans:
+            rows = conn.execute(
+                select(dispatches.c.id, column)
+                .where(*conditions, column.is_not(None))
+                .order_by(column)
+                .limit(limit)
+            ).all()
+            jobs += [Job(when, shard, dispatch_id, kind) for dispatch_id, when in rows]
+            if len(rows) == limit:
+                horizon = min(horizon or rows[-1][1], rows[-1][1])
+    return jobs, horizon
+
+
+def _claim(bind: Engine, job: Job, now: datetime) -> Optional[datetime]:
+    """Takes the job's lease; returns it, or None if not due or taken."""
+    lease = dispatches.c.scheduler_lease_until
+    lease_until = now + timedelta(seconds=settings.SCHEDULER_LEASE_SECONDS)
+    with bind.begin() as conn:
+        result = conn.execute(
+            update(dispatches)
+            .where(
+                dispatches.c.id == job.dispatch_id,
+                *_due(job.kind, now),
+                or_(lease.is_(None), lease < now),
+            )
+            .values(scheduler_lease_until=lease_until)
+        )
+    return lease_until if result.rowcount == 1 else None
+
+
+def _release(bind: Engine, job: Job, lease_until: datetime):
+    with bind.begin() as conn:
+        conn.execute(
+            update(dispatches)
+            .where(
+                dispatches.c.id == job.dispatch_id,
+                dispatches.c.scheduler_lease_until == lease_until,
+            )
+            .values(scheduler_lease_until=None)
+        )
+
+
+def _send(session: Session, dispatch: models.Dispatch, now: datetime) -> bool:
+    if not (
+        dispatch.status == models.DispatchStatus.DRAFT
+        and dispatch.scheduled_at
+        and dispatch.scheduled_at <= now
+    ):
+        return False
+    dispatch.status = models.DispatchStatus.PENDING
+    dispatch.scheduled_at = None
+    # Sent on the creator's behalf, as they asked.
+    audit.record(
+        session,
+        dispatch,
+        dispatch.creator_id,
+        models.DispatchAction.SENT,
+        "Sent as scheduled",
+    )
+    outbox.emit(session, dispatch, models.DispatchAction.SENT, dispatch.creator_id)
+    inbox.track(session, dispatch)
+    track(session, dispatch)  # its due_at counts from now on
+    return True
+
+
+def _flag_overdue(session: Session, dispatch: models.Dispatch, now: datetime) -> bool:
+    if not (
+        dispatch.status in OPEN_STATUSES
+        and dispatch.overdue_at is None
+        and dispatch.due_at
+        and dispatch.due_at <= now
+    ):
+        return False
+    dispatch.overdue_at = now
+    audit.record(
+        session,
+        dispatch,
+        models.SYSTEM_ACTOR_ID,
+        models.DispatchAction.OVERDUE,
+        f"Due at {dispatch.due_at.isoformat()}",
+    )
+    outbox.emit(
+        session, dispatch, models.DispatchAction.OVERDUE, models.SYSTEM_ACTOR_ID
+    )
+    return True
+
+
+ACTIONS = {SEND: _send, OVERDUE: _flag_overdue}
+
+
+def run_job(job: Job) -> bool:
+    """Claims and runs one job. Returns False if it was not (or no longer) due."""
+    bind = shard_engines[job.shard]
+    now = datetime.utcnow()
+    lease_until = _claim(bind, job, now)
+    if lease_until is None:
+        return False
+    applied, done = False, False
+    try:
+        with open_session(job.shard) as session:
+
+            def apply(dispatch: models.Dispatch) -> bool:
+                nonlocal applied
+                applied = ACTIONS[job.kind](session, dispatch, now)
+                if applied:
+                    dispatch.scheduler_lease_until = None
+                return applied
+
+            versioning.write_dispatch(session, job.dispatch_id, None, apply)
+            done = applied  # committed
+    finally:
+        if not done:
+            _release(bind, job, lease_until)
+    if done:
+        logger.info(f"Scheduler: {job.kind} dispatch {job.dispatch_id} ({job.shard})")
+    return done
+
+
+class DispatchScheduler:
+    """Sleeps until the earliest known deadline, then runs the due jobs."""
+
+    def __init__(self):
+        self._heap: List[Job] = []
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._next_resync = 0.0
+        # Jobs pushed while a resync is reading the database.
+        self._pushed_during_resync: Optional[List[Job]] = None
+
+    def push(self, jobs: List[Job]):
+        """Adds deadlines (from any thread); wakes the loop if one is earlier."""
+        if jobs and self._loop:
+            self._loop.call_soon_threadsafe(self._push, jobs)
+
+    def _push(self, jobs: List[Job]):
+        if self._pushed_during_resync is not None:
+            self._pushed_during_resync += jobs
+        earliest = self._heap[0].when if self._heap else None
+        for job in jobs:
+            heapq.heappush(self._heap, job)
+        if earliest is None or self._heap[0].when < earliest:
+            self._wakeup.set()
+
+    async def resync(self):
+        """Rebuilds the heap from the database."""
+        loop = asyncio.get_running_loop()
+        jobs: List[Job] = []
+        next_resync = loop.time() + settings.SCHEDULER_RESYNC_SECONDS
+        self._pushed_during_resync = []
+        try:
+            for shard in shard_engines:
+                found, horizon = await asyncio.to_thread(
+                    _upcoming, shard, settings.SCHEDULER_BATCH_SIZE
+                )
+                jobs += found
+                if horizon is not None:
+                    # Later deadlines were cut off: look again at the last one.
+                    wait = (horizon - datetime.utcnow()).total_seconds()
+                    wait = max(wait, MIN_RESYNC_SECONDS)
+                    next_resync = min(next_resync, loop.time() + wait)
+            jobs += self._pushed_during_resync
+        finally:
+            self._pushed_during_resync = None
+        heapq.heapify(jobs)
+        self._heap = jobs
+        self._next_resync = next_resync
+
+    async def run_due(self) -> int:
+        """Runs the jobs due now, at most SCHEDULER_BATCH_SIZE of them."""
+        now = datetime.utcnow()
+        due: List[Job] = []
+        while (
+            self._heap
+            and self._heap[0].when <= now
+            and len(due) < settings.SCHEDULER_BATCH_SIZE
+        ):
+            job = heapq.heappop(self._heap)
+            if not due or due[-1] != job:  # duplicates sort next to each other
+                due.append(job)
+        semaphore = asyncio.Semaphore(settings.SCHEDULER_CONCURRENCY)
+        retry: List[Job] = []
+
+        async def run(job: Job) -> bool:
+            try:
+                async with semaphore:
+                    return await asyncio.to_thread(run_job, job)
+            except HTTPException as e:
+                # 409 from versioning: lost every write race; 404: deleted.
+                if e.status_code != 404:
+                    retry.append(job._replace(when=now + RETRY_DELAY))
+            except Exception:
+                logger.exception(f"Scheduler job failed: {job}")
+                retry.append(job._replace(when=now + RETRY_DELAY))
+            return False
+
+        done = sum(await asyncio.gather(*(run(job) for job in due)))
+        for job in retry:
+            heapq.heappush(self._heap, job)
+        return done
+
+    def _seconds_until_next(self) -> float:
+        wait = self._next_resync - self._loop.time()
+        if self._heap:
+            until_due = (self._heap[0].when - datetime.utcnow()).total_seconds()
+            wait = min(wait, until_due)
+        return max(wait, 0.0)
+
+    async def run(self):
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        while True:
+            try:
+                if self._loop.time() >= self._next_resync:
+                    await self.resync()
+                await self.run_due()
+            except Exception:
+                logger.exception("Scheduler pass failed")
+                self._next_resync = (
+                    self._loop.time() + settings.SCHEDULER_RESYNC_SECONDS
+                )
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self._seconds_until_next())
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+    def start(self):
+        if not settings.SCHEDULER_ENABLED:
+            return
+        self._task = asyncio.create_task(self.run())
+        logger.info("Dispatch scheduler started")
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        self._loop = None
+        self._heap = []
+        self._next_resync = 0.0
+
+
+scheduler = DispatchScheduler()
+
+
+# --- Deadlines set by this worker's commits go straight onto the heap ---
+
+
+def track(session: Session, dispatch: models.Dispatch):
+    """Pushes the dispatch's deadlines to the scheduler when `session` commits."""
+    session.info.setdefault(_TRACKED_KEY, {})[id(dispatch)] = dispatch
+
+
+@event.listens_for(Session, "before_commit")
+def _collect_tracked_jobs(session):
+    tracked: Dict[int, models.Dispatch] = session.info.pop(_TRACKED_KEY, None)
+    if not tracked:
+        return
+    session.flush()
+    shard = session_shard(session)
+    jobs = [job for d in tracked.values() for job in jobs_for(d, shard)]
+    if jobs:
+        session.info[_JOBS_KEY] = jobs
+
+
+@event.listens_for(Session, "after_commit")
+def _push_tracked_jobs(session):
+    jobs = session.info.pop(_JOBS_KEY, None)
+    if jobs:
+        scheduler.push(jobs)
+
+
+@event.listens_for(Session, "after_soft_rollback")
+def _discard_tracked_jobs(session, previous_transaction):
+    session.info.pop(_TRACKED_KEY, None)
+    session.info.pop(_JOBS_KEY, None)
@@ -1,10 +1,19 @@
-from datetime import datetime
+from datetime import datetime, timezone
 from enum import Enum
-from typing import List, Optional, Generic, TypeVar
+from typing import Dict, List, Optional, Generic, TypeVar
+from pydantic import field_validator
 from sqlmodel import SQLModel
 from .models import DispatchStatus, DispatchFile, DispatchHistory, Comment
 
 
+# --- User Schemas ---
+class UserSummary(SQLModel):
+    id: int
+    full_name: str
+    user_type: str
+    department: Optional[str] = None
+
+
 # --- Shelf Schemas ---
 class ShelfCreate(SQLModel):
     name: str
@@ -27,6 +36,35 @@ class ShelfReadWithChildren(ShelfRead):
     children: List["ShelfReadWithChildren"] = []
 
 
+class ShelfBulkDispatches(SQLModel):
+    dispatch_ids: List[int]
+
+
+class ShelfBulkMove(ShelfBulkDispatches):
+    target_shelf_id: int
+
+
+class ShelfBulkOutcome(str, Enum):
+    ADDED = "added"
+    REMOVED = "removed"
+    MOVED = "moved"
+    ALREADY_PRESENT = "already_present"
+    NOT_PRESENT = "not_present"
+    NOT_FOUND = "not_found"
+    FORBIDDEN = "forbidden"
+
+
+class ShelfBulkItem(SQLModel):
+    dispatch_id: int
+    outcome: ShelfBulkOutcome
+
+
+class ShelfBulkResult(SQLModel):
+    shelf_id: int
+    results: List[ShelfBulkItem]
+    counts: Dict[ShelfBulkOutcome, int]
+
+
 # --- Dispatch Schemas ---
 class DispatchCore(SQLModel):
     title: str
@@ -39,12 +77,27 @@ class DispatchBase(DispatchCore):
     creator_id: int
 
 
-class DispatchCreate(DispatchCore):
+class DispatchDeadlines(SQLModel):
+    # Send a DRAFT automatically at this time (see scheduler.py).
+    scheduled_at: Optional[datetime] = None
+    # Flag the dispatch as overdue if still open at this time.
+    due_at: Optional[datetime] = None
+
+    @field_validator("scheduled_at", "due_at")
+    @classmethod
+    def _as_naive_utc(cls, value: Optional[datetime]) -> Optional[datetime]:
+        # Stored timestamps are naive UTC, like `datetime.utcnow()`.
+        if value is not None and value.tzinfo is not None:
+            value = value.astimezone(timezone.utc).replace(tzinfo=None)
+        return value
+
+
+class DispatchCreate(DispatchCore, DispatchDeadlines):
     assignee_ids: List[int]
     files: List[str]
 
 
-class DispatchUpdate(SQLModel):
+class DispatchUpdate(DispatchDeadlines):
     title: Optional[str] = None
     content: Optional[str] = None
     assignee_ids: Optional[List[int]] = None
@@ -53,6 +106,15 @@ class DispatchUpdate(SQLModel):
 class DispatchRead(DispatchBase):
     id: int
     assignee_ids: List[int]
+    # Also sent as the ETag; pass it in If-Match to make writes conditional.
+    version: int = 1
+    scheduled_at: Optional[datetime] = None
+    due_at: Optional[datetime] = None
+    # When the dispatch was flagged overdue; cleared if `due_at` moves.
+    overdue_at: Optional[datetime] = None
+    archived: bool = False
+    # Set on admin listings that span several shards, where ids may repeat.
+    shard: Optional[str] = None
 
 
 class ShelfReadWithDispatches(ShelfReadWithChildren):
@@ -64,6 +126,8 @@ class DispatchReadWithDetails(DispatchRead):
     history: List[DispatchHistory] = []
     comments: List[Comment] = []
     shelves: List[ShelfRead] = []
+    # Only populated with `expand=users`
+    users: Optional[Dict[int, UserSummary]] = None
 
 
 class DispatchStatusUpdateEnum(str, Enum):
@@ -92,6 +156,13 @@ T = TypeVar("T")
 class PaginatedResponse(SQLModel, Generic[T]):
     total: int
     items: List[T]
+    # Only populated with `expand=users`
+    users: Optional[Dict[int, UserSummary]] = None
+
+
+class CursorPage(SQLModel, Generic[T]):
+    items: List[T]
+    next_cursor: Optional[int] = None
 
 
 class MyStats(SQLModel):
@@ -110,6 +181,8 @@ class SystemStats(SQLModel):
     status_counts: dict[DispatchStatus, int]
     top_creators: List[UserActivityStat]
     top_assignees: List[UserActivityStat]
+    # Only populated with `expand=users`
+    users: Optional[Dict[int, UserSummary]] = None
 
 
 # Rebuild models to resolve forward references
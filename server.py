@@ -0,0 +1,187 @@
+"""
+Pre-forking production server: python -m hpc_dispatch.server
+
+The master process imports the app once, applies the database schema, builds
+the OpenAPI document, binds the listening socket and then forks the workers, so workers neither race on
+schema creation nor pay the import cost again. Per-worker state (DB pool,
+HTTP client, caches, background tasks) is created after the fork. SIGTERM
+or SIGINT drains the workers gracefully.
+"""
+
+import argparse
+import logging
+import os
+import signal
+import socket
+import sys
+import time
+from typing import Dict
+
+logger = logging.getLogger("hpc_dispatch.server")
+
+
+def _bind(host: str, port: int) -> socket.socket:
+    sock = socket.socket(socket.AF_INET6 if ":" in host else socket.AF_INET)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+    return sock
+
+
+def _run_worker(sock: socket.socket, index: int, app, graceful_timeout: int):
+    """Runs in the forked child; never returns."""
+    import uvicorn
+
+    from . import access, ratelimit, users
+    from .config import settings
+    from .database import dispose_engines
+
+    for sig in (signal.SIGTERM, signal.SIGINT, signal.SIGCHLD):
+        signal.signal(sig, signal.SIG_DFL)
+
+    # Connections must never be shared across processes; drop the pool
+    # inherited from the master without closing its sockets.
+    dispose_engines(close=False)
+    users.directory.clear()
+    access.cache.clear()
+    ratelimit.reset()
+    # The master already applied the schema.
+    settings.SCHEMA_SETUP_ON_STARTUP = False
+    # In-process background jobs run in the first worker only.
+    if index != 0:
+        settings.ARCHIVE_INTERVAL_SECONDS = 0
+        settings.OUTBOX_RELAY_IN_PROCESS = False
+        settings.FILE_METADATA_REFRESH_INTERVAL_SECONDS = 0
+
+    config = uvicorn.Config(
+        app,
+        lifespan="on",
+        timeout_graceful_shutdown=graceful_timeout,
+        log_config=None,
+    )
+    server = uvicorn.Server(config)
+    try:
+        server.run(sockets=[sock])
+    finally:
+        os._exit(0)
+
+
+def main(argv=None) -> int:
+    from .config import settings
+
+    parser = argparse.ArgumentParser(prog="python -m hpc_dispatch.server")
+    parser.add_argument("--host", default=settings.SERVER_HOST)
+    parser.add_argument("--port", type=int, default=settings.SERVER_PORT)
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=settings.SERVER_WORKERS or os.cpu_count() or 1,
+        help="Worker processes (default: one per CPU core)",
+    )
+    parser.add_argument(
+        "--graceful-timeout",
+        type=int,
+        default=settings.SERVER_GRACEFUL_TIMEOUT_SECONDS,
+        help="Seconds to let in-flight requests finish on shutdown",
+    )
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+
+    timings: Dict[str, float] = {}
+    started = time.perf_counter()
+
+    # Preload: everything imported here is shared copy-on-write by workers.
+    from . import archive
+    from .database import create_db_and_tables, dispose_engines, ssl_context
+    from .main import app
+
+    timings["import_app"] = time.perf_counter() - started
+
+    phase = time.perf_counter()
+    create_db_and_tables()
+    archive.create_archive_tables()
+    dispose_engines()
+    timings["schema"] = time.perf_counter() - phase
+
+    # Built once here and inherited by every worker: the OpenAPI document
+    # (otherwise built on each worker's first /docs request) and the TLS
+    # context of the user-service client.
+    phase = time.perf_counter()
+    app.openapi()
+    ssl_context()
+    timings["openapi_tls"] = time.perf_counter() - phase
+
+    phase = time.perf_counter()
+    sock = _bind(args.host, args.port)
+    timings["bind"] = time.perf_counter() - phase
+
+    workers: Dict[int, int] = {}  # pid -> worker index
+    shutting_down = False
+
+    def spawn(index: int):
+        pid = os.fork()
+        if pid == 0:
+            _run_worker(sock, index, app, args.graceful_timeout)
+        workers[pid] = index
+
+    phase = time.perf_counter()
+    for index in range(args.workers):
+        spawn(index)
+    timings["fork_workers"] = time.perf_counter() - phase
+
+    logger.info(
+        f"Master {os.getpid()} serving on {args.host}:{args.port} with "
+        f"{args.workers} workers. Cold start: "
+        + ", ".join(
+            f"{name} {seconds * 1000:.0f} ms" for name, seconds in timings.items()
+        )
+        + f", total {(time.perf_counter() - started) * 1000:.0f} ms"
+    )
+
+    def request_shutdown(signum, frame):
+        nonlocal shutting_down
+        if shutting_down:
+            return
+        shutting_down = True
+        logger.info(f"Received {signal.Signals(signum).name}, draining workers...")
+        for pid in workers:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, request_shutdown)
+    signal.signal(signal.SIGINT, request_shutdown)
+
+    deadline = None
+    while workers:
+        try:
+            pid, status = os.waitpid(-1, os.WNOHANG)
+        except ChildProcessError:
+            break
+        if pid:
+            index = workers.pop(pid)
+            if not shutting_down:
+                logger.warning(
+                    f"Worker {index} (pid {pid}) exited with status {status}; "
+                    "restarting"
+                )
+                spawn(index)
+            continue
+        if shutting_down:
+            deadline = deadline or time.monotonic() + args.graceful_timeout + 5
+            if time.monotonic() > deadline:
+                logger.warning(f"Killing {len(workers)} workers after timeout")
+                for pid in workers:
+                    os.kill(pid, signal.SIGKILL)
+                deadline = float("inf")
+        time.sleep(0.2)
+
+    sock.close()
+    logger.info("All workers stopped.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,158 @@
+"""
+Startup profile: python -m hpc_dispatch.startup [--json] [--top N]
+
+Starts the application in a fresh interpreter under `python -X importtime`
+and reports how cold-start time splits between module imports (self and
+cumulative time per module, totals per top-level package) and the
+initialization phases: schema check, OpenAPI generation and lifespan
+startup.
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+from typing import Dict, List, Optional
+
+PACKAGE_PARENT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _probe():
+    """Runs inside the profiled interpreter; prints phase timings as JSON."""
+    import asyncio
+
+    phases: Dict[str, float] = {}
+    started = time.perf_counter()
+    from .main import app
+
+    phases["import_app"] = time.perf_counter() - started
+
+    from . import archive
+    from .config import settings
+    from .database import create_db_and_tables
+
+    phase = time.perf_counter()
+    create_db_and_tables()
+    archive.create_archive_tables()
+    phases["schema"] = time.perf_counter() - phase
+
+    phase = time.perf_counter()
+    app.openapi()
+    phases["openapi"] = time.perf_counter() - phase
+
+    async def lifespan_startup():
+        nonlocal phase
+        phase = time.perf_counter()
+        async with app.router.lifespan_context(app):
+            phases["lifespan"] = time.perf_counter() - phase
+
+    settings.SCHEMA_SETUP_ON_STARTUP = False  # measured above
+    asyncio.run(lifespan_startup())
+    print(json.dumps({name: seconds * 1000 for name, seconds in phases.items()}))
+
+
+def _parse_importtime(stderr: str) -> List[dict]:
+    modules = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line.removeprefix("import time:").split("|")
+        modules.append(
+            {
+                "name": name.strip(),
+                "self_ms": int(self_us) / 1000,
+                "cumulative_ms": int(cumulative_us) / 1000,
+            }
+        )
+    return modules
+
+
+def profile_startup(env: Optional[Dict[str, str]] = None, top: int = 20) -> dict:
+    """Profiles one cold start in a subprocess. `env` overrides os.environ."""
+    child_env = dict(os.environ, **(env or {}))
+    child_env["PYTHONPATH"] = os.pathsep.join(
+        p for p in (PACKAGE_PARENT, child_env.get("PYTHONPATH")) if p
+    )
+    package = os.path.basename(os.path.dirname(os.path.abspath(__file__)))
+    started = time.perf_counter()
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-m", f"{package}.startup", "--probe"],
+        env=child_env,
+        capture_output=True,
+        text=True,
+    )
+    wall_ms = (time.perf_counter() - started) * 1000
+    if proc.returncode != 0:
+        raise RuntimeError(f"Startup probe failed:\n{proc.stderr[-2000:]}")
+
+    modules = _parse_importtime(proc.stderr)
+    packages: Dict[str, float] = {}
+    for module in modules:
+        root = module["name"].split(".")[0]
+        packages[root] = packages.get(root, 0.0) + module["self_ms"]
+    own = [m for m in modules if m["name"].split(".")[0] == package]
+    return {
+        "wall_ms": round(wall_ms, 1),
+        "phases_ms": {
+            name: round(ms, 1)
+            for name, ms in json.loads(proc.stdout.splitlines()[-1]).items()
+        },
+        "imports_ms": round(sum(m["self_ms"] for m in modules), 1),
+        "packages_ms": {
+            name: round(ms, 1)
+            for name, ms in sorted(packages.items(), key=lambda kv: -kv[1])[:top]
+        },
+        "slowest_modules": sorted(modules, key=lambda m: -m["self_ms"])[:top],
+        "app_modules": sorted(own, key=lambda m: -m["self_ms"]),
+    }
+
+
+def median_profile(repeats: int, env: Optional[Dict[str, str]] = None) -> dict:
+    """Median wall and phase times over `repeats` cold starts."""
+    runs = [profile_startup(env) for _ in range(repeats)]
+    return {
+        "repeats": repeats,
+        "wall_ms": round(statistics.median(r["wall_ms"] for r in runs), 1),
+        "phases_ms": {
+            name: round(statistics.median(r["phases_ms"][name] for r in runs), 1)
+            for name in runs[0]["phases_ms"]
+        },
+    }
+
+
+def print_report(profile: dict):
+    print(f"Cold start: {profile['wall_ms']:.0f} ms wall-clock (incl. interpreter)")
+    print("\nPhases:")
+    for name, ms in profile["phases_ms"].items():
+        print(f"  {name:<20} {ms:>8.1f} ms")
+    print(f"\nImports by package (self time, total {profile['imports_ms']:.0f} ms):")
+    for name, ms in profile["packages_ms"].items():
+        print(f"  {name:<20} {ms:>8.1f} ms")
+    for title, modules in (
+        ("Slowest modules", profile["slowest_modules"]),
+        ("Application modules", profile["app_modules"]),
+    ):
+        print(f"\n{title} (self / cumulative):")
+        for m in modules:
+            print(
+                f"  {m['name']:<48} {m['self_ms']:>8.1f} / {m['cumulative_ms']:.1f} ms"
+            )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog="python -m hpc_dispatch.startup")
+    parser.add_argument("--json", action="store_true", help="Print the raw profile")
+    parser.add_argument("--top", type=int, default=20)
+    parser.add_argument("--probe", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.probe:
+        _probe()
+        sys.exit(0)
+    result = profile_startup(top=args.top)
+    if args.json:
+        print(json.dumps(result, indent=2))
+    else:
+        print_report(result)
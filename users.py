@@ -0,0 +1,200 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import anyio
+import httpx
+from fastapi import Depends
+from fastapi.security import HTTPAuthorizationCredentials
+
+from . import models, schemas
+from .auth import MOCK_USERS, http_bearer_scheme
+from .config import settings
+from .database import get_http_client
+
+logger = logging.getLogger(__name__)
+
+# user_id -> (profile or None when the user service does not know the id,
+# monotonic time the entry was fetched)
+CacheEntry = Tuple[Optional[schemas.UserSummary], float]
+
+
+class UserDirectory:
+    """
+    Resolves user IDs to profiles in batches, with a bounded TTL cache.
+
+    Concurrent lookups of the same ID share one upstream request. Entries
+    past their TTL but within the stale window are served immediately while
+    a background refresh runs, so a slow user service does not slow down
+    responses. All methods run on the event loop; no locking is needed.
+    """
+
+    def __init__(self):
+        self._cache: "OrderedDict[int, CacheEntry]" = OrderedDict()
+        self._inflight: Dict[int, asyncio.Task] = {}
+
+    def clear(self):
+        self._cache.clear()
+
+    async def resolve(
+        self, ids: Iterable[int], client: httpx.AsyncClient, token: str
+    ) -> Dict[int, schemas.UserSummary]:
+        result = await self.lookup(
+            ids, client, token, settings.USER_LOOKUP_TIMEOUT_SECONDS
+        )
+        return {uid: user for uid, user in result.items() if user is not None}
+
+    async def lookup(
+        self,
+        ids: Iterable[int],
+        client: httpx.AsyncClient,
+        token: str,
+        timeout: Optional[float] = None,
+    ) -> Dict[int, Optional[schemas.UserSummary]]:
+        """
+        Profiles by ID, None for IDs the user service does not know. IDs whose
+        lookup failed, or did not finish within `timeout`, are left out.
+        """
+        now = time.monotonic()
+        ttl = settings.USER_CACHE_TTL_SECONDS
+        stale_window = settings.USER_CACHE_STALE_SECONDS
+        result: Dict[int, Optional[schemas.UserSummary]] = {}
+        waiting: Dict[int, asyncio.Task] = {}
+        missing: List[int] = []
+        refresh: List[int] = []
+
+        for user_id in set(ids):
+            entry = self._cache.get(user_id)
+            age = now - entry[1] if entry else None
+            if entry and age < ttl:
+                result[user_id] = entry[0]
+                continue
+            if entry and age < ttl + stale_window:
+                result[user_id] = entry[0]
+                if user_id not in self._inflight:
+                    refresh.append(user_id)
+                continue
+            if user_id in self._inflight:
+                waiting[user_id] = self._inflight[user_id]
+            else:
+                missing.append(user_id)
+
+        if refresh:
+            self._start_fetch(refresh, client, token)
+        if missing:
+            task = self._start_fetch(missing, client, token)
+            waiting.update({user_id: task for user_id in missing})
+        if waiting:
+            # Whatever is not back within the timeout is left out; the fetch
+            # keeps running and fills the cache for the next request.
+            await asyncio.wait(set(waiting.values()), timeout=timeout)
+            for user_id, task in waiting.items():
+                if task.done() and not task.cancelled() and not task.exception():
+                    profiles = task.result()
+                    if user_id in profiles:  # not there when the fetch failed
+                        result[user_id] = profiles[user_id]
+
+        return result
+
+    def _start_fetch(
+        self, ids: List[int], client: httpx.AsyncClient, token: str
+    ) -> asyncio.Task:
+        task = asyncio.create_task(self._fetch(ids, client, token))
+        for user_id in ids:
+            self._inflight[user_id] = task
+        return task
+
+    async def _fetch(
+        self, ids: List[int], client: httpx.AsyncClient, token: str
+    ) -> Dict[int, Optional[schemas.UserSummary]]:
+        try:
+            if settings.MOCK_AUTH_ENABLED:
+                known = {u.id: u for u in MOCK_USERS.values()}
+                found = {
+                    uid: schemas.UserSummary.model_validate(known[uid])
+                    for uid in ids
+                    if uid in known
+                }
+            else:
+                found = {}
+                batch_size = settings.USER_LOOKUP_BATCH_SIZE
+                for start in range(0, len(ids), batch_size):
+                    found.update(
+                        await self._fetch_batch(
+                            ids[start : start + batch_size], client, token
+                        )
+                    )
+            # IDs the user service does not know are cached as None too, so
+            # they are not looked up again on every request.
+            profiles = {uid: found.get(uid) for uid in ids}
+            fetched_at = time.monotonic()
+            for user_id, profile in profiles.items():
+                self._cache[user_id] = (profile, fetched_at)
+                self._cache.move_to_end(user_id)
+            while len(self._cache) > settings.USER_CACHE_MAX_SIZE:
+                self._cache.popitem(last=False)
+            return profiles
+        except Exception as e:
+            logger.warning(f"User lookup for {len(ids)} ids failed: {e}")
+            return {}
+        finally:
+            for user_id in ids:
+                self._inflight.pop(user_id, None)
+
+    async def _fetch_batch(
+        self, ids: List[int], client: httpx.AsyncClient, token: str
+    ) -> Dict[int, schemas.UserSummary]:
+        response = await client.get(
+            f"{settings.HPC_USER_SERVICE_URL}{settings.HPC_USER_SERVICE_BATCH_PATH}",
+            params={"ids": ",".join(str(i) for i in ids)},
+            headers={"Authorization": f"Bearer {token}"},
+            timeout=settings.USER_LOOKUP_TIMEOUT_SECONDS * 4,
+        )
+        response.raise_for_status()
+        users = response.json().get("data") or []
+        return {u["id"]: schemas.UserSummary.model_validate(u) for u in users}
+
+
+directory = UserDirectory()
+
+
+class UserResolver:
+    """Per-request handle on the shared directory, usable from sync handlers."""
+
+    def __init__(self, client: httpx.AsyncClient, token: str):
+        self.client = client
+        self.token = token
+
+    def resolve(self, ids: Iterable[int]) -> Dict[int, schemas.UserSummary]:
+        # Sync endpoints run in the threadpool; hop back onto the event loop,
+        # where the directory's cache and in-flight lookups live.
+        return anyio.from_thread.run(
+            directory.resolve, list(ids), self.client, self.token
+        )
+
+    def lookup(self, ids: Iterable[int]) -> Dict[int, Optional[schemas.UserSummary]]:
+        """`UserDirectory.lookup`, waiting for the user service (sync handlers)."""
+        return anyio.from_thread.run(
+            directory.lookup, list(ids), self.client, self.token
+        )
+
+
+async def get_user_resolver(
+    creds: HTTPAuthorizationCredentials = Depends(http_bearer_scheme),
+    client: httpx.AsyncClient = Depends(get_http_client),
+) -> UserResolver:
+    """Dependency providing batched user-profile resolution (`expand=users`)."""
+    return UserResolver(client, creds.credentials)
+
+
+def dispatch_user_ids(dispatch: schemas.DispatchRead) -> List[int]:
+    """All user IDs referenced by a dispatch read model."""
+    ids = [dispatch.creator_id, *dispatch.assignee_ids]
+    if isinstance(dispatch, schemas.DispatchReadWithDetails):
+        ids += [
+            h.actor_id for h in dispatch.history if h.actor_id != models.SYSTEM_ACTOR_ID
+        ]
+        ids += [c.user_id for c in dispatch.comments]
+    return ids
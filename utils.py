@@ -1,3 +1,5 @@
+from typing import List, Optional, Tuple
+
 from . import models, schemas
 
 
@@ -11,6 +13,10 @@ def convert_dispatch_to_read_model(dispatch: models.Dispatch) -> schemas.Dispatc
         created_at=dispatch.created_at,
         creator_id=dispatch.creator_id,
         assignee_ids=[link.assignee_id for link in dispatch.assignee_links],
+        version=dispatch.version,
+        scheduled_at=dispatch.scheduled_at,
+        due_at=dispatch.due_at,
+        overdue_at=dispatch.overdue_at,
     )
 
 
@@ -28,9 +34,52 @@ def convert_dispatch_to_detailed_read_model(
         created_at=dispatch.created_at,
         creator_id=dispatch.creator_id,
         assignee_ids=[link.assignee_id for link in dispatch.assignee_links],
+        version=dispatch.version,
+        scheduled_at=dispatch.scheduled_at,
+        due_at=dispatch.due_at,
+        overdue_at=dispatch.overdue_at,
         files=dispatch.files,
         history=dispatch.history,
         comments=dispatch.comments,
         # Convert each shelf model to a shelf read schema
         shelves=[schemas.ShelfRead.model_validate(s) for s in dispatch.shelves],
     )
+
+
+def merge_sorted_pages(
+    live: List[schemas.DispatchRead],
+    archived: List[schemas.DispatchRead],
+    sort_by: str,
+    sort_dir: str,
+    skip: int,
+    limit: int,
+) -> List[schemas.DispatchRead]:
+    """
+    Merges the first `skip + limit` live and archived items (each already in
+    the requested order) and returns the requested page.
+    """
+    merged = sorted(
+        live + archived,
+        key=lambda d: getattr(d, sort_by, d.created_at),
+        reverse=sort_dir == "desc",
+    )
+    return merged[skip : skip + limit]
+
+
+def keyset_page(
+    session, statement, id_column, cursor: Optional[int], limit: int, order: str
+) -> Tuple[list, Optional[int]]:
+    """
+    Applies cursor pagination on a monotonically increasing id column.
+    Returns the page and the cursor for the next one (None on the last page).
+    """
+    if cursor is not None:
+        statement = statement.where(
+            id_column < cursor if order == "desc" else id_column > cursor
+        )
+    statement = statement.order_by(
+        id_column.desc() if order == "desc" else id_column.asc()
+    )
+    items = session.exec(statement.limit(limit + 1)).all()
+    next_cursor = items[limit - 1].id if len(items) > limit else None
+    return items[:limit], next_cursor
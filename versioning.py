@@ -0,0 +1,124 @@
+"""
+Optimistic concurrency for dispatch writes.
+
+Every dispatch carries a `version`, exposed as its ETag. A write claims the
+dispatch by bumping the version with `UPDATE ... WHERE version = <version
+read>`; when another transaction got there first the claim matches no row.
+A request that sent `If-Match` then gets 412. One that did not is re-run,
+this time bumping the version *before* reading: the UPDATE waits for the
+row lock, so the retry sees the winner's changes and cannot lose again.
+Uncontended writes never wait for a lock.
+"""
+
+import logging
+from typing import Callable, Optional, Set
+
+from fastapi import HTTPException, status
+from sqlalchemy import exc, update
+from sqlalchemy.orm.attributes import set_committed_value
+from sqlmodel import Session
+
+from . import models
+from .config import settings
+
+logger = logging.getLogger(__name__)
+
+dispatches = models.Dispatch.__table__
+
+
+class VersionConflict(Exception):
+    pass
+
+
+def etag(version: int) -> str:
+    return f'"{version}"'
+
+
+def parse_if_match(value: Optional[str]) -> Optional[Set[int]]:
+    """Versions accepted by an If-Match header; None means any (absent or *)."""
+    if value is None or value.strip() == "*":
+        return None
+    versions = set()
+    for tag in value.split(","):
+        tag = tag.strip().removeprefix("W/").strip('"')
+        if tag.isdigit():
+            versions.add(int(tag))
+    return versions
+
+
+def claim(session: Session, dispatch: models.Dispatch):
+    """Bumps the version, or raises VersionConflict if it changed since read."""
+    result = session.execute(
+        update(dispatches)
+        .where(dispatches.c.id == dispatch.id, dispatches.c.version == dispatch.version)
+        .values(version=dispatches.c.version + 1)
+    )
+    if result.rowcount != 1:
+        raise VersionConflict()
+    # Already written; keep the ORM from writing it again.
+    set_committed_value(dispatch, "version", dispatch.version + 1)
+
+
+def _lock(session: Session, dispatch_id: int) -> bool:
+    """Bumps the version unconditionally, taking the row lock first."""
+    result = session.execute(
+        update(dispatches)
+        .where(dispatches.c.id == dispatch_id)
+        .values(version=dispatches.c.version + 1)
+    )
+    return result.rowcount == 1
+
+
+def write_dispatch(
+    session: Session,
+    dispatch_id: int,
+    if_match: Optional[str],
+    apply: Callable[[models.Dispatch], bool],
+) -> models.Dispatch:
+    """
+    Loads the dispatch, lets `apply` check permissions and mutate it, then
+    claims it and commits. `apply` returns False when there is nothing to
+    write. After a conflict `apply` is re-run under the row lock, unless the
+    client pinned a version with If-Match.
+    """
+    expected = parse_if_match(if_match)
+    for attempt in range(1, settings.DISPATCH_WRITE_RETRIES + 1):
+        locked = attempt > 1 and _lock(session, dispatch_id)
+        dispatch = session.get(models.Dispatch, dispatch_id)
+        if not dispatch:
+            raise HTTPException(status_code=404, detail="Dispatch not found")
+        if expected is not None and dispatch.version not in expected:
+            _precondition_failed(dispatch.version)
+        try:
+            if not apply(dispatch):
+                session.rollback()  # releases the lock, if taken
+                return dispatch
+            if not locked:
+                claim(session, dispatch)
+            session.commit()
+        except (VersionConflict, exc.IntegrityError):
+            session.rollback()
+            if expected is not None:
+                current = session.get(models.Dispatch, dispatch_id)
+                _precondition_failed(current.version if current else None)
+            logger.info(f"Write conflict on dispatch {dispatch_id}, attempt {attempt}")
+            continue
+        except Exception:
+            session.rollback()
+            raise
+        session.refresh(dispatch)
+        return dispatch
+    raise HTTPException(
+        status_code=status.HTTP_409_CONFLICT,
+        detail="The dispatch is being modified concurrently; retry the request.",
+        headers={"Retry-After": "1"},
+    )
+
+
+def _precondition_failed(current_version: Optional[int]):
+    headers = {"ETag": etag(current_version)} if current_version else None
+    raise HTTPException(
+        status_code=status.HTTP_412_PRECONDITION_FAILED,
+        detail="The dispatch was modified since it was read; reload it and retry.",
+        headers=headers,
+    )